@@ -3,14 +3,22 @@ import sys
 import discord
 import requests
 import asyncio
-import datetime
+import collections
+import contextlib
+import hashlib
+import io
 import json
+import logging
 import structlog
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from itertools import takewhile
 from PIL import Image
-from typing import Any, Callable, Iterable, NotRequired, TypeVar, TypedDict, Unpack
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from typing import Any, AsyncIterator, Callable, Iterable, NotRequired, TypeVar, TypedDict, Unpack
 
 # Someone not in the role assigner role tried to assign/unassign a role
 class NotRoleAssigner(Exception):
@@ -70,6 +78,8 @@ energy_to_discord_map: dict[str, str] = {}
 
 load_dotenv()
 
+load_testing = '--load-test' in sys.argv
+
 if '--fake-discord' in sys.argv:
     class Client:
         class User:
@@ -82,12 +92,20 @@ if '--fake-discord' in sys.argv:
                 self.name = 'fake discord guild'
                 self.emojis: tuple[discord.Emoji, ...] = ()
 
-        class Channel:
+        # relay_game only sends to Messageables
+        class Channel(discord.abc.Messageable):
             def __init__(self, id: int) -> None:
                 self.id = id
 
-            async def send(self, msg: str, file: discord.File | None = None) -> None:
-                if file:
+            async def _get_channel(self) -> Any:
+                return self
+
+            async def send(self, msg: str, file: discord.File | None = None) -> None: #type: ignore[override]
+                # Pretend to take as long as Discord would (FAKE_DISCORD_SEND_SECONDS), for the relay metrics.
+                await asyncio.sleep(float(os.getenv('FAKE_DISCORD_SEND_SECONDS', 0)))
+                if load_testing:
+                    pass
+                elif file:
                     print(f"send {self.id}: {msg} file: {file.filename}")
                 else:
                     print(f"send {self.id}: {msg}")
@@ -107,7 +125,7 @@ if '--fake-discord' in sys.argv:
                 while True:
                     await asyncio.sleep(60)
             print(f"fake client (key has {len(key)} characters)")
-            asyncio.run(fakebot())
+            asyncio.run(load_test() if load_testing else fakebot())
 
         async def wait_until_ready(self) -> None:
             pass
@@ -139,11 +157,24 @@ ROLE_ASSIGNER_ADMIN_ROLE = int(os.getenv('DISCORD_ROLE_ASSIGNER_ADMIN_ROLE', 925
 ROLE_CREATOR_ROLE = int(os.getenv('DISCORD_ROLE_CREATOR_ROLE', 925206661528948736))
 GAME_URL = os.getenv('GAME_URL', 'si.bitcrafter.net')
 GUILD_ID = int(os.getenv('DISCORD_GUILD_ID', 846580409050857493))
+# Where the relay metrics (see below) are served, on localhost only. 0 to not serve them.
+METRICS_PORT = int(os.getenv('BOT_METRICS_PORT', 9101))
+# How many sets of images can be combined at once (see combine_images), and how long to wait for each before giving up on it.
+IMAGE_WORKERS = int(os.getenv('BOT_IMAGE_WORKERS', 2))
+IMAGE_TIMEOUT = float(os.getenv('BOT_IMAGE_TIMEOUT', 30))
+# Where resized and combined images are kept (see cached_image), and how big that can get before the least recently used are deleted.
+IMAGE_CACHE_DIR = os.getenv('BOT_IMAGE_CACHE_DIR', 'image-cache')
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('BOT_IMAGE_CACHE_MAX_MB', 200)) * 1024 * 1024
+# When to send each channel's log messages (see ChannelRelay.flush_at), and how many to send at once (see RelayScheduler).
+RELAY_QUIET_SECONDS = float(os.getenv('BOT_RELAY_QUIET_SECONDS', 20))
+RELAY_TURN_END_SECONDS = float(os.getenv('BOT_RELAY_TURN_END_SECONDS', 2))
+RELAY_MAX_WAIT_SECONDS = float(os.getenv('BOT_RELAY_MAX_WAIT_SECONDS', 60))
+RELAY_CONCURRENCY = int(os.getenv('BOT_RELAY_CONCURRENCY', 8))
+RELAY_MAX_PENDING = int(os.getenv('BOT_RELAY_MAX_PENDING', 1000))
 
 match os.getenv('IPC_METHOD', 'redis'):
     case 'socket':
         import socket
-        import threading
         SOCKET_PATH = os.getenv('SOCKET_PATH', 'si.sock')
     case 'redis':
         # for type-checking, this code path is statically checked regardless of IPC_METHOD,
@@ -158,18 +189,127 @@ match os.getenv('IPC_METHOD', 'redis'):
 
 relay_task = None
 
-def combine_images(filenames: Iterable[str]) -> None:
-    images = []
-
-    for infile in filenames:
-        images.append(Image.open(infile).resize((300, 420)))
-
-    out = Image.new('RGB', (len(images)*300, 420))
-
-    for i, img in enumerate(images):
-        out.paste(img, (i*300, 0))
-
-    out.save('out.jpg')
+# How long log messages take to get from the site to Discord, for Prometheus.
+# Each message carries its id and when it was created (see send_log in pbf/views.py), and:
+# - waits until it's time to send its channel's messages (RELAY_QUEUE_WAIT, from when it was created; see ChannelRelay),
+# - has its images combined, if it has more than one (RELAY_IMAGE_PREP),
+# - is sent, on its own if it has images, otherwise together with the text messages around it (RELAY_SEND, per send),
+# for a total of RELAY_LATENCY from when it was created.
+RELAY_QUEUE_WAIT = Histogram('bot_relay_queue_wait_seconds', 'Time from a log message being created to the bot starting to send it',
+                             buckets=(1, 5, 10, 15, 20, 22, 25, 30, 45, 60, 120, 300, 600))
+RELAY_IMAGE_PREP = Histogram('bot_relay_image_prep_seconds', "Time preparing a log message's images")
+RELAY_SEND = Histogram('bot_relay_send_seconds', 'Time for each message sent to Discord')
+RELAY_LATENCY = Histogram('bot_relay_latency_seconds', 'Time from a log message being created to it being sent to Discord',
+                          buckets=(1, 5, 10, 15, 20, 22, 25, 30, 45, 60, 120, 300, 600))
+RELAY_BUFFERED_CHANNELS = Gauge('bot_relay_buffered_channels', 'Channels with log messages waiting to be sent')
+RELAY_PENDING_ENTRIES = Gauge('bot_relay_pending_entries', 'Log messages waiting to be sent')
+RELAY_FLUSHES = Counter('bot_relay_flushes', "Times a channel's log messages were sent, by why they were sent then", ['reason'])
+RELAY_RATE_LIMIT_WAITS = Counter('bot_relay_rate_limit_waits', "Sends that waited for a channel's rate limit")
+RELAY_INTAKE_WAITS = Counter('bot_relay_intake_waits', 'Times the bot stopped reading new log messages because too many were waiting')
+
+IMAGE_CACHE_REQUESTS = Counter('bot_image_cache_requests', 'Lookups in the image cache', ['kind', 'result'])
+IMAGE_CACHE_BYTES = Gauge('bot_image_cache_bytes', 'Size of the image cache')
+IMAGE_CACHE_EVICTIONS = Counter('bot_image_cache_evictions', 'Images deleted from the image cache to keep it under its maximum size')
+
+# The same cards get combined over and over (every draw of four minors, everyone picking the same cards...),
+# so we keep both each card resized to 300x420 (kind 'thumbnail') and each combination of them (kind 'strip')
+# as files in IMAGE_CACHE_DIR, named by a hash of the images they're made from.
+# That includes each image's modification time and size, so a replaced image isn't confused with the old one.
+#
+# Using a file bumps its modification time, and once the cache is bigger than IMAGE_CACHE_MAX_BYTES,
+# the files that were used longest ago are deleted.
+# The files are written whole and then renamed into place, so the threads combining images (see image_executor)
+# never see half of one.
+image_cache_lock = threading.Lock()
+# None until we first look at what's in IMAGE_CACHE_DIR (from before a restart)
+image_cache_bytes: int | None = None
+
+def image_cache_key(kind: str, filenames: Iterable[str]) -> str:
+    h = hashlib.sha256(kind.encode())
+    for filename in filenames:
+        stat = os.stat(filename)
+        h.update(f'\0{os.path.abspath(filename)}\0{stat.st_mtime_ns}\0{stat.st_size}'.encode())
+    return os.path.join(IMAGE_CACHE_DIR, f'{kind}-{h.hexdigest()}.jpg')
+
+def cached_image(kind: str, filenames: list[str], make: Callable[[], Image.Image], quality: int) -> bytes:
+    path = image_cache_key(kind, filenames)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)
+        IMAGE_CACHE_REQUESTS.labels(kind, 'hit').inc()
+        return data
+    except FileNotFoundError:
+        IMAGE_CACHE_REQUESTS.labels(kind, 'miss').inc()
+
+    buffer = io.BytesIO()
+    make().save(buffer, 'JPEG', quality=quality)
+    data = buffer.getvalue()
+    os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+    tmp = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+    added_to_image_cache(len(data))
+    return data
+
+def added_to_image_cache(size: int) -> None:
+    global image_cache_bytes
+    with image_cache_lock:
+        if image_cache_bytes is not None:
+            image_cache_bytes += size
+        if image_cache_bytes is None or image_cache_bytes > IMAGE_CACHE_MAX_BYTES:
+            # Total up what's actually there (two threads may have written the same file), and delete the oldest.
+            files = []
+            for entry in os.scandir(IMAGE_CACHE_DIR):
+                if entry.name.endswith('.jpg'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            files.sort()
+            image_cache_bytes = sum(size for (_, size, _) in files)
+            for (_, size, path) in files:
+                if image_cache_bytes <= IMAGE_CACHE_MAX_BYTES:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                image_cache_bytes -= size
+                IMAGE_CACHE_EVICTIONS.inc()
+        IMAGE_CACHE_BYTES.set(image_cache_bytes)
+
+def thumbnail(filename: str) -> Image.Image:
+    def make() -> Image.Image:
+        with Image.open(filename) as image:
+            return image.resize((300, 420)).convert('RGB')
+    # High quality, since it'll be compressed again once it's combined with others.
+    return Image.open(io.BytesIO(cached_image('thumbnail', [filename], make, quality=95)))
+
+# Combines the images side by side into a JPEG, which it returns rather than writing to a file,
+# so that several can be combined at once (see combine_images_async).
+def combine_images(filenames: list[str]) -> io.BytesIO:
+    def make() -> Image.Image:
+        images = [thumbnail(filename) for filename in filenames]
+
+        out = Image.new('RGB', (len(images)*300, 420))
+
+        for i, img in enumerate(images):
+            out.paste(img, (i*300, 0))
+        return out
+
+    return io.BytesIO(cached_image('strip', filenames, make, quality=75))
+
+# Combining images takes long enough that doing it on the event loop would hold up every other channel
+# (and the connection to Discord), so it's done on these threads instead,
+# which also limits how many are combined at once; any others wait their turn.
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='combine_images')
+
+# Raises TimeoutError if the images aren't combined within IMAGE_TIMEOUT (including waiting for a thread).
+# The thread carries on combining them regardless, since there's no stopping it, but nothing waits for it.
+async def combine_images_async(filenames: list[str]) -> io.BytesIO:
+    loop = asyncio.get_running_loop()
+    async with asyncio.timeout(IMAGE_TIMEOUT):
+        return await loop.run_in_executor(image_executor, combine_images, filenames)
 
 @client.event
 async def setup_hook() -> None:
@@ -761,36 +901,65 @@ def adjust_msg(msg: str) -> str:
 
 class GameLogEntry(TypedDict):
     text: str
-    images: str
-    spoiler: bool
-
-async def relay_game(channel_id: int, log: Iterable[GameLogEntry]) -> None:
+    images: NotRequired[str]
+    spoiler: NotRequired[bool]
+    # Sent by the site since relay metrics were added, so messages from before then (e.g. in the outbox) may not have them.
+    id: NotRequired[int]
+    created: NotRequired[float]
+
+SendSlot = Callable[[], contextlib.AbstractAsyncContextManager[None]]
+
+# Sends msg, which is made up of the given entries, and records how long that took.
+# The send happens within slot (see ChannelRelay.send_slot).
+async def send(slot: SendSlot, channel: discord.abc.Messageable, entries: list[GameLogEntry], msg: str, **kwargs: Any) -> None:
+    async with slot():
+        start = time.perf_counter()
+        await channel.send(msg, **kwargs)
+        RELAY_SEND.observe(time.perf_counter() - start)
+    now = time.time()
+    for entry in entries:
+        if 'created' in entry:
+            RELAY_LATENCY.observe(now - entry['created'])
+    LOG.msg('sent', channel_id=getattr(channel, 'id', None), log_ids=[entry.get('id') for entry in entries],
+            latency=[round(now - entry['created'], 3) for entry in entries if 'created' in entry])
+
+async def relay_game(channel_id: int, log: Iterable[GameLogEntry], slot: SendSlot) -> None:
     channel = client.get_channel(channel_id)
     if not isinstance(channel, discord.abc.Messageable):
         LOG.warn(f"channel {channel_id} is {type(channel).__name__}, not sendable")
         return
 
+    now = time.time()
+    for entry in log:
+        if 'created' in entry:
+            RELAY_QUEUE_WAIT.observe(now - entry['created'])
+
     combined_text: list[str] = []
+    # the entries that combined_text is made of
+    combined_entries: list[GameLogEntry] = []
     for entry in log:
         msg = adjust_msg(entry['text'])
         if 'images' in entry:
             if len(combined_text) > 0:
-                await channel.send('\n'.join(combined_text))
+                await send(slot, channel, combined_entries, '\n'.join(combined_text))
                 combined_text = []
+                combined_entries = []
             images = entry['images']
             filenames = images.split(',')
             try:
+                start = time.perf_counter()
+                spoiler = entry.get('spoiler', False)
                 if len(filenames) > 1:
-                    combine_images(filenames)
-                    file_to_send = 'out.jpg'
-                else:
-                    file_to_send = filenames[0]
-                if 'spoiler' in entry.keys():
-                    await channel.send(msg, file=discord.File(file_to_send, spoiler=entry['spoiler']))
+                    file = discord.File(await combine_images_async(filenames), filename='out.jpg', spoiler=spoiler)
                 else:
-                    await channel.send(msg, file=discord.File(file_to_send))
+                    file = discord.File(filenames[0], spoiler=spoiler)
+                RELAY_IMAGE_PREP.observe(time.perf_counter() - start)
+                await send(slot, channel, [entry], msg, file=file)
+            except TimeoutError:
+                LOG.warn('timed out combining images', channel_id=channel_id, images=images)
+                await send(slot, channel, [entry], msg + " (the images took too long to prepare)")
             except discord.Forbidden:
-                await channel.send(msg + "\nCouldn't send the image. Make sure I have permission to attach files.")
+                await send(slot, channel, [entry], msg + "\nCouldn't send the image. Make sure I have permission to attach files.")
             except FileNotFoundError:
                 # If the host uploads two screenshots to the same slot before a message has been sent,
                 # because we use django_cleanup, the first message's image will have been deleted by now.
@@ -798,42 +967,164 @@ async def relay_game(channel_id: int, log: Iterable[GameLogEntry]) -> None:
                 # TODO: After we've confirmed this is in fact what's happening
                 #       we can probably delete this message, and just pass here.
                 # Players probably don't need to be informed of this, so we can just pass.
-                await channel.send(msg + " (the image has since been deleted)")
+                await send(slot, channel, [entry], msg + " (the image has since been deleted)")
         else:
             combined_text.append(msg)
+            combined_entries.append(entry)
 
     if len(combined_text) > 0:
-        await channel.send('\n'.join(combined_text))
+        await send(slot, channel, combined_entries, '\n'.join(combined_text))
         combined_text = []
 
-class GameLogBufferEntry(TypedDict):
-    timestamp: datetime.datetime
-    logs: list[GameLogEntry]
-
-# Buffer up the log so we can send a group of related log messages together.
-game_log_buffer: dict[int, GameLogBufferEntry] = {}
-
-# We keep the last message sent to each channel,
-# which helped us drop duplicate messages when the bot had a bug that would send them.
-# This shouldn't be necessary now that we make sure to only create one relay_task,
-# but we'll keep it in case there are other causes of duplicate messages.
-last_message: dict[int, Any] = {}
-
-class SIDatagramProtocol(asyncio.DatagramProtocol):
-    def __init__(self, enqueue: Callable[[int, str, Callable[[str], GameLogEntry]], None]):
-        self.msgbuflock = threading.Lock()
-        self.enqueue = enqueue
-
-    def connection_made(self, transport: asyncio.BaseTransport) -> None:
-        self.transport = transport
+# Relaying log messages to Discord.
+#
+# Related log messages (a player's whole turn, say) are sent together, so each channel's are buffered until it's time to send them.
+# Each channel with messages waiting has its own ChannelRelay, which sends them (see flush_at for when)
+# without holding up any other channel: not while it waits, nor while it combines images or waits for Discord.
+#
+# Discord allows only so many messages per channel in a short time (CHANNEL_RATE_LIMIT), which each ChannelRelay keeps to,
+# and only RELAY_CONCURRENCY messages are sent at once in total.
+# (discord.py would also wait out the rate limits, but while holding one of those RELAY_CONCURRENCY places.)
+#
+# If RELAY_MAX_PENDING messages are waiting (Discord's down, say), we stop reading new ones until some are sent,
+# which leaves the rest in the socket or Redis in the meantime.
+
+# (messages, per seconds) for each channel
+CHANNEL_RATE_LIMIT = (5, 5.0)
+
+# A message that's unlikely to be followed by more for a while, so its channel's messages can be sent right away.
+FLUSH_SOON_PATTERN = re.compile(r'All spirits are ready!')
+
+class ChannelRelay:
+    def __init__(self, scheduler: 'RelayScheduler', channel_id: int):
+        self.scheduler = scheduler
+        self.channel_id = channel_id
+        self.logs: list[GameLogEntry] = []
+        # time.monotonic() of when the first and last of self.logs arrived
+        self.first_received = 0.0
+        self.last_received = 0.0
+        self.flush_soon = False
+        self.wake = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    def add(self, entry: GameLogEntry) -> None:
+        now = time.monotonic()
+        if not self.logs:
+            self.first_received = now
+        self.last_received = now
+        self.logs.append(entry)
+        if FLUSH_SOON_PATTERN.search(entry['text']):
+            self.flush_soon = True
+        self.wake.set()
+
+    # When to send what's in self.logs, and why then:
+    # - once there have been no new messages for RELAY_QUIET_SECONDS,
+    # - RELAY_TURN_END_SECONDS after a message matching FLUSH_SOON_PATTERN, in case anything else was sent along with it,
+    # - or once the first has waited RELAY_MAX_WAIT_SECONDS, so a busy channel still gets its messages.
+    def flush_at(self) -> tuple[float, str]:
+        times = [(self.last_received + RELAY_QUIET_SECONDS, 'quiet'), (self.first_received + RELAY_MAX_WAIT_SECONDS, 'max_wait')]
+        if self.flush_soon:
+            times.append((self.last_received + RELAY_TURN_END_SECONDS, 'turn_end'))
+        return min(times)
+
+    async def run(self) -> None:
+        try:
+            while self.logs:
+                (at, reason) = self.flush_at()
+                if (delay := at - time.monotonic()) > 0:
+                    self.wake.clear()
+                    try:
+                        async with asyncio.timeout(delay):
+                            await self.wake.wait()
+                    except TimeoutError:
+                        pass
+                    continue
+
+                logs = self.logs
+                self.logs = []
+                self.flush_soon = False
+                RELAY_FLUSHES.labels(reason).inc()
+                LOG.msg('sending', channel_id=self.channel_id, reason=reason, entries=len(logs))
+                try:
+                    await relay_game(self.channel_id, logs, self.send_slot)
+                except Exception as ex:
+                    LOG.exception(ex)
+                finally:
+                    self.scheduler.sent(len(logs))
+        finally:
+            del self.scheduler.channels[self.channel_id]
+
+    # Waits until sending another message keeps to the channel's rate limit, then for one of the RELAY_CONCURRENCY places.
+    @contextlib.asynccontextmanager
+    async def send_slot(self) -> AsyncIterator[None]:
+        (limit, seconds) = CHANNEL_RATE_LIMIT
+        sent = self.scheduler.sent_at.setdefault(self.channel_id, collections.deque(maxlen=limit))
+        if len(sent) == limit and (wait := sent[0] + seconds - time.monotonic()) > 0:
+            RELAY_RATE_LIMIT_WAITS.inc()
+            await asyncio.sleep(wait)
+        async with self.scheduler.sending:
+            try:
+                yield
+            finally:
+                sent.append(time.monotonic())
+
+class RelayScheduler:
+    def __init__(self) -> None:
+        self.channels: dict[int, ChannelRelay] = {}
+        self.sending = asyncio.Semaphore(RELAY_CONCURRENCY)
+        # when the last few messages were sent to each channel (see ChannelRelay.send_slot),
+        # kept after its ChannelRelay is done, since its next one still has to keep to the rate limit
+        self.sent_at: dict[int, collections.deque[float]] = {}
+        # messages received but not yet sent
+        self.pending = 0
+        self.has_room = asyncio.Event()
+        self.has_room.set()
+        # We keep the last message sent to each channel,
+        # which helped us drop duplicate messages when the bot had a bug that would send them.
+        # This shouldn't be necessary now that we make sure to only create one relay_task,
+        # but we'll keep it in case there are other causes of duplicate messages.
+        self.last_message: dict[int, Any] = {}
+
+    # raw is the message as received, to recognise duplicates.
+    # Waits if too many messages are already waiting to be sent.
+    async def add(self, channel_id: int, raw: Any, entry: GameLogEntry) -> None:
+        if not self.has_room.is_set():
+            RELAY_INTAKE_WAITS.inc()
+            # (another waiting caller may have filled it up again first)
+            while not self.has_room.is_set():
+                await self.has_room.wait()
+
+        if self.last_message.get(channel_id) == raw:
+            LOG.msg('drop duplicate message')
+            return
 
-    def datagram_received(self, data: bytes, _addr: tuple[Any, int]) -> None:
-        message = data.decode()
-        LOG.msg("got message (socket)", message=message)
-        j = json.loads(message)
-        channel_id = int(j['channel'])
-        with self.msgbuflock:
-            self.enqueue(channel_id, message, lambda _: j)
+        if (relay := self.channels.get(channel_id)) is None:
+            now = time.monotonic()
+            # (a channel whose first message is still being sent has no times yet, and keeps its place)
+            self.sent_at = {id: sent for (id, sent) in self.sent_at.items() if not sent or sent[-1] + CHANNEL_RATE_LIMIT[1] > now}
+            relay = self.channels[channel_id] = ChannelRelay(self, channel_id)
+        relay.add(entry)
+
+        # Only counted (and remembered) once it's been added, so that nothing is counted that will never be sent.
+        self.last_message[channel_id] = raw
+        self.pending += 1
+        if self.pending >= RELAY_MAX_PENDING:
+            LOG.warn('too many log messages waiting, not reading any more until some are sent', pending=self.pending)
+            self.has_room.clear()
+
+    def sent(self, count: int) -> None:
+        self.pending -= count
+        if self.pending < RELAY_MAX_PENDING:
+            self.has_room.set()
+
+    # Waits for everything received so far to be sent.
+    async def drain(self) -> None:
+        while self.channels:
+            await asyncio.gather(*(relay.task for relay in list(self.channels.values())))
+
+relay_scheduler = RelayScheduler()
+RELAY_BUFFERED_CHANNELS.set_function(lambda: len(relay_scheduler.channels))
+RELAY_PENDING_ENTRIES.set_function(lambda: relay_scheduler.pending)
 
 async def logger() -> None:
     await client.wait_until_ready()
@@ -848,46 +1139,23 @@ async def logger() -> None:
     if not correct_guild:
         LOG.warn("Not in the correct guild! Won't be able to use any spirit emojis!")
 
-    T = TypeVar('T')
-    def enqueue(channel_id: int, raw: T, parse: Callable[[T], GameLogEntry]) -> None:
-        if channel_id in game_log_buffer:
-            game_log_buffer[channel_id]['timestamp'] = datetime.datetime.now()
-        else:
-            game_log_buffer[channel_id] = {'timestamp': datetime.datetime.now(), 'logs': []}
-
-        if last_message.get(channel_id) == raw:
-            LOG.msg('drop duplicate message')
-        else:
-            game_log_buffer[channel_id]['logs'].append(parse(raw))
-            last_message[channel_id] = raw
-
-    async def dequeue() -> None:
-        keys = list(game_log_buffer.keys())
-        for channel_id in keys:
-            if game_log_buffer[channel_id]['timestamp'] + datetime.timedelta(seconds=20) < datetime.datetime.now():
-                LOG.msg('sending', channel_id=channel_id)
-                logs = game_log_buffer[channel_id]['logs']
-                del game_log_buffer[channel_id]
-                await relay_game(channel_id, logs)
-
     if SOCKET_PATH:
         loop = asyncio.get_running_loop()
 
         if os.path.exists(SOCKET_PATH):
             os.remove(SOCKET_PATH)
         LOG.msg("trying to create", socket_path=SOCKET_PATH)
-        transport, protocol = await loop.create_datagram_endpoint(
-            lambda: SIDatagramProtocol(enqueue),
-            local_addr=SOCKET_PATH,
-            family=socket.AF_UNIX,
-        )
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(SOCKET_PATH)
+        sock.setblocking(False)
         LOG.msg("listening", socket_path=SOCKET_PATH)
 
         while True:
             try:
-                with protocol.msgbuflock:
-                    await dequeue()
-                await asyncio.sleep(1)
+                message = (await loop.sock_recv(sock, 65536)).decode()
+                LOG.msg("got message (socket)", message=message)
+                j = json.loads(message)
+                await relay_scheduler.add(int(j['channel']), message, j)
             except Exception as ex:
                 LOG.exception(ex)
 
@@ -898,21 +1166,68 @@ async def logger() -> None:
 
         while True:
             try:
-                async with asyncio.timeout(30):
-                    message = await pubsub.get_message(ignore_subscribe_messages=True)
-                    if message is not None:
-                        LOG.msg("got message (Redis)", message=message)
-                        channel_id = int(message['channel'].split(':')[1])
-                        enqueue(channel_id, message, lambda msg: json.loads(msg['data']))
-
-                    await dequeue()
-
-                    await asyncio.sleep(1)
-            except asyncio.TimeoutError:
-                LOG.msg('timeout')
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=30)
+                if message is None:
+                    LOG.msg('timeout')
+                    continue
+                LOG.msg("got message (Redis)", message=message)
+                channel_id = int(message['channel'].split(':')[1])
+                await relay_scheduler.add(channel_id, message, json.loads(message['data']))
             except Exception as ex:
                 LOG.exception(ex)
 
+# With --fake-discord --load-test: relays made-up games' log messages as fast as the players can make them,
+# and reports how long they took to get to (fake) Discord.
+# Set FAKE_DISCORD_SEND_SECONDS to make each send take as long as Discord would,
+# and BOT_RELAY_QUIET_SECONDS etc. to not wait as long before sending.
+async def load_test() -> None:
+    import glob
+    import random
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    games = int(os.getenv('LOAD_TEST_GAMES', 50))
+    turns = int(os.getenv('LOAD_TEST_TURNS', 5))
+    players = int(os.getenv('LOAD_TEST_PLAYERS', 4))
+    cards = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'pbf', 'static', 'pbf', '*.jpg')))
+
+    log_id = 0
+    async def play(channel_id: int) -> None:
+        nonlocal log_id
+        for turn in range(turns):
+            for player in range(players):
+                entries: list[GameLogEntry] = [{'text': f'player {player} gains 3 energy'}, {'text': f'player {player} plays a card'}]
+                if cards:
+                    entries.append({'text': f'player {player} gains a power card', 'images': ','.join(random.sample(cards, 4))})
+                entries.append({'text': f'player {player} is ready'})
+                if player == players - 1:
+                    entries.append({'text': 'All spirits are ready!'})
+                for entry in entries:
+                    log_id += 1
+                    entry['id'] = log_id
+                    entry['created'] = time.time()
+                    await relay_scheduler.add(channel_id, log_id, entry)
+                await asyncio.sleep(random.uniform(0, 0.5))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(play(channel_id) for channel_id in range(1, games + 1)))
+    await relay_scheduler.drain()
+    elapsed = time.perf_counter() - start
+
+    from prometheus_client import REGISTRY
+    def value(name: str, **labels: str) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0
+    # the bucket that the qth quantile of latencies is in
+    def latency(q: float) -> str:
+        buckets = [(sample.labels['le'], sample.value) for metric in RELAY_LATENCY.collect() for sample in metric.samples if sample.name.endswith('_bucket')]
+        return next((f'<= {le}s' for (le, count) in buckets if count and count >= q * buckets[-1][1]), 'none sent')
+
+    print(f"{log_id} log messages from {games} games in {elapsed:.1f}s")
+    print(f"{value('bot_relay_send_seconds_count'):.0f} sends, {value('bot_relay_rate_limit_waits_total'):.0f} waited for a channel's rate limit")
+    print("flushes: " + ', '.join(f"{reason} {value('bot_relay_flushes_total', reason=reason):.0f}" for reason in ('quiet', 'turn_end', 'max_wait')))
+    print(f"latency: mean {value('bot_relay_latency_seconds_sum') / max(value('bot_relay_latency_seconds_count'), 1):.2f}s, "
+          f"median {latency(0.5)}, 95% {latency(0.95)}, max {latency(1)}")
+
 if __name__ == '__main__':
     #combine_images(["./pbf/static/pbf/settle_into_huntinggrounds.jpg","./pbf/static/pbf/flocking_redtalons.jpg","./pbf/static/pbf/vigor_of_the_breaking_dawn.jpg","./pbf/static/pbf/vengeance_of_the_dead.jpg"])
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT, addr='127.0.0.1')
     client.run(DISCORD_KEY)
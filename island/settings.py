@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 
 from pathlib import Path
 from dotenv import load_dotenv
+from typing import Any
 import os
 
 load_dotenv()
@@ -57,6 +58,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django_prometheus.middleware.PrometheusBeforeMiddleware',
+    # Queries, render time and response size for each view (see pbf/metrics.py).
+    'pbf.metrics.ViewMetricsMiddleware',
 
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -65,6 +68,12 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Relays the request's log messages to Discord once it's done (see pbf/relay.py).
+    'pbf.relay.RelayBatchMiddleware',
+    # Which shard's database the request's game is in, if games are sharded (see pbf/shards.py).
+    'pbf.shards.ShardMiddleware',
+    # Each request's transaction, on its game's database only, with BEGIN IMMEDIATE for views that write (see pbf/db.py).
+    'pbf.db.TransactionModeMiddleware',
     #"debug_toolbar.middleware.DebugToolbarMiddleware",
 
     'django_prometheus.middleware.PrometheusAfterMiddleware',
@@ -74,7 +83,8 @@ ROOT_URLCONF = 'island.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django's, timing each render (see pbf/metrics.py).
+        'BACKEND': 'pbf.metrics.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -90,17 +100,90 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'island.wsgi.application'
 
+# If set, requests that take longer than this many seconds are logged, with their SQL (see pbf/metrics.py).
+SLOW_REQUEST_SECONDS = float(os.environ['SLOW_REQUEST_SECONDS']) if os.getenv('SLOW_REQUEST_SECONDS') else None
+
 
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
-DATABASES = {
+DATABASES: dict[str, dict[str, Any]] = {
     'default': {
         'ENGINE': 'django_prometheus.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Each request is one transaction all the same, but opened by pbf.db.TransactionModeMiddleware,
+        # on the one database the request is about rather than on every one.
+        'ATOMIC_REQUESTS': False,
+        # Kept open between requests (gunicorn's sync workers are one thread each, so one connection per worker).
+        # Under ASGI, where each request can be on a different thread, set DB_CONN_MAX_AGE to 0.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # How long to wait for another worker's write lock before giving up with "database is locked".
+            # Views that write take it at the start of the request (see pbf/db.py).
+            'timeout': 20,
+            # WAL lets reads carry on while someone writes, and with it synchronous=NORMAL is still safe from corruption
+            # (a power cut could lose the last few commits, but not break the database).
+            # Each worker's connection also maps up to 256 MB of the file and caches up to 32 MB of pages.
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA mmap_size=268435456; PRAGMA cache_size=-32000; PRAGMA temp_store=MEMORY',
+        },
+        # A file rather than SQLite's default of an in-memory database for tests,
+        # whose connections (one per thread) would fail rather than wait for each other's locks.
+        # Some tests make requests from several threads at once.
+        'TEST': {'NAME': BASE_DIR / 'test-db.sqlite3'},
     }
 }
 
+# If set, games are spread over this many more SQLite files, db-shard0.sqlite3 and so on (see pbf/shards.py),
+# so that writes to different games don't wait for each other.
+DB_SHARDS = int(os.getenv('DB_SHARDS', 0))
+for i in range(DB_SHARDS):
+    DATABASES[f'shard{i}'] = {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / f'db-shard{i}.sqlite3',
+        'TEST': {'NAME': BASE_DIR / f'test-db-shard{i}.sqlite3'},
+    }
+
+# If set to yes, views that only read use a read-only connection of their own to each database (see pbf/db.py).
+# Most tests need it unset: a TestCase's data is never committed, so other connections can't see it.
+# The ones that need it set (TestReadConnection, and the ...ReadConnection variants of the read-only views' tests)
+# are skipped without it, and CI runs them with it.
+DB_READ_CONNECTION = os.environ.get('DB_READ_CONNECTION', '') == 'yes'
+if DB_READ_CONNECTION:
+    for alias, db in list(DATABASES.items()):
+        DATABASES[f'{alias}_read'] = {
+            **db,
+            'NAME': f"file:{db['NAME']}?mode=ro",
+            'OPTIONS': {
+                **db['OPTIONS'],
+                # No journal_mode, which a read-only connection can't set; the database is already in WAL mode.
+                'init_command': 'PRAGMA query_only=ON; PRAGMA mmap_size=268435456; PRAGMA cache_size=-32000; PRAGMA temp_store=MEMORY',
+            },
+            'TEST': {'MIRROR': alias},
+        }
+
+DATABASE_ROUTERS = ['pbf.db.ReadRouter', 'pbf.shards.ShardRouter']
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered parts of each player (see pbf/cache.py).
+    # Each process keeps its own, evicting the least recently used once it's full,
+    # unless FRAGMENT_CACHE is redis, to share them between processes.
+    'template_fragments': {
+        'BACKEND': 'django_prometheus.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+        'KEY_FUNCTION': 'pbf.cache.make_key',
+    },
+}
+if os.getenv('FRAGMENT_CACHE') == 'redis':
+    CACHES['template_fragments'] = {
+        'BACKEND': 'pbf.cache.RedisCache',
+        'LOCATION': f"redis://{os.getenv('REDIS_HOST', 'localhost')}:{os.getenv('REDIS_PORT', 6379)}/2",
+        'KEY_FUNCTION': 'pbf.cache.make_key',
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -148,8 +231,6 @@ INTERNAL_IPS = [
     "127.0.0.1",
 ]
 
-ATOMIC_REQUESTS = True
-
 #LOGGING = {
 #    'version': 1,
 #    'filters': {
@@ -187,6 +268,7 @@ if not DEBUG:
         },
         "loggers": {
             "django": {"handlers": ["console"], "level": "INFO"},
+            "pbf": {"handlers": ["console"], "level": "INFO"},
         },
     }
 
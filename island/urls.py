@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.urls import include, path, register_converter
 from django.conf import settings
 from django.conf.urls.static import static
-from pbf import views
+from pbf import events, views
 from pbf.api import api
 
 class NegativeIntConverter:
@@ -27,6 +27,7 @@ urlpatterns = [
     path('game/<str:game_id>/spirit/<path:spirit_spec>', views.view_game, name='view_game'),
     path('game/<str:game_id>/setup', views.game_setup, name='game_setup'),
     path('game/<str:game_id>/logs', views.game_logs, name='game_logs'),
+    path('game/<str:game_id>/events', events.game_events, name='game_events'),
     path('game/<str:game_id>/screenshot', views.view_game, name='add_screenshot'),
     path('game/<str:game_id>/add-player', views.add_player, name='add_player'),
     path('game/<str:game_id>/draw', views.draw_cards, name='draw_cards'),
@@ -88,6 +89,7 @@ urlpatterns = [
     path('game/<int:player_id>/element/<str:element>/remove', views.remove_element, name='remove_element'),
     path('game/<int:player_id>/element-permanent/<str:element>/add', views.add_element_permanent, name='add_element_permanent'),
     path('game/<int:player_id>/element-permanent/<str:element>/remove', views.remove_element_permanent, name='remove_element_permanent'),
+    path('game/<int:player_id>/actions', views.player_actions, name='player_actions'),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 
 if settings.DEBUG:
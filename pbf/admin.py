@@ -4,7 +4,7 @@ from django.db.models.fields.related import ManyToManyField
 from django.forms.models import ModelMultipleChoiceField
 from django.http import HttpRequest
 from typing import Any
-from .models import Card, Game, GamePlayer
+from .models import Card, Game, GameMajorDeckCard, GameMinorDeckCard, GamePlayer
 
 class CardAdmin(admin.ModelAdmin): #type: ignore[type-arg]
     def has_add_permission(self, request: HttpRequest) -> bool:
@@ -16,12 +16,27 @@ class CardAdmin(admin.ModelAdmin): #type: ignore[type-arg]
     search_fields = ('name',)
     list_display = ('name', 'spirit__name', 'type')
 
+# The decks have positions (see GameMinorDeckCard and GameMajorDeckCard), so they can't use filter_horizontal.
+# Cards added here get a random position, the same as being shuffled in.
+class GameMinorDeckInline(admin.TabularInline): #type: ignore[type-arg]
+    model = GameMinorDeckCard
+    fields = ('card', )
+    autocomplete_fields = ('card', )
+    verbose_name = 'minor deck card'
+
+class GameMajorDeckInline(admin.TabularInline): #type: ignore[type-arg]
+    model = GameMajorDeckCard
+    fields = ('card', )
+    autocomplete_fields = ('card', )
+    verbose_name = 'major deck card'
+
 class GameAdmin(admin.ModelAdmin): #type: ignore[type-arg]
     search_fields = ('id', 'name')
     search_help_text = 'Search by ID or name'
     list_display = ('id', 'created_at', 'name', 'scenario', 'discord_channel')
     ordering = ('-created_at', )
-    filter_horizontal = ('minor_deck', 'major_deck', 'discard_pile')
+    filter_horizontal = ('discard_pile', )
+    inlines = (GameMinorDeckInline, GameMajorDeckInline)
     def has_delete_permission(self, request: HttpRequest, obj: Game | None = None) -> bool:
         return False
 
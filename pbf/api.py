@@ -1,9 +1,16 @@
+from django.db.models import F
 from django.shortcuts import get_object_or_404
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import etag
 from ninja import NinjaAPI
+from ninja.decorators import decorate_view
 from ninja import Field, ModelSchema
 import os
 import ipaddress
-from .models import Card, Game, GameLog, GamePlayer, GamePlayerImpendingWithEnergy, Presence, Spirit
+from .models import Card, Game, GameLog, GamePlayer, GamePlayerImpendingWithEnergy, Presence, Spirit, bump_version
+from .db import for_reading
+from .shards import game_databases
+from .views import game_etag
 
 api = NinjaAPI()
 
@@ -39,6 +46,23 @@ class GamePlayerSchema(ModelSchema):
     healing: list[CardSchema] = []
     impending: list[ImpendingSchema] = Field([], alias="gameplayerimpendingwithenergy_set")
     presence: list[PresenceSchema] = Field([], alias="presence_set")
+    # The elements are stored packed into one field each, but exported one field per element, as they always were.
+    temporary_sun: int
+    temporary_moon: int
+    temporary_fire: int
+    temporary_air: int
+    temporary_water: int
+    temporary_earth: int
+    temporary_plant: int
+    temporary_animal: int
+    permanent_sun: int
+    permanent_moon: int
+    permanent_fire: int
+    permanent_air: int
+    permanent_water: int
+    permanent_earth: int
+    permanent_plant: int
+    permanent_animal: int
     class Meta:
         model = GamePlayer
         fields = [
@@ -46,8 +70,6 @@ class GamePlayerSchema(ModelSchema):
                 'ready', 'paid_this_turn', 'gained_this_turn',
                 'energy', 'last_unready_energy', 'last_ready_energy',
                 'bargain_paid_this_turn', 'bargain_cost_per_turn',
-                'temporary_sun', 'temporary_moon', 'temporary_fire', 'temporary_air', 'temporary_water', 'temporary_earth', 'temporary_plant', 'temporary_animal',
-                'permanent_sun', 'permanent_moon', 'permanent_fire', 'permanent_air', 'permanent_water', 'permanent_earth', 'permanent_plant', 'permanent_animal',
                 'spirit_specific_resource', 'spirit_specific_per_turn_flags',
                 ]
 
@@ -101,16 +123,21 @@ def ip(request):
 @api.post("/game/{game_id}/link/{channel_id}", auth=ip_whitelist)
 def game_link(request, game_id, channel_id):
     game = get_object_or_404(Game, pk=game_id)
-    Game.objects.filter(discord_channel=channel_id).update(discord_channel='')
+    for alias in game_databases():
+        Game.objects.using(alias).filter(discord_channel=channel_id).update(discord_channel='', version=F('version') + 1)
     game.discord_channel = channel_id
-    game.save()
+    game.save(update_fields=['discord_channel'])
+    bump_version(game.id)
     return "ok"
 
 @api.get("/game", response=list[GameSchema])
 def game_list(request):
-    return Game.objects.all()
+    # Every shard's games (see pbf/shards.py).
+    return [game for alias in game_databases() for game in Game.objects.using(for_reading(alias)).all()]
 
+# Answers If-None-Match with 304 the same way as the views that only read a game (see views.game_etag).
 @api.get("/game/{game_id}", response=GameDetailSchema)
+@decorate_view(cache_control(no_cache=True), etag(game_etag))
 def game(request, game_id):
     return get_object_or_404(Game, pk=game_id)
 
@@ -118,6 +145,6 @@ def game(request, game_id):
 def gamelogs(request, game_id, after: int | None = None):
     game = get_object_or_404(Game, pk=game_id)
     if after is None:
-        return game.gamelog_set.all()
+        return game.gamelog_set.order_by('id')
     else:
-        return game.gamelog_set.filter(pk__gt=after)
+        return game.gamelog_set.filter(pk__gt=after).order_by('id')
@@ -4,3 +4,23 @@ from django.apps import AppConfig
 class PbfConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pbf'
+
+    def ready(self) -> None:
+        from django.db.models.signals import post_delete, post_migrate, post_save
+
+        from .catalog import invalidate_card_catalog
+        from .models import Card, Spirit
+        from .shards import copy_reference_data, delete_reference_row, save_reference_row, start_player_ids
+
+        # The card catalog is a per-process copy of the Card table,
+        # so it needs to be rebuilt whenever that table might have changed.
+        post_migrate.connect(invalidate_card_catalog, dispatch_uid='pbf_card_catalog_migrate')
+        post_save.connect(invalidate_card_catalog, sender=Card, dispatch_uid='pbf_card_catalog_save')
+        post_delete.connect(invalidate_card_catalog, sender=Card, dispatch_uid='pbf_card_catalog_delete')
+
+        # Shards (see pbf/shards.py) get default's cards and spirits, and their own range of player ids.
+        post_migrate.connect(copy_reference_data, sender=self, dispatch_uid='pbf_shard_reference_data')
+        post_migrate.connect(start_player_ids, sender=self, dispatch_uid='pbf_shard_player_ids')
+        for model in (Card, Spirit):
+            post_save.connect(save_reference_row, sender=model, dispatch_uid=f'pbf_shard_save_{model._meta.model_name}')
+            post_delete.connect(delete_reference_row, sender=model, dispatch_uid=f'pbf_shard_delete_{model._meta.model_name}')
@@ -0,0 +1,50 @@
+import functools
+import hashlib
+import os
+from django.core.cache.backends.redis import RedisCache as DjangoRedisCache
+from django_prometheus.cache.metrics import django_cache_get_total, django_cache_hits_total, django_cache_misses_total #type: ignore[import-untyped]
+from typing import Any
+
+# The cache of rendered parts of a player (the {% cache %} tags in the templates),
+# configured as template_fragments in island/settings.py.
+#
+# Those are keyed by the player's version (see models.bump_version), so they never need to be invalidated:
+# once the player changes, nothing asks for the old version any more, and it's eventually evicted
+# (or expires after a day, the time given to each {% cache %}).
+# The key also has the deploy's version (see make_key), since a new deploy may render the same player differently.
+
+# Identifies the code that renders things, which is what changes when a deploy changes how things are rendered:
+# DEPLOY_VERSION if the deploy sets it (to a git revision, say), or else a hash of the app's code and templates
+# (all of it, since what's rendered can depend on any of it: models, template tags, spirit data and so on).
+@functools.cache
+def deploy_version() -> str:
+    if version := os.getenv('DEPLOY_VERSION'):
+        return version
+    here = os.path.dirname(__file__)
+    digest = hashlib.sha256()
+    for (root, dirs, files) in os.walk(here):
+        dirs[:] = sorted(d for d in dirs if d not in ('__pycache__', 'static'))
+        in_templates = os.path.relpath(root, here).split(os.sep)[0] == 'templates'
+        for name in sorted(files):
+            if name.endswith('.py') or in_templates:
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, here).encode() + b'\0')
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+# KEY_FUNCTION for template_fragments.
+def make_key(key: str, key_prefix: str, version: Any) -> str:
+    return f'{key_prefix}:{version}:{deploy_version()}:{key}'
+
+# Django's Redis cache, counting hits and misses with the same metrics as django_prometheus's own cache backends.
+# (django_prometheus's Redis backends need django-redis, which we don't otherwise use.)
+class RedisCache(DjangoRedisCache):
+    def get(self, key: Any, default: Any = None, version: Any = None) -> Any:
+        django_cache_get_total.labels(backend='redis').inc()
+        cached = super().get(key, None, version)
+        if cached is None:
+            django_cache_misses_total.labels(backend='redis').inc()
+            return default
+        django_cache_hits_total.labels(backend='redis').inc()
+        return cached
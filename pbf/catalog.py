@@ -0,0 +1,102 @@
+import copy
+from collections import Counter
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from typing import Any
+
+from .models import Card, CompiledThreshold, Elements, compiled_card_thresholds
+
+# Cards are static reference data: only data migrations (or a rare admin edit) change them.
+# So rather than asking the database for the same rows on every request,
+# each worker process keeps one read-only copy of every card in memory.
+#
+# The copy is thrown away whenever migrations run or a Card is saved/deleted in this process
+# (see PbfConfig.ready), and rebuilt on next use.
+# Other worker processes are not notified, but deploys restart workers after migrating anyway.
+
+@dataclass(frozen=True)
+class CatalogCard:
+    id: int
+    name: str
+    type: int
+    spirit_id: int | None
+    cost: int
+    speed: int
+    exclude_from_deck: bool
+    url: str
+    elements: tuple[Elements, ...]
+    thresholds: tuple[tuple[int, int, CompiledThreshold], ...]
+    _card: Card = field(repr=False, compare=False)
+
+    # Returns a fresh model instance each time,
+    # so that callers can't accidentally modify the one shared by every request.
+    def card(self) -> Card:
+        return copy.copy(self._card)
+
+    def get_elements(self) -> Counter[Elements]:
+        return Counter(self.elements)
+
+class CardCatalog:
+    def __init__(self, cards: Iterable[Card]) -> None:
+        self.by_id: dict[int, CatalogCard] = {}
+        self.by_name: dict[str, CatalogCard] = {}
+        self.by_casefold_name: dict[str, CatalogCard] = {}
+        self.by_spirit: dict[int, list[CatalogCard]] = {}
+        for card in cards:
+            entry = CatalogCard(
+                id=card.id,
+                name=card.name,
+                type=card.type,
+                spirit_id=card.spirit_id,
+                cost=card.cost,
+                speed=card.speed,
+                exclude_from_deck=card.exclude_from_deck,
+                url=card.url(),
+                elements=tuple(card.get_elements()),
+                thresholds=tuple(compiled_card_thresholds.get(card.name, [])),
+                _card=card,
+            )
+            self.by_id[entry.id] = entry
+            self.by_name[entry.name] = entry
+            # If two cards differ only in case, the first one (by name) wins,
+            # but an exact match is always tried first by get_iexact.
+            self.by_casefold_name.setdefault(entry.name.casefold(), entry)
+            if entry.spirit_id is not None:
+                self.by_spirit.setdefault(entry.spirit_id, []).append(entry)
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    # These raise Card.DoesNotExist just like Card.objects.get would,
+    # so callers can switch over without changing their error handling.
+    def get(self, name: str) -> CatalogCard:
+        try:
+            return self.by_name[name]
+        except KeyError:
+            raise Card.DoesNotExist(f'no card named {name!r}') from None
+
+    def get_iexact(self, name: str) -> CatalogCard:
+        if (entry := self.by_name.get(name)) is not None:
+            return entry
+        try:
+            return self.by_casefold_name[name.casefold()]
+        except KeyError:
+            raise Card.DoesNotExist(f'no card named {name!r} (case-insensitive)') from None
+
+    def for_spirit(self, spirit_id: int) -> list[CatalogCard]:
+        return self.by_spirit.get(spirit_id, [])
+
+_catalog: CardCatalog | None = None
+
+def card_catalog() -> CardCatalog:
+    global _catalog
+    # Read into a local first, so that an invalidation from another thread
+    # between the check and the return can't make us return None.
+    catalog = _catalog
+    if catalog is None:
+        catalog = _catalog = CardCatalog(Card.objects.all())
+    return catalog
+
+def invalidate_card_catalog(**kwargs: Any) -> None:
+    global _catalog
+    _catalog = None
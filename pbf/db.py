@@ -0,0 +1,122 @@
+from collections.abc import Callable, Iterator
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Model
+from django.http import HttpRequest, HttpResponse
+from typing import Any, TypeVar
+from .shards import current_db
+
+# How requests use SQLite (configured in DATABASES in island/settings.py).
+#
+# Each request is one transaction, on the database the request is about (not Django's ATOMIC_REQUESTS,
+# which would open one on every database, shards and read connections included, for every request).
+# TransactionModeMiddleware opens it once it knows the view, and it ends with the request,
+# committed, or rolled back if the view raised.
+# Views that say they aren't atomic (with shards.non_atomic_requests) don't get one.
+# SQLite's plain BEGIN (DEFERRED) only takes the write lock at the transaction's first write,
+# and if another connection has taken it in the meantime, waiting for it could deadlock,
+# so SQLite fails the write straight away with "database is locked", regardless of the busy timeout.
+# So requests to views that write start with BEGIN IMMEDIATE instead, which takes the write lock up front,
+# waiting for it (up to the timeout) if need be.
+#
+# Views that never write are marked @read_only, and keep the plain BEGIN,
+# which with WAL never waits for anyone: readers see the last commit while a writer carries on.
+#
+# With games sharded (see pbf/shards.py), this is the database of the request's game.
+# Views that make a new game (whose database isn't known until then) write it in a write_transaction of their own.
+# (Many views that write are GETs, since that's what their hx-get links send, so the method alone doesn't say.)
+#
+# With DB_READ_CONNECTION set (see island/settings.py), views that never write also get a connection of their own,
+# opened read-only (mode=ro, query_only), so they can't write, whatever they do,
+# and never share a connection or transaction with anything that does: ReadRouter sends their queries there.
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+View = TypeVar('View', bound=Callable[..., Any])
+
+def read_only(view: View) -> View:
+    view.read_only = True #type: ignore[attr-defined]
+    return view
+
+def is_read_only(request: HttpRequest, view_func: Callable[..., Any]) -> bool:
+    if request.method not in SAFE_METHODS:
+        return False
+    if getattr(view_func, 'read_only', False):
+        return True
+    # The API's GETs only read (django-ninja's views don't carry @read_only from the functions behind them).
+    match = request.resolver_match
+    return match is not None and match.app_name == 'ninja'
+
+_read_db: ContextVar[str | None] = ContextVar('read_db', default=None)
+# The request's transaction, and the database it's on (once TransactionModeMiddleware.process_view has opened it).
+_request_transaction: ContextVar[ExitStack | None] = ContextVar('request_transaction', default=None)
+_request_db: ContextVar[str | None] = ContextVar('request_db', default=None)
+
+class ReadRouter:
+    def db_for_read(self, model: type[Model], **hints: Any) -> str | None:
+        return _read_db.get() if model._meta.app_label == 'pbf' else None
+
+# The database to read from instead of alias, for queries that say which database to use.
+def for_reading(alias: str) -> str:
+    return f'{alias}_read' if _read_db.get() else alias
+
+class TransactionModeMiddleware:
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        tokens = (_read_db.set(None), _request_db.set(None))
+        try:
+            with ExitStack() as stack:
+                stack_token = _request_transaction.set(stack)
+                try:
+                    return self.get_response(request)
+                finally:
+                    _request_transaction.reset(stack_token)
+        finally:
+            _read_db.reset(tokens[0])
+            _request_db.reset(tokens[1])
+
+    def process_view(self, request: HttpRequest, view_func: Callable[..., Any], view_args: Any, view_kwargs: Any) -> None:
+        alias = current_db()
+        if alias in getattr(view_func, '_non_atomic_requests', ()):
+            return
+        stack = _request_transaction.get()
+        assert stack is not None
+        if not is_read_only(request, view_func):
+            stack.enter_context(write_transaction(alias))
+        else:
+            if settings.DB_READ_CONNECTION:
+                alias = f'{alias}_read'
+                _read_db.set(alias)
+            stack.enter_context(transaction.atomic(using=alias))
+        _request_db.set(alias)
+
+    # As with ATOMIC_REQUESTS, a view that raises has its changes rolled back.
+    def process_exception(self, request: HttpRequest, exception: Exception) -> None:
+        if (alias := _request_db.get()) is not None:
+            transaction.set_rollback(True, using=alias)
+
+# A transaction that's going to write, for use outside of requests (management commands, say),
+# which starts with BEGIN IMMEDIATE like a request to a view that writes.
+# Within a transaction already (such as a request's), it's a savepoint of that.
+# using is the database to write to, by default the one of the game being worked on.
+@contextmanager
+def write_transaction(using: str | None = None) -> Iterator[None]:
+    using = using or current_db()
+    connection = connections[using]
+    if connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+        return
+    connection.ensure_connection()
+    mode = connection.transaction_mode #type: ignore[attr-defined]
+    connection.transaction_mode = 'IMMEDIATE' #type: ignore[attr-defined]
+    try:
+        with transaction.atomic(using=using):
+            connection.transaction_mode = mode #type: ignore[attr-defined]
+            yield
+    finally:
+        connection.transaction_mode = mode #type: ignore[attr-defined]
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import os
+from collections import defaultdict
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+from django.shortcuts import aget_object_or_404
+from typing import Any
+
+from . import relay
+from .models import Game
+from .shards import game_db, non_atomic_requests
+
+# Server-sent events (SSE) telling everyone looking at a game what changed in it,
+# so their pages can fetch just that (see game.html).
+#
+# Each request's changes to a game are collected into one event (see relay.game_changed),
+# and published once the request is done, the same way log messages are relayed to Discord:
+# through Redis, on the channel game-events:<game id>.
+# Without Redis (e.g. developing with IPC_METHOD=socket) events are only delivered within the same process,
+# which is enough when that's a single ASGI process serving both the site and the events.
+#
+# The events endpoint needs an ASGI server (island/asgi.py), since each client holds a connection open.
+# Under WSGI it says there's nothing to stream, and pages just don't get live updates.
+#
+# Each process keeps one Hub, with a single Redis subscription shared by everyone watching a game in that process,
+# subscribed while anyone is watching it.
+
+CHANNEL_PREFIX = 'game-events:'
+# Sent when there's been nothing else to send for this many seconds,
+# so that proxies don't close the connection for being idle.
+KEEPALIVE_SECONDS = 15.0
+
+Event = dict[str, Any]
+
+class LocalBackend:
+    async def subscribe(self, game_id: str) -> None:
+        pass
+
+    async def unsubscribe(self, game_id: str) -> None:
+        pass
+
+class RedisBackend:
+    def __init__(self, hub: 'Hub', pubsub: Any, errors: tuple[type[Exception], ...]):
+        self.hub = hub
+        self.pubsub = pubsub
+        self.errors = errors
+        self.reader: asyncio.Task[None] | None = None
+
+    @classmethod
+    def connect(cls, hub: 'Hub') -> 'RedisBackend':
+        import redis.asyncio #type: ignore[import-not-found]
+        client = redis.asyncio.StrictRedis(host=os.getenv('REDIS_HOST', 'localhost'), port=int(os.getenv('REDIS_PORT', 6379)), db=1)
+        return cls(hub, client.pubsub(ignore_subscribe_messages=True), (redis.exceptions.RedisError, OSError))
+
+    async def subscribe(self, game_id: str) -> None:
+        await self.pubsub.subscribe(CHANNEL_PREFIX + game_id)
+        if self.reader is None:
+            self.reader = asyncio.create_task(self.read())
+
+    async def unsubscribe(self, game_id: str) -> None:
+        await self.pubsub.unsubscribe(CHANNEL_PREFIX + game_id)
+
+    async def read(self) -> None:
+        while True:
+            try:
+                message = await self.pubsub.get_message(timeout=1.0)
+            except self.errors as e:
+                # The subscriptions are restored when it reconnects.
+                print(f"Game events: lost Redis connection, retrying: {e!r}")
+                await asyncio.sleep(1.0)
+                continue
+            if message and message['type'] == 'message':
+                self.hub.deliver(message['channel'].decode().removeprefix(CHANNEL_PREFIX), json.loads(message['data']))
+
+class Hub:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.listeners: defaultdict[str, set[asyncio.Queue[Event]]] = defaultdict(set)
+        self.backend: LocalBackend | RedisBackend = RedisBackend.connect(self) if relay.redis_client else LocalBackend()
+
+    @asynccontextmanager
+    async def listen(self, game_id: str) -> AsyncIterator[asyncio.Queue[Event]]:
+        queue: asyncio.Queue[Event] = asyncio.Queue()
+        if not self.listeners[game_id]:
+            await self.backend.subscribe(game_id)
+        self.listeners[game_id].add(queue)
+        try:
+            yield queue
+        finally:
+            self.listeners[game_id].discard(queue)
+            if not self.listeners[game_id]:
+                del self.listeners[game_id]
+                await self.backend.unsubscribe(game_id)
+
+    # Only called from the hub's event loop.
+    def deliver(self, game_id: str, event: Event) -> None:
+        for queue in self.listeners.get(game_id, ()):
+            queue.put_nowait(event)
+
+_hub: Hub | None = None
+
+def hub() -> Hub:
+    global _hub
+    loop = asyncio.get_running_loop()
+    if _hub is None or _hub.loop is not loop:
+        _hub = Hub(loop)
+    return _hub
+
+# For relay.publish when there's no Redis; called from whatever thread the view ran in.
+def publish_local(game_id: str, event: Event) -> None:
+    if _hub is not None and game_id in _hub.listeners:
+        _hub.loop.call_soon_threadsafe(_hub.deliver, game_id, event)
+
+def format_event(event: Event) -> bytes:
+    return f"event: change\ndata: {json.dumps(event)}\n\n".encode()
+
+async def stream(game_id: str) -> AsyncIterator[bytes]:
+    async with hub().listen(game_id) as queue:
+        # Lets the client know it's connected (and EventSource fires its open event on the first bytes).
+        yield b": connected\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+            except TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            yield format_event(event)
+
+# Async views can't be in a transaction, and it only reads one row anyway.
+@non_atomic_requests
+async def game_events(request: HttpRequest, game_id: str) -> HttpResponseBase:
+    game = await aget_object_or_404(Game.objects.using(game_db(game_id)), pk=game_id)
+    if not isinstance(request, ASGIRequest):
+        # 204 tells EventSource not to reconnect.
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(stream(str(game.id)), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Caddy's reverse_proxy passes event streams through as they come;
+    # this is for nginx, which would buffer them.
+    response['X-Accel-Buffering'] = 'no'
+    return response
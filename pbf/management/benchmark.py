@@ -0,0 +1,33 @@
+import statistics
+import time
+from django.db import connections
+from django.test import Client
+
+# What the benchmark commands that run worker processes (benchmarkcontention, benchmarkreads) have in common.
+
+# GETs each of urls in turn, in a worker process.
+# Returns the milliseconds each request took, and what went wrong with any that failed.
+def time_requests(urls):
+    client = Client(HTTP_HOST='localhost', raise_request_exception=False)
+    times = []
+    errors = []
+    for url in urls:
+        start = time.perf_counter()
+        response = client.get(url)
+        times.append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            exc_info = getattr(response, 'exc_info', None)
+            errors.append(repr(exc_info[1]) if exc_info else f'HTTP {response.status_code}')
+    connections.close_all()
+    return (times, errors)
+
+# Prints what time_requests returned in each worker: how many requests (and how many a second, given how long they all took),
+# their latency, and the errors.
+def report(label, results, elapsed=None):
+    ms = sorted(t for (times, _) in results for t in times)
+    errors = [error for (_, errors) in results for error in errors]
+    rate = f" in {elapsed:.2f}s ({len(ms) / elapsed:.0f}/s)" if elapsed else ''
+    print(f"{label}: {len(ms)} requests{rate}, {len(errors)} errors")
+    print(f"  latency: median {statistics.median(ms):.1f} ms, p95 {ms[int(len(ms) * 0.95)]:.1f} ms, p99 {ms[int(len(ms) * 0.99)]:.1f} ms, max {ms[-1]:.1f} ms")
+    for error in sorted(set(errors)):
+        print(f"  {errors.count(error)} x {error}")
@@ -0,0 +1,77 @@
+import multiprocessing
+import os
+import tempfile
+import time
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from pbf.management.benchmark import report, time_requests
+
+# The mix of requests each worker makes, over and over, for its player: mostly writes, like players clicking around.
+REQUESTS = (
+    'energy/1',
+    'element/fire/add',
+    'element/fire/remove',
+    'energy/-1',
+    'tab',
+)
+
+class Command(BaseCommand):
+    help = "Runs worker processes (like gunicorn's) making requests against one game and against a game each, on a scratch copy of the schema, and reports throughput, latency and errors such as 'database is locked'"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument("--requests", type=int, default=100, help="requests per worker")
+        parser.add_argument("--profile", choices=('tuned', 'untuned'), default='tuned',
+                            help="tuned: the settings in island/settings.py; untuned: rollback journal, no request transactions, connecting for each request, SQLite's default 5 second timeout")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['requests'] < 1:
+            raise CommandError("--workers and --requests must be at least 1")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            # and the shards' too, with DB_SHARDS set (see pbf/shards.py)
+            for alias in connections:
+                db = connections[alias].settings_dict
+                db['NAME'] = os.path.join(tmp, f'benchmark-{alias}.sqlite3')
+                if options['profile'] == 'untuned':
+                    db.update(CONN_MAX_AGE=0, OPTIONS={'init_command': 'PRAGMA journal_mode=DELETE'})
+            if options['profile'] == 'untuned':
+                # no request transactions (see pbf/db.py)
+                settings.MIDDLEWARE = [m for m in settings.MIDDLEWARE if m != 'pbf.db.TransactionModeMiddleware']
+            connections.close_all()
+            print(f"setting up {len(connections.settings)} databases in {tmp} ({options['profile']})")
+            call_command('migrate', verbosity=0)
+            call_command('migrateshards', verbosity=0)
+
+            players = self.make_game(options['workers'])
+            self.run('one game', [players[i % len(players)] for i in range(options['workers'])], options)
+            self.run('a game each', [self.make_game(1)[0] for _ in range(options['workers'])], options)
+
+    # Returns (game id, player id) of up to count players in a new game.
+    def make_game(self, count):
+        from pbf.models import Game, Spirit
+        from pbf.shards import game_db
+        client = Client(HTTP_HOST='localhost')
+        game_id = client.post('/new').url.split('/')[-2]
+        game = Game.objects.using(game_db(game_id)).get(id=game_id)
+        for spirit in Spirit.objects.order_by('id').values_list('name', flat=True)[:min(count, len(game.color_freq()))]:
+            client.post(f'/game/{game.id}/add-player', {'spirit': spirit, 'color': 'random'})
+        return [(str(game.id), player_id) for player_id in game.gameplayer_set.values_list('id', flat=True)]
+
+    def run(self, label, players, options):
+        # Each worker connects for itself, like a freshly forked gunicorn worker.
+        connections.close_all()
+        ctx = multiprocessing.get_context('fork')
+        start = time.perf_counter()
+        with ctx.Pool(len(players)) as pool:
+            results = pool.map(time_requests, [request_urls(game_id, player_id, options['requests']) for (game_id, player_id) in players])
+        elapsed = time.perf_counter() - start
+        report(f"{label}, {len(players)} workers", results, elapsed)
+
+# What a worker requests: count of REQUESTS for its player, in turn.
+def request_urls(game_id, player_id, count):
+    actions = [REQUESTS[i % len(REQUESTS)] for i in range(count)]
+    return [f'/game/{game_id}/tab/{player_id}' if action == 'tab' else f'/game/{player_id}/{action}' for action in actions]
@@ -0,0 +1,69 @@
+import io
+import json
+import os
+import statistics
+import time
+from contextlib import ExitStack
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from pbf.models import Game
+from pbf.shards import game_databases, game_db
+
+class Command(BaseCommand):
+    help = "Times importing games as the API exports them (/api/game/<id>), from exported files or games in the database, reporting the queries and milliseconds each import takes. Nothing is saved"
+
+    def add_arguments(self, parser):
+        parser.add_argument("games", nargs="*", help="game ids, or files exported from the API; by default the 5 games with the most players")
+        parser.add_argument("--repeat", type=int, default=5, help="imports of each game")
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1")
+        client = Client(HTTP_HOST='localhost')
+
+        games = options['games'] or self.largest_games(5)
+        if not games:
+            raise CommandError("there are no games to export, so give some exported files")
+        exports = []
+        for game in games:
+            if os.path.exists(game):
+                with open(game) as f:
+                    exports.append((game, f.read()))
+                continue
+            response = client.get(f'/api/game/{game}')
+            if response.status_code != 200:
+                raise CommandError(f"{game} is neither a file nor a game (HTTP {response.status_code})")
+            exports.append((game, response.content.decode()))
+
+        for (label, exported) in exports:
+            j = json.loads(exported)
+            cards = sum(len(player.get(name, [])) for player in j.get('players', []) for name in ('hand', 'discard', 'play', 'selection', 'days', 'healing', 'scenario', 'impending'))
+            (queries, ms) = self.time_imports(client, exported, options['repeat'])
+            print(f"{label}: {len(j.get('players', []))} players, {cards} cards held, {queries} queries, median {statistics.median(ms):.1f} ms, max {max(ms):.1f} ms")
+
+    def largest_games(self, count):
+        games = [game for alias in game_databases() for game in Game.objects.using(alias).annotate(players=Count('gameplayer')).values_list('players', 'id')]
+        return [str(id) for (_, id) in sorted(games, reverse=True)[:count]]
+
+    # Returns the queries the last import made (not counting savepoints), and the milliseconds each took.
+    def time_imports(self, client, exported, repeat):
+        ms = []
+        for _ in range(repeat):
+            with ExitStack() as stack:
+                # Each import is rolled back, wherever the new game would have gone.
+                captured = {}
+                for alias in game_databases():
+                    stack.enter_context(transaction.atomic(using=alias))
+                    captured[alias] = stack.enter_context(CaptureQueriesContext(connections[alias]))
+                start = time.perf_counter()
+                response = client.post('/import', {'json': io.StringIO(exported)})
+                ms.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 302:
+                    raise CommandError(f"import failed with HTTP {response.status_code}")
+                queries = [q for q in captured[game_db(response.url.split('/')[-1])].captured_queries if 'SAVEPOINT' not in q['sql']]
+                for alias in game_databases():
+                    transaction.set_rollback(True, using=alias)
+        return (len(queries), ms)
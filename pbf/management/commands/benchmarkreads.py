@@ -0,0 +1,90 @@
+import multiprocessing
+import os
+import tempfile
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from pbf.management.benchmark import report, time_requests
+
+# What the readers ask for, over and over: the views that only read, as a page polls them.
+READS = (
+    '/game/{game_id}/tab/{player_id}',
+    '/game/{game_id}/minor-deck',
+    '/game/{player_id}/discard-pile',
+    '/game/{game_id}/logs',
+    '/api/game/{game_id}',
+)
+
+# What the writers do, over and over, to their own player.
+WRITES = (
+    '/game/{player_id}/energy/1',
+    '/game/{player_id}/element/fire/add',
+    '/game/{player_id}/element/fire/remove',
+    '/game/{player_id}/energy/-1',
+)
+
+class Command(BaseCommand):
+    help = "Runs worker processes reading a game while others keep writing to it, on a scratch copy of the schema, and reports the readers' latency. Compare runs with and without DB_READ_CONNECTION=yes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=4)
+        parser.add_argument("--writers", type=int, default=4)
+        parser.add_argument("--requests", type=int, default=200, help="requests per reader")
+
+    def handle(self, *args, **options):
+        if options['readers'] < 1 or options['writers'] < 0 or options['requests'] < 1:
+            raise CommandError("--readers and --requests must be at least 1, and --writers can't be negative")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for alias in connections:
+                db = connections[alias].settings_dict
+                name = os.path.join(tmp, f"benchmark-{alias.removesuffix('_read')}.sqlite3")
+                db['NAME'] = f'file:{name}?mode=ro' if alias.endswith('_read') else name
+            connections.close_all()
+            print(f"setting up {tmp} (read connection: {'yes' if settings.DB_READ_CONNECTION else 'no'})")
+            call_command('migrate', verbosity=0)
+            call_command('migrateshards', verbosity=0)
+            (game_id, player_ids) = self.make_game(options['readers'] + options['writers'])
+            # with more workers than players, some share
+            players = [player_ids[i % len(player_ids)] for i in range(options['readers'] + options['writers'])]
+            self.run(game_id, players, options)
+
+    # Returns the id of a new game, with the ids of up to count players in it.
+    def make_game(self, count):
+        from pbf.models import Game, Spirit
+        from pbf.shards import game_db
+        client = Client(HTTP_HOST='localhost')
+        game_id = client.post('/new').url.split('/')[-2]
+        game = Game.objects.using(game_db(game_id)).get(id=game_id)
+        for spirit in Spirit.objects.order_by('id').values_list('name', flat=True)[:min(count, len(game.color_freq()))]:
+            client.post(f'/game/{game_id}/add-player', {'spirit': spirit, 'color': 'random'})
+        return (game_id, list(game.gameplayer_set.order_by('id').values_list('id', flat=True)))
+
+    def run(self, game_id, player_ids, options):
+        # Each worker connects for itself, like a freshly forked gunicorn worker.
+        connections.close_all()
+        ctx = multiprocessing.get_context('fork')
+        stop = ctx.Event()
+        writers = [ctx.Process(target=writer, args=(game_id, player_id, stop)) for player_id in player_ids[options['readers']:]]
+        for process in writers:
+            process.start()
+        with ctx.Pool(options['readers']) as pool:
+            results = pool.map(time_requests, [read_urls(game_id, player_id, options['requests']) for player_id in player_ids[:options['readers']]])
+        stop.set()
+        for process in writers:
+            process.join()
+        report(f"reads, with {len(writers)} writers", results)
+
+# What a reader requests: count of READS, in turn.
+def read_urls(game_id, player_id, count):
+    return [READS[i % len(READS)].format(game_id=game_id, player_id=player_id) for i in range(count)]
+
+def writer(game_id, player_id, stop):
+    client = Client(HTTP_HOST='localhost', raise_request_exception=False)
+    i = 0
+    while not stop.is_set():
+        client.get(WRITES[i % len(WRITES)].format(game_id=game_id, player_id=player_id))
+        i += 1
+    connections.close_all()
@@ -0,0 +1,58 @@
+import random
+import time
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from pbf.models import Elements, card_thresholds, check_elements_uncompiled, compiled_card_thresholds, compiled_spirit_thresholds, pack_elements, spirit_thresholds
+
+class Command(BaseCommand):
+    help = 'Compares the compiled threshold evaluator against the original string-parsing one for every spirit/aspect: checks that they agree, and times both'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--samples", type=int, default=200, help="random element combinations per spirit/aspect")
+        parser.add_argument("--cards", type=int, default=10, help="cards with thresholds shown alongside the spirit's innates (hand, play, selection)")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        card_names = list(card_thresholds)
+
+        total_old = 0.0
+        total_new = 0.0
+        checks = 0
+        mismatches = 0
+        for name in spirit_thresholds:
+            # Dark Fire is the only aspect with equiv_elements, but check every spirit both ways.
+            for equiv in (None, 'MF'):
+                for _ in range(options['samples']):
+                    # Mostly small amounts like a real game, but sometimes more than ELEMENT_MASK of one element.
+                    elements = defaultdict(int, {e: rng.choice((0, 0, 1, 2, 3, 4, 5, 7, 20)) for e in Elements})
+                    cards = rng.sample(card_names, options['cards'])
+
+                    # Same shape of work as rendering a player:
+                    # the innates plus every card in hand/play/selection, with the elements packed once.
+                    start = time.perf_counter()
+                    old = [check_elements_uncompiled(elements, desired, equiv) for (_, _, desired) in spirit_thresholds[name]]
+                    for card in cards:
+                        old += [check_elements_uncompiled(elements, desired, equiv) for (_, _, desired) in card_thresholds[card]]
+                    mid = time.perf_counter()
+                    have = pack_elements(elements, equiv)
+                    new = [t.with_equiv(equiv).check(have) for (_, _, t) in compiled_spirit_thresholds[name]]
+                    for card in cards:
+                        new += [t.with_equiv(equiv).check(have) for (_, _, t) in compiled_card_thresholds[card]]
+                    end = time.perf_counter()
+
+                    total_old += mid - start
+                    total_new += end - mid
+                    checks += len(old)
+                    if old != new:
+                        mismatches += 1
+                        print(f"MISMATCH {name} (equiv {equiv}) with {dict(elements)} and cards {cards}")
+            if options['verbosity'] > 1:
+                print(f"{name}: {len(spirit_thresholds[name])} innate thresholds")
+
+        print(f"{len(spirit_thresholds)} spirits/aspects, {checks} threshold checks")
+        print(f"uncompiled: {total_old * 1000:.1f} ms ({total_old / checks * 1e9:.0f} ns/check)")
+        print(f"compiled:   {total_new * 1000:.1f} ms ({total_new / checks * 1e9:.0f} ns/check)")
+        print(f"speedup: {total_old / total_new:.1f}x")
+        if mismatches:
+            raise CommandError(f"{mismatches} samples gave different results")
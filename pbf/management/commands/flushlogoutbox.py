@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from pbf import relay
+from pbf.models import LogOutbox
+from pbf.shards import game_databases
+
+class Command(BaseCommand):
+    help = "Publishes log messages left in the outbox because Redis was down (or the site stopped before publishing them). With --forever, keeps checking for more, to run alongside the site"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--forever", action="store_true")
+        parser.add_argument("--interval", type=float, default=5.0, help="seconds between checks, and between retries while Redis is down")
+        parser.add_argument("--min-age", type=float, default=relay.OUTBOX_MIN_AGE, help="seconds a message must have been waiting, so as not to publish it while the request that saved it is still doing so")
+
+    def handle(self, *args, **options):
+        if not relay.redis_client:
+            raise CommandError("Log messages are only saved to the outbox when relaying through Redis (set IPC_METHOD=redis)")
+
+        while True:
+            try:
+                # Drain everything there is before waiting.
+                while (sent := relay.flush_outbox(min_age=options['min_age'])):
+                    print(f"published {sent} log messages, {sum(LogOutbox.objects.using(alias).count() for alias in dict.fromkeys([DEFAULT_DB_ALIAS, *game_databases()]))} left")
+            except relay.redis_errors as e:
+                if not options['forever']:
+                    raise CommandError(f"Redis still unavailable: {e!r}")
+                print(f"Redis still unavailable: {e!r}")
+            if not options['forever']:
+                return
+            time.sleep(options['interval'])
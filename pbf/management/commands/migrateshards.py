@@ -0,0 +1,12 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from pbf.shards import shard_aliases
+
+class Command(BaseCommand):
+    help = "Migrates each shard's database (see pbf/shards.py), which also copies default's cards and spirits to it, so run it after migrate"
+
+    def handle(self, *args, **options):
+        for alias in shard_aliases():
+            if options['verbosity']:
+                print(f"migrating {alias}")
+            call_command('migrate', database=alias, interactive=False, verbosity=options['verbosity'])
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from pbf.models import Game
+from pbf.shards import game_db, move_game, shard_aliases
+
+class Command(BaseCommand):
+    help = "Moves each game to the shard that DB_SHARDS says it belongs in (see pbf/shards.py): out of default after first sharding, or between shards after raising DB_SHARDS. Moved players get new ids, so stop the site while it runs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="only say which games would move")
+
+    def handle(self, *args, **options):
+        if not settings.DB_SHARDS:
+            raise CommandError("DB_SHARDS isn't set, so there are no shards to move games to")
+
+        moved = 0
+        for source in (DEFAULT_DB_ALIAS, *shard_aliases()):
+            for (game_id, name) in Game.objects.using(source).values_list('id', 'name'):
+                target = game_db(game_id)
+                if target == source:
+                    continue
+                print(f"{game_id} ({name}): {source} -> {target}")
+                if not options['dry_run']:
+                    move_game(game_id, source, target)
+                moved += 1
+        print(f"{'would move' if options['dry_run'] else 'moved'} {moved} games")
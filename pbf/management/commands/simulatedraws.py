@@ -0,0 +1,66 @@
+import hashlib
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test.utils import CaptureQueriesContext
+from pbf.models import Game
+from pbf.shards import game_db, use_db
+import pbf.views
+
+class Command(BaseCommand):
+    # This doesn't replay what happened in the game: the game's players draw, gain, return and discard cards in their own way,
+    # which only the whole sequence of their actions could reproduce.
+    help = "Simulates drawing power cards in a new game with a given seed (or a game's starting seed), discarding every card drawn. The same seed always gives the same draws. Intended for load testing and profiling draws, and checking that draws are reproducible; nothing is saved"
+
+    def add_arguments(self, parser):
+        parser.add_argument("game_id", nargs="?", help="game whose seed to start from (its own draws aren't replayed)")
+        parser.add_argument("--seed", type=int, help="seed to use instead of a game's")
+        parser.add_argument("--draws", type=int, default=100)
+        parser.add_argument("--cards", type=int, default=4, help="cards per draw")
+        parser.add_argument("--type", choices=('minor', 'major'), default='minor')
+        parser.add_argument("--check", action="store_true", help="simulate twice and fail if the draws differ")
+
+    def handle(self, *args, **options):
+        if options['seed'] is not None:
+            seed = options['seed']
+        elif options['game_id']:
+            seed = Game.objects.using(game_db(options['game_id'])).get(id=options['game_id']).rng_seed
+        else:
+            raise CommandError("give a game id or --seed")
+
+        if options['draws'] < 1:
+            raise CommandError("--draws must be at least 1")
+
+        digest = self.simulate(seed, options)
+        if options['check'] and self.simulate(seed, options) != digest:
+            raise CommandError(f"seed {seed} gave different draws the second time")
+
+    def simulate(self, seed, options):
+        draws = []
+        times = []
+        queries = []
+        game = Game(name='simulatedraws', rng_seed=seed)
+        db = game_db(game.id)
+        with use_db(db), transaction.atomic(using=db):
+            game.save()
+            pbf.views.setup_decks(game)
+            for _ in range(options['draws']):
+                with CaptureQueriesContext(connections[db]) as captured:
+                    start = time.perf_counter()
+                    cards = pbf.views.cards_from_deck(game, options['cards'], options['type'])
+                    times.append(time.perf_counter() - start)
+                # Discarded, like cards that were drawn and not gained, so the deck eventually gets reshuffled.
+                game.discard_pile.add(*cards)
+                queries.append(len(captured))
+                draws.append([card.name for card in cards])
+                if options['verbosity'] > 1:
+                    print(', '.join(draws[-1]))
+            reshuffles = game.gamelog_set.filter(text__startswith='Re-shuffling').count()
+            transaction.set_rollback(True, using=db)
+
+        digest = hashlib.sha256(repr(draws).encode()).hexdigest()[:16]
+        ms = sorted(t * 1000 for t in times)
+        print(f"seed {seed}: {len(draws)} draws of {options['cards']} {options['type']}s, {reshuffles} reshuffles, digest {digest}")
+        print(f"per draw: median {statistics.median(ms):.2f} ms, max {ms[-1]:.2f} ms, {max(queries)} queries at most")
+        return digest
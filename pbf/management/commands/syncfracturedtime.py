@@ -1,5 +1,7 @@
 from django.core.management.base import BaseCommand
-from pbf.models import GamePlayer
+from pbf.db import write_transaction
+from pbf.models import GamePlayer, bump_version
+from pbf.shards import game_databases, use_db
 
 class Command(BaseCommand):
     help = 'set Fractured Days spirit-specific resource to number of Time discs they have'
@@ -8,6 +10,11 @@ class Command(BaseCommand):
         parser.add_argument('--save', action='store_true', help='save')
 
     def handle(self, *args, **options):
+        for alias in game_databases():
+            with use_db(alias):
+                self.sync(options['save'])
+
+    def sync(self, save):
         fractured_days = GamePlayer.objects.filter(spirit__name='Fractured').all()
         change = []
         for frac in fractured_days:
@@ -16,8 +23,12 @@ class Command(BaseCommand):
                 change.append((frac.spirit_specific_resource, frac))
                 frac.spirit_specific_resource = time
         print(f"change {len(change)}/{len(fractured_days)} Fractured Days")
-        if options['save']:
-            GamePlayer.objects.bulk_update((f for (_, f) in change), ['spirit_specific_resource'])
+        if save:
+            with write_transaction():
+                GamePlayer.objects.bulk_update((f for (_, f) in change), ['spirit_specific_resource'])
+                # so that what's cached for them (see pbf/cache.py) is rendered again
+                for (_, frac) in change:
+                    bump_version(frac.game_id, frac.id)
         else:
             for (old, frac) in change:
                 print(f"{frac.id}: {old} -> {frac.spirit_specific_resource}")
@@ -0,0 +1,103 @@
+import logging
+import time
+from collections.abc import Callable
+from contextlib import ExitStack
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+from django.template.backends.django import DjangoTemplates as BaseDjangoTemplates, Template as BaseTemplate
+from prometheus_client import Histogram
+from typing import Any
+
+# Metrics for each view, on top of the per-request ones from django_prometheus:
+# how many queries it makes, how long they take, how long rendering templates takes, and how big the response is,
+# labelled by the view's URL name (e.g. play_card).
+#
+# Rendering includes any queries that templates make (such as for a queryset they loop over),
+# so that time is counted in both.
+#
+# Setting SLOW_REQUEST_SECONDS (see island/settings.py) also logs every request that takes longer than that,
+# with the SQL of each query it made.
+
+QUERIES = Histogram('pbf_view_queries', 'Database queries made by each request', ['view'], buckets=(1, 2, 5, 10, 15, 20, 30, 50, 100))
+SQL_SECONDS = Histogram('pbf_view_sql_seconds', 'Time spent on database queries by each request', ['view'])
+RENDER_SECONDS = Histogram('pbf_view_render_seconds', 'Time spent rendering templates by each request', ['view'])
+RESPONSE_BYTES = Histogram('pbf_view_response_bytes', 'Size of the response to each request', ['view'], buckets=(256, 1024, 4096, 8192, 16384, 32768, 65536, 131072, 524288))
+
+logger = logging.getLogger('pbf.slow_requests')
+
+class RequestStats:
+    def __init__(self, keep_sql: bool):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        # (seconds, sql) of each query, only kept if they might be logged
+        self.sql: list[tuple[float, str]] | None = [] if keep_sql else None
+
+    def execute(self, execute: Callable[..., Any], sql: str, params: Any, many: bool, context: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.sql_seconds += elapsed
+            if self.sql is not None:
+                self.sql.append((elapsed, sql))
+
+_stats: ContextVar[RequestStats | None] = ContextVar('request_stats', default=None)
+
+class ViewMetricsMiddleware:
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        slow = settings.SLOW_REQUEST_SECONDS
+        stats = RequestStats(keep_sql=slow is not None)
+        token = _stats.set(stats)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats.execute))
+                response = self.get_response(request)
+        finally:
+            _stats.reset(token)
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = (match.url_name if match else None) or 'unresolved'
+        QUERIES.labels(view).observe(stats.queries)
+        SQL_SECONDS.labels(view).observe(stats.sql_seconds)
+        RENDER_SECONDS.labels(view).observe(stats.render_seconds)
+        # Streaming responses (game events) don't have a size, and stay open as long as someone's watching.
+        if response.streaming:
+            return response
+        RESPONSE_BYTES.labels(view).observe(len(response.content))
+
+        if slow is not None and elapsed > slow:
+            lines = [f"{request.method} {request.path} ({view}) took {elapsed * 1000:.1f} ms: "
+                     f"{stats.queries} queries in {stats.sql_seconds * 1000:.1f} ms, rendering {stats.render_seconds * 1000:.1f} ms"]
+            lines.extend(f"  {seconds * 1000:.2f} ms: {sql}" for (seconds, sql) in stats.sql or ())
+            logger.warning('\n'.join(lines))
+        return response
+
+# The template backend (see TEMPLATES in island/settings.py): Django's own, timing each render for ViewMetricsMiddleware.
+# Only the templates that views render are timed, not those they include (which are part of the same render).
+class Template(BaseTemplate):
+    def render(self, context: dict[str, Any] | None = None, request: HttpRequest | None = None) -> Any:
+        if (stats := _stats.get()) is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.render_seconds += time.perf_counter() - start
+
+class DjangoTemplates(BaseDjangoTemplates):
+    def from_string(self, template_code: str) -> Template:
+        return Template(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name: str) -> Template:
+        return Template(super().get_template(template_name).template, self)
@@ -0,0 +1,87 @@
+import random
+
+import django.db.models.deletion
+import pbf.models
+from django.db import migrations, models
+
+
+# Existing decks were unordered, so give every card a random position,
+# the same as shuffling each deck.
+def shuffle_existing_decks(apps, schema_editor):
+    for model_name in ('GameMinorDeckCard', 'GameMajorDeckCard'):
+        model = apps.get_model('pbf', model_name)
+        rows = list(model.objects.only('id'))
+        for row in rows:
+            row.position = random.getrandbits(31)
+        model.objects.bulk_update(rows, ['position'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pbf', '0065_card_type_rename_special_to_retired'),
+    ]
+
+    operations = [
+        # The tables already exist (created by Django for the ManyToManyFields),
+        # so only tell Django about the models for them, without touching the database.
+        # Django can't add through= to an existing ManyToManyField in the database anyway.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='GameMinorDeckCard',
+                    fields=[
+                        ('id', models.AutoField(primary_key=True, serialize=False)),
+                        ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pbf.card')),
+                        ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pbf.game')),
+                    ],
+                    options={
+                        'db_table': 'pbf_game_minor_deck',
+                        'unique_together': {('game', 'card')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='game',
+                    name='minor_deck',
+                    field=models.ManyToManyField(blank=True, related_name='minor_deck', through='pbf.GameMinorDeckCard', to='pbf.card'),
+                ),
+                migrations.CreateModel(
+                    name='GameMajorDeckCard',
+                    fields=[
+                        ('id', models.AutoField(primary_key=True, serialize=False)),
+                        ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pbf.card')),
+                        ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pbf.game')),
+                    ],
+                    options={
+                        'db_table': 'pbf_game_major_deck',
+                        'unique_together': {('game', 'card')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='game',
+                    name='major_deck',
+                    field=models.ManyToManyField(blank=True, related_name='major_deck', through='pbf.GameMajorDeckCard', to='pbf.card'),
+                ),
+            ],
+            database_operations=[],
+        ),
+        migrations.AddField(
+            model_name='gameminordeckcard',
+            name='position',
+            field=models.IntegerField(default=pbf.models.random_deck_position),
+        ),
+        migrations.AddField(
+            model_name='gamemajordeckcard',
+            name='position',
+            field=models.IntegerField(default=pbf.models.random_deck_position),
+        ),
+        migrations.RunPython(shuffle_existing_decks, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='gameminordeckcard',
+            index=models.Index(fields=['game', 'position'], name='pbf_game_minor_deck_position'),
+        ),
+        migrations.AddIndex(
+            model_name='gamemajordeckcard',
+            index=models.Index(fields=['game', 'position'], name='pbf_game_major_deck_position'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.9 on 2026-10-18 01:06
+
+import random
+
+import pbf.models
+from django.db import migrations, models
+
+
+# AddField evaluates the default once, so existing games would all share a seed.
+def seed_existing_games(apps, schema_editor):
+    Game = apps.get_model('pbf', 'Game')
+    games = list(Game.objects.only('id'))
+    for game in games:
+        game.rng_seed = random.getrandbits(63)
+    Game.objects.bulk_update(games, ['rng_seed'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pbf', '0066_game_deck_positions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='rng_counter',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='rng_seed',
+            field=models.BigIntegerField(default=pbf.models.new_rng_seed),
+        ),
+        migrations.RunPython(seed_existing_games, migrations.RunPython.noop),
+    ]
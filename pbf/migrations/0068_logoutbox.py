@@ -0,0 +1,22 @@
+# Generated by Django 6.0.9 on 2026-10-18 01:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pbf', '0067_game_rng'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('channel', models.CharField(max_length=255)),
+                ('message', models.TextField()),
+            ],
+        ),
+    ]
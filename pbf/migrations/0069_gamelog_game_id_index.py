@@ -0,0 +1,24 @@
+# Generated by Django 6.0.9 on 2026-10-18 01:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pbf', '0068_logoutbox'),
+    ]
+
+    operations = [
+        # Add the new index before dropping the old one, so logs are never unindexed.
+        migrations.AddIndex(
+            model_name='gamelog',
+            index=models.Index(fields=['game', 'id'], name='pbf_gamelog_game_id_id'),
+        ),
+        migrations.AlterField(
+            model_name='gamelog',
+            name='game',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='pbf.game'),
+        ),
+    ]
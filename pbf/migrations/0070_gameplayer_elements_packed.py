@@ -0,0 +1,117 @@
+# Generated by Django 6.0.9 on 2026-10-18 01:32
+
+from django.db import migrations, models
+
+ELEMENTS = ('sun', 'moon', 'fire', 'air', 'water', 'earth', 'plant', 'animal')
+# as in pbf.models, which may have changed by the time this runs
+ELEMENT_WIDTH = 4
+ELEMENT_MASK = (1 << ELEMENT_WIDTH) - 1
+
+
+def pack_elements(apps, schema_editor):
+    GamePlayer = apps.get_model('pbf', 'GamePlayer')
+    players = list(GamePlayer.objects.all())
+    for player in players:
+        for kind in ('temporary', 'permanent'):
+            packed = 0
+            for (i, e) in enumerate(ELEMENTS):
+                n = max(0, min(getattr(player, f'{kind}_{e}'), ELEMENT_MASK))
+                packed |= n << (ELEMENT_WIDTH * i)
+            setattr(player, f'{kind}_elements_packed', packed)
+    GamePlayer.objects.bulk_update(players, ['temporary_elements_packed', 'permanent_elements_packed'], batch_size=1000)
+
+
+def unpack_elements(apps, schema_editor):
+    GamePlayer = apps.get_model('pbf', 'GamePlayer')
+    players = list(GamePlayer.objects.all())
+    for player in players:
+        for kind in ('temporary', 'permanent'):
+            packed = getattr(player, f'{kind}_elements_packed')
+            for (i, e) in enumerate(ELEMENTS):
+                setattr(player, f'{kind}_{e}', (packed >> (ELEMENT_WIDTH * i)) & ELEMENT_MASK)
+    GamePlayer.objects.bulk_update(players, [f'{kind}_{e}' for kind in ('temporary', 'permanent') for e in ELEMENTS], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pbf', '0069_gamelog_game_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameplayer',
+            name='permanent_elements_packed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='gameplayer',
+            name='temporary_elements_packed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(pack_elements, unpack_elements),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='permanent_sun',
+        ),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='permanent_moon',
+        ),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='permanent_fire',
+        ),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='permanent_air',
+        ),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='permanent_water',
+        ),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='permanent_earth',
+        ),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='permanent_plant',
+        ),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='permanent_animal',
+        ),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='temporary_sun',
+        ),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='temporary_moon',
+        ),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='temporary_fire',
+        ),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='temporary_air',
+        ),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='temporary_water',
+        ),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='temporary_earth',
+        ),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='temporary_plant',
+        ),
+        migrations.RemoveField(
+            model_name='gameplayer',
+            name='temporary_animal',
+        ),
+    ]
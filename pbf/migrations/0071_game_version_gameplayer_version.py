@@ -0,0 +1,23 @@
+# Generated by Django 6.0.9 on 2026-10-18 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pbf', '0070_gameplayer_elements_packed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='gameplayer',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
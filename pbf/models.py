@@ -1,5 +1,6 @@
 import functools
 import os
+import random
 import uuid
 from enum import Enum
 from collections import Counter, defaultdict
@@ -9,15 +10,22 @@ from typing import Any, NamedTuple
 
 from django.core import checks
 from django.db import models
+from .shards import ShardedQuerySet
 
 def chunk(str: str, n: int) -> Iterable[str]:
     return [str[i:i+n] for i in range(0, len(str), n)]
 
 def check_elements(elements: dict['Elements', int], desired: list[str] | str, equiv_elements: str | None = None) -> bool:
+    return compile_threshold(threshold_key(desired), equiv_elements).check(pack_elements(elements, equiv_elements))
+
+# The original string-parsing evaluator.
+# No longer used on any hot path, but kept as the reference that the compiled thresholds are checked against
+# (see the benchmarkthresholds command and TestCheckElements).
+def check_elements_uncompiled(elements: dict['Elements', int], desired: list[str] | str, equiv_elements: str | None = None) -> bool:
     if isinstance(desired, list):
         # Doesn't pass equiv_elements,
         # but so far no spirit can have both equiv_elements and an OR threshold.
-        return any(check_elements(elements, d) for d in desired)
+        return any(check_elements_uncompiled(elements, d) for d in desired)
 
     chunks = chunk(desired, 2)
     if equiv_elements:
@@ -32,6 +40,92 @@ def check_elements(elements: dict['Elements', int], desired: list[str] | str, eq
         if e and elements[e] < amt: return False
     return True
 
+# Compiled thresholds.
+#
+# Thresholds are checked for every card and innate on every render,
+# so rather than re-parsing strings like '3M2A1N' each time,
+# each one is compiled once into the same layout as spirit_specific_resource:
+# ELEMENT_WIDTH bits per element, Sun in the lowest bits.
+# The elements a player has are packed the same way (once per render),
+# and then checking a threshold is a few integer operations.
+#
+# To compare every element at once, the lanes are split into even and odd ones,
+# so that each lane has ELEMENT_WIDTH spare bits above it.
+# Set a guard bit just above each lane of what the player has, subtract what is needed,
+# and the guard bit survives only in the lanes where the player has enough.
+
+class PackedElements(NamedTuple):
+    # Each element saturates at ELEMENT_MASK;
+    # that's fine since no threshold needs more than that of any one element.
+    packed: int
+    # Exact total of the equiv_elements (Dark Fire's Moon and Fire),
+    # kept separately because the sum of two lanes can exceed ELEMENT_MASK.
+    equiv_total: int
+
+def pack_elements(elements: dict['Elements', int], equiv_elements: str | None = None) -> PackedElements:
+    packed = 0
+    for (e, shift) in ELEMENT_SHIFTS:
+        if (n := elements[e]) > 0:
+            packed |= (n if n < ELEMENT_MASK else ELEMENT_MASK) << shift
+    equiv_total = sum(elements[ELEMENT_CHARS[c]] for c in equiv_elements) if equiv_elements else 0
+    return PackedElements(packed, equiv_total)
+
+def has_packed_elements(have: int, need: int) -> bool:
+    return (((have & EVEN_ELEMENT_LANES) | ELEMENT_GUARDS) - (need & EVEN_ELEMENT_LANES)) & ELEMENT_GUARDS == ELEMENT_GUARDS \
+        and ((((have >> ELEMENT_WIDTH) & EVEN_ELEMENT_LANES) | ELEMENT_GUARDS) - ((need >> ELEMENT_WIDTH) & EVEN_ELEMENT_LANES)) & ELEMENT_GUARDS == ELEMENT_GUARDS
+
+def packed_count(packed: int, e: 'Elements') -> int:
+    return (packed >> (ELEMENT_WIDTH * (e.value - 1))) & ELEMENT_MASK
+
+# The exact sum of each element of two packed vectors.
+# Like has_packed_elements, even and odd lanes are added separately,
+# so each lane's sum has ELEMENT_WIDTH spare bits to carry into instead of overflowing into the next lane.
+def sum_packed_elements(a: int, b: int) -> Iterable[tuple['Elements', int]]:
+    even = (a & EVEN_ELEMENT_LANES) + (b & EVEN_ELEMENT_LANES)
+    odd = ((a >> ELEMENT_WIDTH) & EVEN_ELEMENT_LANES) + ((b >> ELEMENT_WIDTH) & EVEN_ELEMENT_LANES)
+    for (e, shift) in ELEMENT_SHIFTS:
+        if (e.value - 1) % 2:
+            yield (e, (odd >> (shift - ELEMENT_WIDTH)) & ELEMENT_SUM_MASK)
+        else:
+            yield (e, (even >> shift) & ELEMENT_SUM_MASK)
+
+class CompiledThreshold(NamedTuple):
+    desired: str | tuple[str, ...]
+    # One entry per alternative of an OR threshold (just one for the usual kind):
+    # (packed elements needed, total of equiv_elements needed)
+    alternatives: tuple[tuple[int, int], ...]
+
+    def check(self, have: PackedElements) -> bool:
+        (packed, equiv_total) = have
+        for (need, equiv_need) in self.alternatives:
+            if equiv_total >= equiv_need and has_packed_elements(packed, need):
+                return True
+        return False
+
+    def with_equiv(self, equiv_elements: str | None) -> 'CompiledThreshold':
+        return compile_threshold(self.desired, equiv_elements) if equiv_elements else self
+
+# lists aren't hashable, so OR thresholds are cached by tuple
+def threshold_key(desired: list[str] | str) -> str | tuple[str, ...]:
+    return tuple(desired) if isinstance(desired, list) else desired
+
+@functools.cache
+def compile_threshold(desired: str | tuple[str, ...], equiv_elements: str | None = None) -> CompiledThreshold:
+    if isinstance(desired, tuple):
+        # Like check_elements_uncompiled, OR thresholds don't use equiv_elements.
+        return CompiledThreshold(desired, tuple(compile_threshold(d).alternatives[0] for d in desired))
+
+    need = 0
+    equiv_need = 0
+    for c in chunk(desired, 2):
+        amt = int(c[0])
+        if equiv_elements and c[1] in equiv_elements:
+            equiv_need += amt
+        elif (e := Elements.from_char(c[1])):
+            shift = ELEMENT_WIDTH * (e.value - 1)
+            # An element listed twice needs the larger amount, not the sum.
+            need = (need & ~(ELEMENT_MASK << shift)) | (max(amt, (need >> shift) & ELEMENT_MASK) << shift)
+    return CompiledThreshold(desired, ((need, equiv_need),))
 
 class Elements(Enum):
     Sun = 1
@@ -226,10 +320,10 @@ class Card(models.Model):
                 counter[Elements[e]] = 1
         return counter
 
-    def thresholds(self, elements: dict[Elements, int], equiv_elements: str | None = None) -> Iterable[Threshold]:
+    def thresholds(self, elements: PackedElements, equiv_elements: str | None = None) -> Iterable[Threshold]:
         thresholds = []
-        for t in card_thresholds.get(self.name, []):
-            thresholds.append(Threshold(t[0], t[1], check_elements(elements, t[2], equiv_elements)))
+        for (x, y, t) in compiled_card_thresholds.get(self.name, []):
+            thresholds.append(Threshold(x, y, t.with_equiv(equiv_elements).check(elements)))
         return thresholds
 
     def healing_thresholds(self, num_healing_cards: int, healing_markers: dict[str, int]) -> Iterable[Threshold]:
@@ -281,6 +375,10 @@ class Card(models.Model):
 
         return locs
 
+# Seeds for Game.rng_seed, as big as fits in a (signed) BigIntegerField.
+def new_rng_seed() -> int:
+    return random.getrandbits(63)
+
 class Game(models.Model):
     def screenshot_with_suffix(game: 'Game', filename: str) -> str:
         # If the game is set to always suffix the screenshot, do so.
@@ -298,12 +396,14 @@ class Game(models.Model):
 
         return os.path.join('screenshot', str(game.id), filename)
 
+    objects = ShardedQuerySet['Game'].as_manager()
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     turn = models.IntegerField(default=1)
     name = models.CharField(max_length=255, blank=False)
-    minor_deck = models.ManyToManyField(Card, related_name='minor_deck', blank=True)
-    major_deck = models.ManyToManyField(Card, related_name='major_deck', blank=True)
+    minor_deck = models.ManyToManyField(Card, related_name='minor_deck', blank=True, through='GameMinorDeckCard')
+    major_deck = models.ManyToManyField(Card, related_name='major_deck', blank=True, through='GameMajorDeckCard')
     discard_pile = models.ManyToManyField(Card, related_name='discard_pile', blank=True)
     screenshot = models.ImageField(upload_to=screenshot_with_suffix, blank=True)
     screenshot2 = models.ImageField(upload_to=screenshot_with_suffix, blank=True)
@@ -319,6 +419,11 @@ class Game(models.Model):
     #    ('703767917854195733', '#bot-testing'),
     #)
     discord_channel = models.CharField(max_length=255, default="", blank=True)
+    # See rng() below.
+    rng_seed = models.BigIntegerField(default=new_rng_seed)
+    rng_counter = models.IntegerField(default=0)
+    # Counts changes to the game, including to any of its players (see bump_version).
+    version = models.PositiveIntegerField(default=0)
 
     def __str__(self) -> str:
         return str(self.id)
@@ -332,13 +437,55 @@ class Game(models.Model):
     def player_count(self) -> int:
         return self.gameplayer_set.count()
 
+    # Every random choice made for a game (shuffling cards into a deck, picking a colour)
+    # gets its own random.Random, seeded from the game's seed and how many came before it.
+    # So the same seed and the same sequence of actions always give the same decks and draws
+    # (see the simulatedraws command).
+    # The count is incremented in the database, rather than saving one more than we loaded,
+    # so two requests for the same game never get the same one.
+    def rng(self) -> random.Random:
+        Game.objects.using(self._state.db).filter(id=self.id).update(rng_counter=models.F('rng_counter') + 1)
+        self.rng_counter = Game.objects.using(self._state.db).values_list('rng_counter', flat=True).get(id=self.id)
+        return random.Random((self.rng_seed << 32) | (self.rng_counter - 1))
+
+    # Makes the current transaction the only one changing this game until it ends:
+    # anyone else locking the game (or, on SQLite, writing at all) waits until then.
+    # It does that by writing to the game's row, which databases with row locks lock for just this game,
+    # while SQLite locks the whole database file for any write
+    # (which requests that write already hold from their start: see pbf/db.py).
+    # Call it before reading what's about to be changed, such as which cards are on top of a deck.
+    def lock(self) -> None:
+        Game.objects.using(self._state.db).filter(id=self.id).update(rng_counter=models.F('rng_counter'))
+
+    def deck_through(self, deck: str) -> type['GameMinorDeckCard | GameMajorDeckCard']:
+        return self._meta.get_field(deck).remote_field.through #type: ignore[union-attr,no-any-return]
+
+    # Shuffles cards into the deck (minor_deck or major_deck), at random positions from the game's rng.
+    # Cards already in the deck stay where they are.
+    def shuffle_into_deck(self, deck: str, cards: Iterable[Card]) -> None:
+        # Sorted so the positions each card gets don't depend on the order the cards came in.
+        ids = sorted({card.id for card in cards})
+        if not ids:
+            return
+        rng = self.rng()
+        through = self.deck_through(deck)
+        through.objects.using(self._state.db).bulk_create([through(game=self, card_id=id, position=rng.getrandbits(31)) for id in ids], ignore_conflicts=True) #type: ignore[misc]
+
+    # Draws (and removes) up to n cards from the top of the deck, without reshuffling.
+    def draw_from_deck(self, deck: str, n: int) -> list[Card]:
+        through = self.deck_through(deck)
+        drawn: list[GameMinorDeckCard | GameMajorDeckCard] = list(through.objects.using(self._state.db).filter(game=self).order_by('position', 'id').select_related('card')[:n])
+        through.objects.using(self._state.db).filter(id__in=[d.id for d in drawn]).delete()
+        return [d.card for d in drawn]
+
     def player_summary(self) -> Iterable[Any]:
         players = self.gameplayer_set.values_list('id', 'name', 'spirit__name', 'aspect', 'color', 'ready', named=True)
         return [p._replace(color=colors_to_circle_color_map[p.color] if p.color else p.color) for p in players]
 
     def exploratory_vengeance_location(self) -> Iterable[str]:
+        from .catalog import card_catalog
         # Template only uses the name, so just give them that
-        return [locname for (_, locname) in Card.objects.get(name='Vengeance of the Dead exploratory').location_in_game(self)]
+        return [locname for (_, locname) in card_catalog().get('Vengeance of the Dead exploratory').card().location_in_game(self)]
 
     def scenario_setup_from_deck(self) -> bool:
         scenarios = {
@@ -359,6 +506,40 @@ class Game(models.Model):
         }
         return self.scenario in scenarios
 
+# Power decks are kept shuffled:
+# every card in a deck has a random position, and cards are drawn from the lowest position up.
+# So a draw only reads and deletes the first few rows (using the index on game and position),
+# and shuffling cards into a deck (reshuffling the discard pile, returning a card, undoing a gain)
+# is just inserting them, since they'll get random positions.
+# The game's own rng (Game.shuffle_into_deck) is used for that;
+# this default is only for cards added some other way, e.g. the admin.
+def random_deck_position() -> int:
+    return random.getrandbits(31)
+
+# These tables were created by Django for the ManyToManyFields before they had positions,
+# hence the non-big AutoField.
+class GameMinorDeckCard(models.Model):
+    id = models.AutoField(primary_key=True)
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    card = models.ForeignKey(Card, on_delete=models.CASCADE)
+    position = models.IntegerField(default=random_deck_position)
+
+    class Meta:
+        db_table = 'pbf_game_minor_deck'
+        unique_together = (('game', 'card'),)
+        indexes = [models.Index(fields=['game', 'position'], name='pbf_game_minor_deck_position')]
+
+class GameMajorDeckCard(models.Model):
+    id = models.AutoField(primary_key=True)
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    card = models.ForeignKey(Card, on_delete=models.CASCADE)
+    position = models.IntegerField(default=random_deck_position)
+
+    class Meta:
+        db_table = 'pbf_game_major_deck'
+        unique_together = (('game', 'card'),)
+        indexes = [models.Index(fields=['game', 'position'], name='pbf_game_major_deck_position')]
+
 colors_to_circle_color_map = {
         'blue': '#705dff',
         'green': '#0d9501',
@@ -389,11 +570,35 @@ colors_to_emoji_map = {
 # (so can store values from 0 to 15 inclusive)
 ELEMENT_WIDTH = 4
 ELEMENT_MASK = (1 << ELEMENT_WIDTH) - 1
+# for sum_packed_elements: a lane plus the spare bits above it
+ELEMENT_SUM_MASK = (1 << (2 * ELEMENT_WIDTH)) - 1
+# for has_packed_elements: every other lane, and the bit just above each of those lanes
+EVEN_ELEMENT_LANES = sum(ELEMENT_MASK << (2 * ELEMENT_WIDTH * i) for i in range(len(Elements) // 2))
+ELEMENT_GUARDS = sum(1 << (ELEMENT_WIDTH + 2 * ELEMENT_WIDTH * i) for i in range(len(Elements) // 2))
+ELEMENT_CHARS = {c: e for c in 'SMFAWEPN' if (e := Elements.from_char(c))}
+ELEMENT_SHIFTS = [(e, ELEMENT_WIDTH * (e.value - 1)) for e in Elements]
+ELEMENT_NAMES = {e.name.lower(): e for e in Elements}
+
+# One element's count in one of GamePlayer's packed element fields,
+# so that it can still be read and set (and exported and imported) as e.g. player.temporary_sun.
+# Setting it to more than fits in the lane (or less than 0) is an error, rather than quietly storing something else.
+class ElementCount(property):
+    def __init__(self, field: str, e: Elements):
+        shift = ELEMENT_WIDTH * (e.value - 1)
+        def get(player: 'GamePlayer') -> int:
+            return packed_count(getattr(player, field), e)
+        def set(player: 'GamePlayer', n: int) -> None:
+            if not 0 <= n <= ELEMENT_MASK:
+                raise ValueError(f"{field.removesuffix('_elements_packed')} {e.name.lower()} must be from 0 to {ELEMENT_MASK}, not {n}")
+            setattr(player, field, (getattr(player, field) & ~(ELEMENT_MASK << shift)) | (n << shift))
+        super().__init__(get, set)
 
 class GamePlayer(models.Model):
     class Meta:
         ordering = ('-id', )
 
+    objects = ShardedQuerySet['GamePlayer'].as_manager()
+
     game = models.ForeignKey(Game, on_delete=models.CASCADE)
     name = models.CharField(max_length=255, blank=True)
     spirit = models.ForeignKey(Spirit, blank=False, on_delete=models.CASCADE)
@@ -426,22 +631,27 @@ class GamePlayer(models.Model):
         ('white', 'white'),
     )
     color = models.CharField(max_length=255, blank=True, choices=COLORS)
-    temporary_sun = models.IntegerField(default=0)
-    temporary_moon = models.IntegerField(default=0)
-    temporary_fire = models.IntegerField(default=0)
-    temporary_air = models.IntegerField(default=0)
-    temporary_water = models.IntegerField(default=0)
-    temporary_earth = models.IntegerField(default=0)
-    temporary_plant = models.IntegerField(default=0)
-    temporary_animal = models.IntegerField(default=0)
-    permanent_sun = models.IntegerField(default=0)
-    permanent_moon = models.IntegerField(default=0)
-    permanent_fire = models.IntegerField(default=0)
-    permanent_air = models.IntegerField(default=0)
-    permanent_water = models.IntegerField(default=0)
-    permanent_earth = models.IntegerField(default=0)
-    permanent_plant = models.IntegerField(default=0)
-    permanent_animal = models.IntegerField(default=0)
+    # Elements added with the element tracker's buttons, packed like spirit_specific_resource:
+    # ELEMENT_WIDTH bits per element (so at most ELEMENT_MASK of each), Sun in the lowest bits.
+    # Temporary ones are cleared at the end of the turn.
+    temporary_elements_packed = models.IntegerField(default=0)
+    permanent_elements_packed = models.IntegerField(default=0)
+    temporary_sun = ElementCount('temporary_elements_packed', Elements.Sun)
+    temporary_moon = ElementCount('temporary_elements_packed', Elements.Moon)
+    temporary_fire = ElementCount('temporary_elements_packed', Elements.Fire)
+    temporary_air = ElementCount('temporary_elements_packed', Elements.Air)
+    temporary_water = ElementCount('temporary_elements_packed', Elements.Water)
+    temporary_earth = ElementCount('temporary_elements_packed', Elements.Earth)
+    temporary_plant = ElementCount('temporary_elements_packed', Elements.Plant)
+    temporary_animal = ElementCount('temporary_elements_packed', Elements.Animal)
+    permanent_sun = ElementCount('permanent_elements_packed', Elements.Sun)
+    permanent_moon = ElementCount('permanent_elements_packed', Elements.Moon)
+    permanent_fire = ElementCount('permanent_elements_packed', Elements.Fire)
+    permanent_air = ElementCount('permanent_elements_packed', Elements.Air)
+    permanent_water = ElementCount('permanent_elements_packed', Elements.Water)
+    permanent_earth = ElementCount('permanent_elements_packed', Elements.Earth)
+    permanent_plant = ElementCount('permanent_elements_packed', Elements.Plant)
+    permanent_animal = ElementCount('permanent_elements_packed', Elements.Animal)
     bargain_cost_per_turn = models.IntegerField(default=0)
     bargain_paid_this_turn = models.IntegerField(default=0)
     aspect = models.CharField(max_length=255, default=None, null=True, blank=True)
@@ -457,6 +667,8 @@ class GamePlayer(models.Model):
     # but only once per turn.
     # again, to reduce some repetitive code, we'll use one field for all of these.
     spirit_specific_per_turn_flags = models.PositiveIntegerField(default=0)
+    # Counts changes to this player (see bump_version).
+    version = models.PositiveIntegerField(default=0)
 
     # Meanings for specific bits in the spirit-specific per-turn flags:
     # It's okay for different spirits to assign different meanings to the same bits.
@@ -607,14 +819,9 @@ class GamePlayer(models.Model):
     @functools.cached_property
     def elements(self) -> dict[Elements, int]:
         counter = Counter[Elements]()
-        counter[Elements.Sun] += self.temporary_sun + self.permanent_sun
-        counter[Elements.Moon] += self.temporary_moon + self.permanent_moon
-        counter[Elements.Fire] += self.temporary_fire + self.permanent_fire
-        counter[Elements.Air] += self.temporary_air + self.permanent_air
-        counter[Elements.Water] += self.temporary_water + self.permanent_water
-        counter[Elements.Earth] += self.temporary_earth + self.permanent_earth
-        counter[Elements.Plant] += self.temporary_plant + self.permanent_plant
-        counter[Elements.Animal] += self.temporary_animal + self.permanent_animal
+        for (e, n) in sum_packed_elements(self.temporary_elements_packed, self.permanent_elements_packed):
+            if n:
+                counter[e] += n
 
         if self.aspect in ('Dark Fire', 'Intensify'):
             counter[Elements.Moon] += 1
@@ -631,32 +838,75 @@ class GamePlayer(models.Model):
                 counter.update(Elements[e] for e in presence.elements.split(',') if e != 'Rot')
         return defaultdict(int, counter)
 
+    @functools.cached_property
+    def packed_elements(self) -> PackedElements:
+        return pack_elements(self.elements, self.equiv_elements())
+
     @functools.cached_property
     def cards_in_play(self) -> models.QuerySet[Card, Card]:
         return self.play.all()
 
     @functools.cached_property
-    def played_impending(self) -> models.QuerySet[Card, Card]:
-        return self.impending_with_energy.filter(gameplayerimpendingwithenergy__in_play=True)
+    def played_impending(self) -> list[Card]:
+        return [impend.card for impend in self.impending_and_cards() if impend.in_play]
+
+    def impending_and_cards(self) -> models.QuerySet['GamePlayerImpendingWithEnergy', 'GamePlayerImpendingWithEnergy']:
+        # Use the ones from prefetch_for_render if it has run,
+        # otherwise get the cards in the same query.
+        if 'gameplayerimpendingwithenergy_set' in getattr(self, '_prefetched_objects_cache', {}):
+            return self.gameplayerimpendingwithenergy_set.all()
+        return self.gameplayerimpendingwithenergy_set.select_related('card')
 
     def equiv_elements(self) -> str | None:
         if self.aspect == 'Dark Fire': return "MF"
         return None
 
-    def total_and_temporary_elements(self) -> Iterable[tuple[str, int, int]]:
+    # (element, total, temporary, how many more temporary can be added) for each element.
+    def total_and_temporary_elements(self) -> Iterable[tuple[str, int, int, int]]:
         elements = self.elements
         # not a dictionary because this is used in the template,
         # which wouldn't be able to deconstruct a tuple of (total, temporary) in the value.
-        result = [(elt.name.lower(), elements[elt], getattr(self, 'temporary_' + elt.name.lower())) for elt in Elements]
+        temporary = self.temporary_elements_packed
+        result = [(elt.name.lower(), elements[elt], packed_count(temporary, elt), ELEMENT_MASK - packed_count(temporary, elt)) for elt in Elements]
         if self.aspect == 'Dark Fire':
-            result[1:3] = [('moonfire', elements[Elements.Moon] + elements[Elements.Fire], self.temporary_moon + self.temporary_fire)]
+            # adding moonfire adds moon (see change_element)
+            result[1:3] = [('moonfire', elements[Elements.Moon] + elements[Elements.Fire], packed_count(temporary, Elements.Moon) + packed_count(temporary, Elements.Fire), result[1][3])]
         return result
 
-    def permanent_elements(self) -> dict[str, int]:
-        result = [(elt.name.lower(), getattr(self, 'permanent_' + elt.name.lower())) for elt in Elements]
+    # (element, permanent, how many more permanent can be added) for each element.
+    def permanent_elements(self) -> list[tuple[str, int, int]]:
+        permanent = self.permanent_elements_packed
+        result = [(elt.name.lower(), packed_count(permanent, elt), ELEMENT_MASK - packed_count(permanent, elt)) for elt in Elements]
         if self.aspect == 'Dark Fire':
-            result[1:3] = [('moonfire', self.permanent_moon + self.permanent_fire)]
-        return {k: v for (k, v) in result}
+            result[1:3] = [('moonfire', packed_count(permanent, Elements.Moon) + packed_count(permanent, Elements.Fire), result[1][2])]
+        return result
+
+    # Writes changes to just these fields in a single UPDATE, then reads back just those fields for rendering.
+    # Changes should be in terms of what's stored (e.g. energy=F('energy') + 1) rather than this instance's values,
+    # which may already be out of date: that way, when two requests change the same player at once
+    # (two quick clicks, or two tabs), both changes take effect instead of the later one overwriting the earlier.
+    def write(self, **changes: Any) -> None:
+        GamePlayer.objects.using(self._state.db).filter(pk=self.pk).update(**changes)
+        self.refresh_from_db(fields=list(changes))
+
+    # Adds (amount 1) or removes (amount -1) one of an element in the tracker,
+    # field being temporary_elements_packed or permanent_elements_packed.
+    # It goes through write, so two people clicking at the same time can't lose one of the clicks,
+    # and it does nothing if the count would go below 0 or above ELEMENT_MASK.
+    # moonfire (Dark Fire) adds Moon, and removes Moon if there is any, otherwise Fire.
+    def change_element(self, field: str, element: str, amount: int) -> None:
+        from django.db.models.lookups import GreaterThan, LessThan
+        candidates: list[Elements] = []
+        if element == 'moonfire':
+            candidates = [Elements.Moon] if amount > 0 else [Elements.Moon, Elements.Fire]
+        elif (e := ELEMENT_NAMES.get(element)):
+            candidates = [e]
+
+        def can_change(e: Elements) -> GreaterThan | LessThan:
+            count = models.F(field).bitrightshift(ELEMENT_WIDTH * (e.value - 1)).bitand(ELEMENT_MASK)
+            return LessThan(count, ELEMENT_MASK) if amount > 0 else GreaterThan(count, 0)
+        step = models.Case(*(models.When(can_change(e), then=models.Value(amount << (ELEMENT_WIDTH * (e.value - 1)))) for e in candidates), default=models.Value(0))
+        self.write(**{field: models.F(field) + step})
 
 
     class PresenceInfo(NamedTuple):
@@ -665,7 +915,32 @@ class GamePlayer(models.Model):
 
     @functools.cached_property
     def presences_off_track(self) -> Iterable[PresenceInfo]:
-        return self.presence_set.filter(opacity=0.0).exclude(energy='', elements='').values_list('energy', 'elements', named=True) #type: ignore[return-value]
+        # Filtered here rather than in the database, so that this uses the presence
+        # already loaded for rendering the spirit panel (see prefetch_for_render).
+        return [
+            GamePlayer.PresenceInfo(p.energy, p.elements)
+            for p in self.presence_set.all()
+            if p.opacity == 0.0 and (p.energy or p.elements)
+        ]
+
+    # Loads everything player.html looks at, one query per relation,
+    # so that the number of queries to render a player doesn't depend on how many times each is used.
+    # Relations the template won't look at for this spirit/scenario are skipped.
+    #
+    # Adding or removing cards clears that relation's prefetched cards,
+    # but other changes (such as updating Presence or impending energy) don't,
+    # so this should be called after the view has made its changes.
+    def prefetch_for_render(self) -> None:
+        lookups: list[str | models.Prefetch[Any]] = ['hand', 'discard', 'play', 'selection', 'presence_set']
+        if self.spirit.name == 'Waters':
+            lookups.append('healing')
+        if self.spirit.name in ('Fractured', 'Covets'):
+            lookups.append('days')
+        if self.spirit.name == 'Earthquakes':
+            lookups.append(models.Prefetch('gameplayerimpendingwithenergy_set', queryset=GamePlayerImpendingWithEnergy.objects.select_related('card')))
+        if self.game.scenario in ('Destiny Unfolds', 'Second Wave'):
+            lookups.append('scenario')
+        models.prefetch_related_objects([self], *lookups)
 
     # Any code that creates a GamePlayer is expected to (manually) call this function once after creating it,
     # (currently add_player in views)
@@ -705,6 +980,19 @@ class GamePlayer(models.Model):
         else:
             self.bargain_paid_this_turn += energy
 
+    # The same as gain_energy_or_pay_debt, but as changes for write,
+    # so it's based on the stored energy and bargain debt.
+    def gain_energy_or_pay_debt_changes(self, energy: int) -> dict[str, Any]:
+        from django.db.models.functions import Greatest, Least
+        if energy < 0:
+            raise ValueError(f"gained negative energy {energy}")
+        # Both use the values from before the update, as SQL does.
+        remaining_bargain_cost = models.F('bargain_cost_per_turn') - models.F('bargain_paid_this_turn')
+        return {
+            'energy': models.F('energy') + Greatest(models.Value(energy) - remaining_bargain_cost, models.Value(0)),
+            'bargain_paid_this_turn': Least(models.F('bargain_paid_this_turn') + energy, models.F('bargain_cost_per_turn')),
+        }
+
     def get_gain_energy(self) -> int:
         energy_revealed = [p.energy for p in self.presences_off_track if p.energy]
         # not using max(..., default=...) because default would be eagerly evaluated; we want lazy
@@ -744,7 +1032,8 @@ class GamePlayer(models.Model):
         return self.days
 
     def days_ordered(self) -> Iterable[Card]:
-        return self.days.order_by('type', 'cost')
+        # sorted here rather than order_by, so that it uses prefetched days
+        return sorted(self.days.all(), key=lambda card: (card.type, card.cost))
 
     # Time was originally added before the spirit_specific_resource field.
     # It was tracked by presence discs on the spirit's portrait.
@@ -779,7 +1068,7 @@ class GamePlayer(models.Model):
         # so we'll go with that.
         # If that ever stops working, we could convert them using list().
         for card in cards:
-            card.computed_thresholds = card.thresholds(self.elements, self.equiv_elements()) #type: ignore[attr-defined]
+            card.computed_thresholds = card.thresholds(self.packed_elements, self.equiv_elements()) #type: ignore[attr-defined]
         return cards
 
     def played_cards_with_thresholds(self) -> Iterable[Card]:
@@ -816,7 +1105,7 @@ class GamePlayer(models.Model):
         # to save a database query if called on any other spirit.
         # But in this case the contract is that the template will check the spirit,
         # so this method will not check, as it'd be redundant.
-        impends = self.gameplayerimpendingwithenergy_set.all().prefetch_related('card')
+        impends = self.impending_and_cards()
         # Just need the side-effect of modifying the cards.
         # still need to return the list of Impending object (not Card).
         _ = self.cards_with_thresholds(imp.card for imp in impends)
@@ -832,14 +1121,17 @@ class GamePlayer(models.Model):
         return cards
 
     def thresholds(self) -> Iterable[Threshold]:
-        elements = self.elements
+        elements = self.packed_elements
         thresholds = []
         name = self.full_name()
         equiv_elements = self.equiv_elements()
         if (name == 'Waters'):
-            if self.healing.all().contains(Card.objects.get(name='Waters Renew')):
+            from .catalog import card_catalog
+            catalog = card_catalog()
+            healing = {card.id for card in self.healing.all()}
+            if catalog.get('Waters Renew').id in healing:
                 name += ' - Renew'
-            elif self.healing.all().contains(Card.objects.get(name='Waters Taste of Ruin')):
+            elif catalog.get('Waters Taste of Ruin').id in healing:
                 name += ' - Ruin'
         if name == 'Earthquakes':
             # Show additional threshold indicators for whether enough cards are in play.
@@ -855,14 +1147,26 @@ class GamePlayer(models.Model):
             # count() won't query the database if the QuerySet have already been retrieved.
             # We evaluate elements (which will retrieve cards in play and played impending cards) at the top of this function.
             # So this is certain to not query.
-            cards_in_play = self.cards_in_play.count() + self.played_impending.count()
+            cards_in_play = self.cards_in_play.count() + len(self.played_impending)
             for (y, n) in ((475, 3), (525, 5), (580, 7)):
                 thresholds.append(Threshold(737, y, cards_in_play >= n))
-        if name in spirit_thresholds:
-            for t in spirit_thresholds[name]:
-                thresholds.append(Threshold(t[0], t[1], check_elements(elements, t[2], equiv_elements)))
+        if name in compiled_spirit_thresholds:
+            for (x, y, t) in compiled_spirit_thresholds[name]:
+                thresholds.append(Threshold(x, y, t.with_equiv(equiv_elements).check(elements)))
         return thresholds
 
+# Every view that changes a game calls this once it's done, with the player too if it changed one.
+# The versions are what the ETags of views that only read a game are made from (see views.tab),
+# so they always go up through an UPDATE, never by saving a Game or GamePlayer that was loaded earlier:
+# that would write back the version it was loaded with, and the same version could then mean two different states.
+# all_players is for a view that changed every player in the game.
+def bump_version(game_id: Any, player_id: int | None = None, *, all_players: bool = False) -> None:
+    Game.objects.filter(pk=game_id).update(version=models.F('version') + 1)
+    if all_players:
+        GamePlayer.objects.filter(game_id=game_id).update(version=models.F('version') + 1)
+    elif player_id is not None:
+        GamePlayer.objects.filter(pk=player_id).update(version=models.F('version') + 1)
+
 class GamePlayerImpendingWithEnergy(models.Model):
     gameplayer = models.ForeignKey(GamePlayer, on_delete=models.CASCADE)
     card = models.ForeignKey(Card, on_delete=models.CASCADE)
@@ -1611,6 +1915,16 @@ card_thresholds = {
 }
 
 
+# Compiled once at import; see CompiledThreshold.
+compiled_spirit_thresholds = {
+    name: [(x, y, compile_threshold(threshold_key(desired))) for (x, y, desired) in thresholds]
+    for (name, thresholds) in spirit_thresholds.items()
+}
+compiled_card_thresholds = {
+    name: [(x, y, compile_threshold(threshold_key(desired))) for (x, y, desired) in thresholds]
+    for (name, thresholds) in card_thresholds.items()
+}
+
 class Presence(models.Model):
     # Presence to the left of this X are Time
     FRACTURED_DAYS_TIME_X = 300
@@ -1623,8 +1937,24 @@ class Presence(models.Model):
     elements = models.CharField(max_length=255, blank=True)
 
 class GameLog(models.Model):
-    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    # indexed together with id instead (see Meta), which covers lookups by game too
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, db_index=False)
     date = models.DateTimeField(auto_now_add=True, blank=True)
     text = models.CharField(max_length=255, blank=False)
     spoiler_text = models.CharField(max_length=255, blank=True)
     images = models.CharField(max_length=1024, blank=True, null=True)
+
+    class Meta:
+        # Logs are only ever read for one game at a time, in order of id
+        # (which is also the order of date, but without needing to sort):
+        # the latest few, or those after a given id.
+        indexes = [models.Index(fields=['game', 'id'], name='pbf_gamelog_game_id_id')]
+
+# Log messages to relay to Discord through Redis (see relay.py), saved with their GameLog and removed once published.
+# Any left behind (because Redis was down, say) wait for the flushlogoutbox command to publish them.
+# Kept in the same database as the game they're for.
+class LogOutbox(models.Model):
+    created_at = models.DateTimeField(auto_now_add=True)
+    channel = models.CharField(max_length=255)
+    # as JSON, exactly what gets published
+    message = models.TextField()
@@ -0,0 +1,215 @@
+import json
+import os
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+from django.http import HttpRequest, HttpResponse
+from typing import Any
+
+from .models import LogOutbox
+from .shards import current_db, game_databases
+
+# Relaying log messages to Discord, via the bot.
+#
+# Messages are relayed in one batch per request, after the request's transaction commits:
+# - queue_log registers each message with transaction.on_commit,
+#   so a message for something that got rolled back is never relayed.
+# - Once committed, the message goes into the current batch (opened by RelayBatchMiddleware for each request),
+#   and the whole batch is published at the end of the request, in one Redis pipeline.
+# - Outside of a request (management commands, or tests calling add_log_msg directly) there's no batch,
+#   so each message is published as soon as it's committed.
+#
+# When relaying through Redis, each message is also saved to LogOutbox, in the same transaction as its GameLog,
+# and removed once it's published. So if Redis can't be reached (or the process dies before publishing),
+# the message is still there, and the flushlogoutbox command publishes it later.
+# Messages published in the meantime aren't held back, so they can arrive before the saved ones.
+
+# These are used for inter-process communication (IPC) between the site and the bot.
+bot_socket = None
+redis_client = None
+SOCKET_PATH = ''
+# What redis_client raises when Redis can't be reached.
+redis_errors: tuple[type[Exception], ...] = ()
+# seconds
+REDIS_TIMEOUT = 1.0
+# flushlogoutbox leaves messages younger than this (in seconds) to the request that saved them, which is still publishing them.
+OUTBOX_MIN_AGE = 30.0
+
+def set_ipc_method(method: str) -> None:
+    global bot_socket, redis_client, SOCKET_PATH, redis_errors
+    match method:
+        case 'socket':
+            SOCKET_PATH = os.getenv('SOCKET_PATH', 'si.sock')
+            import socket
+            bot_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            redis_client = None
+        case 'redis':
+            try:
+                # for type-checking, this code path is statically checked regardless of IPC_METHOD,
+                # and we don't want to force type-checking to install redis
+                import redis #type: ignore[import-not-found]
+            except ImportError as e:
+                e.add_note("If you want to use Redis to relay log messages to Discord, add `--group redis` to your `uv run` command.")
+                e.add_note("If you just want to develop the site (not running in production) and don't need to send messages to Discord, see .env.template for instructions on running in debug mode")
+                raise
+            REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
+            REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+            bot_socket = None
+            # Publishing happens at the end of requests, so a Redis that's down or slow mustn't hold them up for long:
+            # whatever isn't published in time is left in the outbox.
+            redis_client = redis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT, db=1, socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT)
+            redis_errors = (redis.exceptions.RedisError,)
+        case _:
+            raise ValueError('unknown IPC method')
+
+match os.getenv('IPC_METHOD'):
+    case None:
+        if settings.DEBUG:
+            # In development, it's still useful to run the site without a Discord bot,
+            # so IPC can be disabled by default.
+            # That way, a developer doesn't have to install IPC-related packages unless they want to.
+            print("\033[1;33mWARNING: Not sending messages to Discord. If Discord messages are needed, set IPC_METHOD to a valid value\033[0m")
+        else:
+            # For production, we want to set the IPC method immediately,
+            # so that it fails fast if a required package is not installed,
+            # rather than only surfacing the error when attempting to relay a log message.
+            set_ipc_method('redis')
+    case 'delay_setup_for_testing':
+        # For testing, we'll allow each test to individually set up its own IPC method,
+        # so as to not require Redis nor Unix sockets on systems that lack them.
+        pass
+    case ipc_method:
+        set_ipc_method(ipc_method)
+
+Message = dict[str, str | bool | int | float]
+
+# What's waiting to be published at the end of a request:
+# log messages for Discord, as (channel, message),
+# and for each game changed, what changed (see game_changed).
+class Batch:
+    def __init__(self, origin: str = ''):
+        self.origin = origin
+        self.logs: list[tuple[str, Message]] = []
+        self.changes: dict[str, dict[str, Any]] = {}
+        # ids of the logs' LogOutbox rows, by database
+        self.saved: dict[str, list[int]] = {}
+
+    def add_log(self, channel: str, message: Message, saved: tuple[str, int] | None) -> None:
+        self.logs.append((channel, message))
+        if saved is not None:
+            self.saved.setdefault(saved[0], []).append(saved[1])
+
+    def add_change(self, game_id: str, log: int | None, ready: tuple[int, bool] | None, stale: int | None) -> None:
+        change = self.changes.setdefault(game_id, {'origin': self.origin, 'logs': [], 'ready': {}, 'stale': []})
+        if log is not None:
+            change['logs'].append(log)
+        if ready is not None:
+            change['ready'][ready[0]] = ready[1]
+        if stale is not None and stale not in change['stale']:
+            change['stale'].append(stale)
+
+_batch: ContextVar[Batch | None] = ContextVar('relay_batch', default=None)
+
+def queue_log(channel: str, message: Message) -> None:
+    using = current_db()
+    saved = None
+    if redis_client:
+        saved = (using, LogOutbox.objects.using(using).create(channel=channel, message=json.dumps(message)).id)
+    transaction.on_commit(lambda: _committed(lambda batch: batch.add_log(channel, message, saved)), using=using)
+
+# Tells everyone watching the game (see events.py) that:
+# log: a new log message with this id
+# ready: a player with this id became ready (True) or not (False)
+# stale: a player with this id changed, so their tab needs to be fetched again
+def game_changed(game_id: Any, *, log: int | None = None, ready: tuple[int, bool] | None = None, stale: int | None = None) -> None:
+    transaction.on_commit(lambda: _committed(lambda batch: batch.add_change(str(game_id), log, ready, stale)), using=current_db())
+
+def _committed(add: Callable[[Batch], None]) -> None:
+    if (pending := _batch.get()) is not None:
+        add(pending)
+    else:
+        add(single := Batch())
+        publish(single)
+
+# origin identifies the page that made the request, so it can ignore the changes it made itself.
+@contextmanager
+def batch(origin: str = '') -> Iterator[None]:
+    if _batch.get() is not None:
+        # already in a batch, which will publish everything
+        yield
+        return
+    pending = Batch(origin)
+    token = _batch.set(pending)
+    try:
+        yield
+    finally:
+        _batch.reset(token)
+        if pending.logs or pending.changes:
+            publish(pending)
+
+class RelayBatchMiddleware:
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        with batch(request.headers.get('X-Page-Id', '')):
+            return self.get_response(request)
+
+def publish(batch: Batch) -> None:
+    from .events import CHANNEL_PREFIX, publish_local
+    if redis_client:
+        logs = [(channel, json.dumps(j)) for (channel, j) in batch.logs]
+        changes = [(CHANNEL_PREFIX + game_id, json.dumps(change)) for (game_id, change) in batch.changes.items()]
+        try:
+            publish_redis([(f'log-relay:{channel}', payload) for (channel, payload) in logs] + changes)
+        except redis_errors as e:
+            # The logs stay in the outbox.
+            # Changes aren't worth keeping: pages that missed them fetch everything when they reconnect.
+            if logs:
+                print(f"Couldn't relay {len(logs)} log messages, leaving them in the outbox: {e!r}")
+            return
+        for (alias, ids) in batch.saved.items():
+            LogOutbox.objects.using(alias).filter(id__in=ids).delete()
+        return
+
+    for (game_id, change) in batch.changes.items():
+        publish_local(game_id, change)
+    if bot_socket:
+        for (channel, j) in batch.logs:
+            try:
+                bot_socket.sendto(json.dumps({**j, 'channel': channel}).encode(), SOCKET_PATH)
+            except ConnectionRefusedError:
+                print("nobody there")
+            except FileNotFoundError:
+                print("no file")
+    elif batch.logs:
+        print("Neither Redis nor socket?")
+
+# payloads are (Redis channel, message already encoded as JSON)
+def publish_redis(payloads: list[tuple[str, str]]) -> None:
+    assert redis_client
+    pipe = redis_client.pipeline(transaction=False)
+    for (channel, payload) in payloads:
+        pipe.publish(channel, payload)
+    pipe.execute()
+
+# Publishes up to limit of the oldest messages in the outbox (of each database), that are at least min_age seconds old,
+# removing them from it.
+# Returns how many were published.
+# Raises whatever redis_client raises if Redis still can't be reached.
+def flush_outbox(limit: int = 100, min_age: float = OUTBOX_MIN_AGE) -> int:
+    published = 0
+    before = timezone.now() - timedelta(seconds=min_age)
+    # default too, for messages saved there before the games were sharded
+    for alias in dict.fromkeys([DEFAULT_DB_ALIAS, *game_databases()]):
+        saved = list(LogOutbox.objects.using(alias).filter(created_at__lte=before).order_by('id')[:limit])
+        if not saved:
+            continue
+        publish_redis([(f'log-relay:{m.channel}', m.message) for m in saved])
+        LogOutbox.objects.using(alias).filter(id__in=[m.id for m in saved]).delete()
+        published += len(saved)
+    return published
@@ -0,0 +1,237 @@
+import copy
+import uuid
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Model, QuerySet
+from django.http import HttpRequest, HttpResponse
+from typing import Any, TypeVar
+
+# Spreading games over several SQLite files ("shards"), so that writes to different games don't wait for each other
+# (each SQLite file has a single write lock, see pbf/db.py).
+#
+# With DB_SHARDS set (see island/settings.py), each game and everything that belongs to it
+# (its players, their cards, presence and impending cards, and the game's decks and log, and the log's outbox)
+# lives in the shard that game_db picks from the game's id.
+# Everything else (sessions, admin users) stays in default.
+# Cards and spirits are in default too, and copied into every shard after it's migrated (see copy_reference_data)
+# and whenever one is saved or deleted in default (see save_reference_row), so that queries can join game data to them there.
+# (Changes made without saving each one, such as QuerySet.update or bulk_create, need manage.py migrateshards to be copied.)
+# Unsharded (DB_SHARDS=0, the default), everything is in default as before.
+#
+# Most queries don't say which game they're for (GamePlayer.objects.get(pk=player_id), say),
+# so ShardMiddleware picks the shard for each request from its URL's game_id or player_id, and ShardRouter sends queries there.
+# Player ids say which shard they're in: each shard numbers its players from its index * PLAYER_ID_STRIDE.
+# Queries about objects that are already loaded (player.hand.all(), say) go to the object's own shard.
+# Views that make a new game say so with use_db_for_request,
+# and elsewhere (management commands, say) use_db does the same for a block of code.
+#
+# The admin only sees default.
+# After setting or raising DB_SHARDS, migrate the shards (manage.py migrateshards)
+# then move existing games to where they now belong (manage.py rebalanceshards), with the site stopped.
+
+PLAYER_ID_STRIDE = 1 << 40
+
+# Reference data, kept in default and copied to every shard.
+REFERENCE_MODELS = {'card', 'spirit'}
+
+def shard_aliases() -> list[str]:
+    return [f'shard{i}' for i in range(settings.DB_SHARDS)]
+
+# The databases that have games in them.
+def game_databases() -> list[str]:
+    return shard_aliases() or [DEFAULT_DB_ALIAS]
+
+def game_db(game_id: Any) -> str:
+    if not settings.DB_SHARDS:
+        return DEFAULT_DB_ALIAS
+    try:
+        index = uuid.UUID(str(game_id)).int % settings.DB_SHARDS
+    except ValueError:
+        # Not a game id, so there's no such game anywhere.
+        return DEFAULT_DB_ALIAS
+    return f'shard{index}'
+
+def player_db(player_id: Any) -> str:
+    if not settings.DB_SHARDS:
+        return DEFAULT_DB_ALIAS
+    index = int(player_id) // PLAYER_ID_STRIDE
+    return f'shard{index}' if index < settings.DB_SHARDS else DEFAULT_DB_ALIAS
+
+M = TypeVar('M', bound=Model)
+
+_current: ContextVar[str | None] = ContextVar('game_db', default=None)
+
+# The database of the game being worked on (default if none is).
+def current_db() -> str:
+    return _current.get() or DEFAULT_DB_ALIAS
+
+@contextmanager
+def use_db(alias: str) -> Iterator[None]:
+    token = _current.set(alias)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+def is_game_data(model: type[Model]) -> bool:
+    return model._meta.app_label == 'pbf' and model._meta.model_name not in REFERENCE_MODELS
+
+# The shard an object belongs in, going by the game or player it's for.
+def db_of(instance: Model) -> str | None:
+    from .models import Game
+    if isinstance(instance, Game):
+        return game_db(instance.pk)
+    if (game_id := getattr(instance, 'game_id', None)) is not None:
+        return game_db(game_id)
+    for attr in ('game_player_id', 'gameplayer_id'):
+        if (player_id := getattr(instance, attr, None)) is not None:
+            return player_db(player_id)
+    return None
+
+# QuerySet.create saves to the database its QuerySet picked before the object existed,
+# which with no shard chosen (outside of a request, say) is default, wherever the game belongs.
+# Games and players are created where db_of says instead (unless the QuerySet was given a database with using).
+class ShardedQuerySet(QuerySet[M]):
+    def create(self, **kwargs: Any) -> M:
+        if self._db is not None or not settings.DB_SHARDS: #type: ignore[attr-defined]
+            return super().create(**kwargs)
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=db_of(obj) or self.db)
+        return obj
+
+class ShardRouter:
+    def db_for_read(self, model: type[Model], **hints: Any) -> str | None:
+        return self._db_for(model, hints)
+
+    def db_for_write(self, model: type[Model], **hints: Any) -> str | None:
+        return self._db_for(model, hints)
+
+    def _db_for(self, model: type[Model], hints: dict[str, Any]) -> str | None:
+        if not settings.DB_SHARDS or model._meta.app_label != 'pbf':
+            return None
+        instance = hints.get('instance')
+        if instance is not None and is_game_data(type(instance)):
+            return instance._state.db or db_of(instance)
+        return _current.get()
+
+    # Players and decks refer to cards and spirits loaded from default, which have the same ids in every shard.
+    def allow_relation(self, obj1: Model, obj2: Model, **hints: Any) -> bool | None:
+        if settings.DB_SHARDS and not (is_game_data(type(obj1)) and is_game_data(type(obj2))):
+            return True
+        return None
+
+    # Shards get the whole schema, but not the migrations that change data:
+    # those change the cards and spirits in default, and copy_reference_data copies them over.
+    def allow_migrate(self, db: str, app_label: str, model_name: str | None = None, **hints: Any) -> bool | None:
+        if db in shard_aliases() and model_name is None:
+            return False
+        return None
+
+# For views that make a new game, whose id isn't in the URL: the rest of the request is about that game.
+def use_db_for_request(alias: str) -> None:
+    _current.set(alias)
+
+class ShardMiddleware:
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        token = _current.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            _current.reset(token)
+
+    def process_view(self, request: HttpRequest, view_func: Callable[..., Any], view_args: Any, view_kwargs: Any) -> None:
+        if not settings.DB_SHARDS:
+            return
+        if 'game_id' in view_kwargs:
+            _current.set(game_db(view_kwargs['game_id']))
+        elif 'player_id' in view_kwargs:
+            _current.set(player_db(view_kwargs['player_id']))
+
+View = TypeVar('View', bound=Callable[..., Any])
+
+# Like transaction.non_atomic_requests, for every database.
+def non_atomic_requests(view: View) -> View:
+    for alias in settings.DATABASES:
+        view = transaction.non_atomic_requests(using=alias)(view)
+    return view
+
+# After migrating a shard, brings its cards and spirits up to date with default's.
+# (Cards and spirits removed from default are left in the shard, where games might still have them.)
+def copy_reference_data(using: str, **kwargs: Any) -> None:
+    from .models import Card, Spirit
+    if using not in shard_aliases():
+        return
+    reference: list[Any] = [Spirit, Card]
+    for model in reference:
+        fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+        model.objects.using(using).bulk_create(model.objects.using(DEFAULT_DB_ALIAS).all(), update_conflicts=True, unique_fields=['id'], update_fields=fields)
+
+# Keeps the shards' copies of a card or spirit in step with default's when it's saved or deleted there (in the admin, say).
+def save_reference_row(sender: type[Model], instance: Model, using: str, **kwargs: Any) -> None:
+    if using != DEFAULT_DB_ALIAS:
+        return
+    model: Any = sender
+    fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+    for alias in shard_aliases():
+        # a copy, since bulk_create marks what it's given as being in alias
+        model.objects.using(alias).bulk_create([copy.copy(instance)], update_conflicts=True, unique_fields=['id'], update_fields=fields)
+
+def delete_reference_row(sender: type[Model], instance: Model, using: str, **kwargs: Any) -> None:
+    if using != DEFAULT_DB_ALIAS:
+        return
+    for alias in shard_aliases():
+        sender._default_manager.using(alias).filter(pk=instance.pk).delete()
+
+# Starts numbering a shard's players at its index * PLAYER_ID_STRIDE, so that player_db can tell where they are.
+def start_player_ids(using: str, **kwargs: Any) -> None:
+    from .models import GamePlayer
+    if using not in shard_aliases():
+        return
+    first = shard_aliases().index(using) * PLAYER_ID_STRIDE
+    table = GamePlayer._meta.db_table
+    with connections[using].cursor() as cursor:
+        cursor.execute('UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s', [first, table])
+        cursor.execute('INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)', [table, first, table])
+
+# Moves a game and everything that belongs to it from one database to another.
+# Its players (and their presence, and its log messages) are numbered afresh in the new one.
+def move_game(game_id: Any, source: str, target: str) -> None:
+    from .models import Game, GameLog, GamePlayer, Presence
+    with transaction.atomic(using=source), transaction.atomic(using=target):
+        game = Game.objects.using(source).get(pk=game_id)
+        game.save(using=target, force_insert=True)
+        _copy_many_to_many(Game, game.pk, game.pk, source, target)
+        logs = list(GameLog.objects.using(source).filter(game_id=game.pk).order_by('id'))
+        for log in logs:
+            log.pk = None
+        GameLog.objects.using(target).bulk_create(logs)
+
+        for player in GamePlayer.objects.using(source).filter(game_id=game.pk).order_by('id'):
+            old_id = player.pk
+            player.pk = None
+            player.save(using=target, force_insert=True)
+            presence = list(Presence.objects.using(source).filter(game_player_id=old_id).order_by('id'))
+            for p in presence:
+                p.pk = None
+                p.game_player_id = player.pk
+            Presence.objects.using(target).bulk_create(presence)
+            _copy_many_to_many(GamePlayer, old_id, player.pk, source, target)
+
+        Game.objects.using(source).filter(pk=game.pk).delete()
+
+def _copy_many_to_many(model: type[Model], old_id: Any, new_id: Any, source: str, target: str) -> None:
+    for field in model._meta.many_to_many:
+        through: Any = field.remote_field.through
+        attname = through._meta.get_field(field.m2m_field_name()).attname
+        rows = list(through.objects.using(source).filter(**{attname: old_id}).order_by('pk'))
+        for row in rows:
+            row.pk = None
+            setattr(row, attname, new_id)
+        through.objects.using(target).bulk_create(rows)
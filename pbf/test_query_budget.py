@@ -0,0 +1,304 @@
+import os
+import time
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from .models import Game, GamePlayer, Spirit
+from .testing import TestCase, connection, make_game
+
+os.environ['IPC_METHOD'] = 'delay_setup_for_testing'
+
+# Maximum number of SQL queries each endpoint may issue, keyed by URL name.
+#
+# These are what the endpoints issue today in the game built by setUpTestData.
+# If a change makes an endpoint cheaper, lower its budget here so it stays that way.
+# If a change has to make an endpoint more expensive, raise it,
+# and the diff to this table shows reviewers the cost.
+#
+# To see every endpoint's query count and time, run the tests with
+# QUERY_BUDGET_REPORT=some/file.tsv
+#
+# Starting and ending transactions (such as each request's own: see pbf/db.py) doesn't count.
+QUERY_BUDGETS = {
+    'home': 0,
+    'new_game': 9,
+    'import_game': 13,
+    'view_game': 5,
+    'game_setup': 10,
+    'game_logs': 2,
+    'game_events': 1,
+    'add_screenshot': 1,
+    'add_player': 10,
+    'draw_cards': 7,
+    'tab': 11,
+    'minor_deck': 3,
+    'major_deck': 3,
+    'change_game_name': 3,
+    'change_scenario': 3,
+    'edit_players': 4,
+    'deck_mods': 11,
+    'toggle_deck_mod': 34,
+    'setup_discard_pile': 3,
+    'setup_discard_card_game': 8,
+    'gain_power': 18,
+    'gain_healing': 16,
+    'take_powers': 16,
+    'take_play_powers': 16,
+    'choose_card': 19,
+    'send_days': 17,
+    'choose_days': 16,
+    'create_days': 22,
+    'setup_deck': 3,
+    'setup_discard_card_player': 8,
+    'add_to_scenario': 9,
+    'gain_scenario': 15,
+    'discard_scenario': 15,
+    'create_plant_treasure': 13,
+    'take_plant_treasure': 13,
+    'discard_pile': 3,
+    'choose_from_discard': 15,
+    'return_to_deck': 17,
+    'play_card': 14,
+    'add_energy_to_impending': 13,
+    'remove_energy_from_impending': 12,
+    'play_from_impending': 15,
+    'unplay_from_impending': 14,
+    'gain_energy_on_impending': 16,
+    'impend_card': 14,
+    'unimpend_card': 13,
+    'unplay_card': 14,
+    'forget_card': 17,
+    'reclaim_card': 12,
+    'reclaim_all': 12,
+    'discard_all': 16,
+    'discard_card': 15,
+    'pay_energy': 7,
+    'gain_energy': 7,
+    'change_energy': 6,
+    'change_bargain_cost_per_turn': 5,
+    'change_bargain_paid_this_turn': 5,
+    'change_spirit_specific_resource': 5,
+    'gain_rot': 6,
+    'convert_rot': 7,
+    'toggle_presence': 13,
+    'undo_gain_card': 16,
+    'ready': 17,
+    'add_element': 13,
+    'remove_element': 13,
+    'add_element_permanent': 13,
+    'remove_element_permanent': 13,
+    'player_actions': 25,
+}
+
+# Rendering a player's tab, for each spirit, in a game with as many players as there are colours.
+SPIRIT_TAB_BUDGET = 12
+
+# (url name, spirit or other label, queries, milliseconds, response bytes), for the report.
+report: list[tuple[str, str, int, float, int]] = []
+
+# The queries captured by a CaptureQueriesContext, other than starting and ending transactions.
+def data_queries(captured):
+    return [q for q in captured.captured_queries if not q['sql'].startswith(('BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')) and q['sql'] not in ('COMMIT', 'ROLLBACK')]
+
+class TestQueryBudget(TestCase):
+    # The spirits whose panels have the most going on,
+    # plus River as the plain one that most endpoints are exercised on.
+    SPIRITS = ['River', 'Earthquakes', 'Fractured', 'Covets', 'Rot', 'Waters']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.game = make_game(Client(), *cls.SPIRITS)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if (path := os.getenv('QUERY_BUDGET_REPORT')):
+            with open(path, 'w') as f:
+                f.write('endpoint\tspirit\tqueries\tbudget\tms\tbytes\n')
+                for (name, label, queries, ms, size) in report:
+                    budget = SPIRIT_TAB_BUDGET if label != '' and name == 'tab' else QUERY_BUDGETS[name]
+                    f.write(f'{name}\t{label}\t{queries}\t{budget}\t{ms:.1f}\t{size}\n')
+
+    def player(self, spirit):
+        return self.game.gameplayer_set.get(spirit__name=spirit)
+
+    def hit(self, name, args, data=None, label='', budget=None, query=None):
+        client = Client()
+        url = reverse(name, args=args)
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = client.post(url, data) if data is not None else client.get(url, query)
+            elapsed = time.perf_counter() - start
+        queries = data_queries(captured)
+        self.assertLess(response.status_code, 400, f'{name} {url}')
+        report.append((name, label, len(queries), elapsed * 1000, len(response.content)))
+        self.used[name] = max(self.used.get(name, 0), len(queries))
+        budget = QUERY_BUDGETS[name] if budget is None else budget
+        with self.subTest(endpoint=name, spirit=label):
+            self.assertLessEqual(len(queries), budget, f'{name} issued {len(queries)} queries, budget is {budget}:\n' + '\n'.join(q['sql'] for q in queries))
+        return response
+
+    def setUp(self):
+        self.used = {}
+
+    def test_every_endpoint(self):
+        game = self.game
+        river = self.player('River')
+        earthquakes = self.player('Earthquakes')
+        fractured = self.player('Fractured')
+        covets = self.player('Covets')
+        rot = self.player('Rot')
+        waters = self.player('Waters')
+
+        # Game-wide pages
+        self.hit('home', [])
+        self.hit('view_game', [game.id])
+        self.hit('view_game', [game.id, 'River'])
+        self.hit('add_screenshot', [game.id], {})
+        self.hit('game_setup', [game.id])
+        self.hit('game_logs', [game.id])
+        self.hit('game_logs', [game.id], query={'after': 0})
+        self.hit('game_events', [game.id])
+        self.hit('tab', [game.id, river.id])
+        self.hit('minor_deck', [game.id])
+        self.hit('major_deck', [game.id])
+        self.hit('change_game_name', [game.id], {'name': 'budget'})
+        self.hit('change_scenario', [game.id], {'scenario': 'Blitz'})
+        self.hit('edit_players', [game.id], {'id': [river.id], 'name': ['host'], 'color': [river.color]})
+        self.hit('deck_mods', [game.id])
+        self.hit('toggle_deck_mod', [game.id, 'vengeance_of_the_dead'], {})
+        self.hit('setup_discard_pile', [game.id, 'minor'])
+        self.hit('setup_discard_card_game', [game.id, game.minor_deck.first().id], {})
+        self.hit('draw_cards', [game.id], {'num_cards': 2, 'type': 'minor'})
+        self.hit('discard_pile', [river.id])
+
+        # Gaining power cards
+        self.hit('gain_power', [river.id, 'minor', 4])
+        self.hit('choose_card', [river.id, river.selection.first().id])
+        self.hit('gain_power', [river.id, 'major', 4])
+        self.hit('undo_gain_card', [river.id])
+        self.hit('take_powers', [river.id, 'minor', 1])
+        self.hit('take_play_powers', [river.id, 'minor', 1])
+        self.hit('choose_from_discard', [river.id, game.discard_pile.first().id])
+        self.hit('return_to_deck', [river.id, game.discard_pile.first().id])
+        self.hit('setup_deck', [river.id, 'minor'])
+        self.hit('setup_discard_card_player', [river.id, game.minor_deck.first().id], {})
+
+        # Scenario cards
+        card = game.minor_deck.first()
+        self.hit('add_to_scenario', [river.id, card.id], {})
+        self.hit('discard_scenario', [river.id, card.id], {})
+        game.discard_pile.remove(card)
+        river.scenario.add(card)
+        self.hit('gain_scenario', [river.id, card.id], {})
+
+        # Playing, discarding, reclaiming
+        card = river.hand.first()
+        self.hit('play_card', [river.id, card.id])
+        self.hit('unplay_card', [river.id, card.id])
+        self.hit('play_card', [river.id, card.id])
+        self.hit('discard_all', [river.id])
+        self.hit('reclaim_card', [river.id, card.id])
+        self.hit('discard_card', [river.id, card.id])
+        self.hit('reclaim_all', [river.id])
+        self.hit('discard_card', [river.id, card.id])
+        self.hit('reclaim_all', [river.id, 'water'])
+        self.hit('forget_card', [river.id, card.id])
+
+        # Impending
+        card = earthquakes.hand.first()
+        self.hit('impend_card', [earthquakes.id, card.id])
+        self.hit('add_energy_to_impending', [earthquakes.id, card.id])
+        self.hit('remove_energy_from_impending', [earthquakes.id, card.id])
+        self.hit('play_from_impending', [earthquakes.id, card.id])
+        self.hit('unplay_from_impending', [earthquakes.id, card.id])
+        self.hit('gain_energy_on_impending', [earthquakes.id])
+        self.hit('unimpend_card', [earthquakes.id, card.id])
+
+        # Spirit-specific
+        self.hit('create_days', [fractured.id, 1])
+        self.hit('choose_days', [fractured.id, fractured.days.first().id])
+        self.hit('draw_cards', [game.id], {'num_cards': 1, 'type': 'minor'})
+        self.hit('send_days', [fractured.id, game.discard_pile.first().id])
+        self.hit('create_plant_treasure', [covets.id])
+        self.hit('take_plant_treasure', [covets.id])
+        self.hit('gain_healing', [waters.id])
+        self.hit('choose_card', [waters.id, waters.selection.get(name='Waters Renew').id])
+        self.hit('gain_rot', [rot.id])
+        self.hit('convert_rot', [rot.id])
+        self.hit('change_spirit_specific_resource', [rot.id, 1])
+
+        # Energy, presence, elements
+        self.hit('pay_energy', [river.id])
+        self.hit('gain_energy', [river.id])
+        self.hit('change_energy', [river.id, 1])
+        self.hit('change_bargain_cost_per_turn', [river.id, 1])
+        self.hit('change_bargain_paid_this_turn', [river.id, 1])
+        presence = river.presence_set.last()
+        self.hit('toggle_presence', [river.id, presence.left, presence.top])
+        self.hit('add_element', [river.id, 'sun'])
+        self.hit('remove_element', [river.id, 'sun'])
+        self.hit('add_element_permanent', [river.id, 'sun'])
+        self.hit('remove_element_permanent', [river.id, 'sun'])
+        self.hit('player_actions', [river.id], {'actions': '[["change_energy", 1], ["change_energy", 1], ["toggle_presence", %d, %d], ["add_element", "sun"]]' % (presence.left, presence.top)})
+        self.hit('ready', [river.id])
+
+        # Starting new games
+        response = self.hit('new_game', [], {})
+        # redirects to /game/<id>/setup
+        new_game = Game.objects.get(id=response.url.split('/')[-2])
+        self.hit('add_player', [new_game.id], {'spirit': 'River', 'color': 'random'})
+        import io
+        self.hit('import_game', [], {'json': io.StringIO('{"players": [{"spirit": "River"}, {"spirit": "Waters"}]}')})
+
+        # Every endpoint has a budget and got exercised
+        # (url names from island/urls.py, minus those only available in DEBUG).
+        from island.urls import urlpatterns
+        names = {p.name for p in urlpatterns if getattr(p, 'name', None) and not p.name.startswith('view_screenshot')}
+        self.assertEqual(names, set(QUERY_BUDGETS))
+        self.assertEqual(set(self.used), set(QUERY_BUDGETS))
+
+    def test_tab_for_every_spirit(self):
+        # A full table of players, each spirit in turn,
+        # since each spirit's panel shows different things.
+        spirits = list(Spirit.objects.values_list('name', flat=True))
+        num_colors = len(GamePlayer.COLORS)
+        for i in range(0, len(spirits), num_colors):
+            client = Client()
+            response = client.post("/new")
+            game = Game.objects.get(id=response.url.split('/')[-2])
+            for spirit in spirits[i:i + num_colors]:
+                client.post(f"/game/{game.id}/add-player", {"spirit": spirit, "color": "random"})
+            for player in game.gameplayer_set.select_related('spirit'):
+                self.hit('tab', [game.id, player.id], label=player.spirit.name, budget=SPIRIT_TAB_BUDGET)
+
+    def test_render_does_not_depend_on_cards(self):
+        # Rendering a player takes one query per relation,
+        # not one per card or per use of the relation.
+        river = self.player('River')
+        client = Client()
+        url = reverse('tab', args=[self.game.id, river.id])
+        with CaptureQueriesContext(connection) as before:
+            client.get(url)
+        river.play.add(*self.game.minor_deck.all()[:5])
+        river.discard.add(*self.game.minor_deck.all()[5:10])
+        river.presence_set.update(opacity=0.0)
+        with CaptureQueriesContext(connection) as after:
+            client.get(url)
+        self.assertEqual(len(data_queries(before)), len(data_queries(after)))
+
+    def test_import_does_not_depend_on_size(self):
+        # A game exported by the API, imported whole and with just one of its players:
+        # the same queries, only with more rows in each bulk insert.
+        import io
+        import json
+        for player in self.game.gameplayer_set.all():
+            player.play.add(*self.game.minor_deck.all()[:2])
+            player.discard.add(*self.game.major_deck.all()[:2])
+        exported = json.loads(Client().get(f'/api/game/{self.game.id}').content)
+        self.assertEqual(len(exported['players']), len(self.SPIRITS))
+        counts = []
+        for players in (exported['players'], exported['players'][:1]):
+            self.hit('import_game', [], {'json': io.StringIO(json.dumps({**exported, 'players': players}))}, label=f'{len(players)} players')
+            counts.append(report[-1][2])
+        self.assertEqual(counts[0], counts[1])
@@ -0,0 +1,61 @@
+import uuid
+from typing import Any
+from unittest import mock
+from django import test
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.connection import ConnectionProxy
+from .models import Game
+from .shards import game_db, shard_aliases, use_db
+
+# The test cases the tests use, which also run with games sharded (DB_SHARDS=2, say: see pbf/shards.py).
+#
+# Sharded, tests use every database, and each test class keeps its games in one shard (GAMES_DB, the last),
+# where queries that don't say which database they're for go, as if each test were a request about its games.
+# (TestShards, which sees how games are spread between shards, sets shard_games to False.)
+# assertNumQueries, captureOnCommitCallbacks, connection and read_connection are about that database too.
+# Unsharded, it's all default, as with Django's own.
+
+GAMES_DB = shard_aliases()[-1] if settings.DB_SHARDS else DEFAULT_DB_ALIAS
+
+# The connection to GAMES_DB (in whichever thread uses it).
+connection: Any = ConnectionProxy(connections, GAMES_DB)
+# And the one views that only read use, which is another with DB_READ_CONNECTION set (see pbf/db.py).
+read_connection: Any = ConnectionProxy(connections, f'{GAMES_DB}_read' if settings.DB_READ_CONNECTION else GAMES_DB)
+
+# A new game id that belongs in shard alias.
+def game_id_in(alias: str) -> uuid.UUID:
+    while game_db(game_id := uuid.uuid4()) != alias:
+        pass
+    return game_id
+
+# A new game, made through the views like a host would, with a player of each of spirits.
+def make_game(client: test.Client, *spirits: str) -> Game:
+    game = Game.objects.get(id=client.post('/new')['Location'].split('/')[-2])
+    for spirit in spirits:
+        client.post(f'/game/{game.id}/add-player', {'spirit': spirit, 'color': 'random'})
+    return game
+
+class ShardedTests:
+    databases: Any = '__all__'
+    shard_games = True
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        if settings.DB_SHARDS and cls.shard_games:
+            cls.enterClassContext(use_db(GAMES_DB)) #type: ignore[attr-defined]
+            cls.enterClassContext(mock.patch.object(Game._meta.get_field('id'), 'default', lambda: game_id_in(GAMES_DB))) #type: ignore[attr-defined]
+        super().setUpClass() #type: ignore[misc]
+
+    def assertNumQueries(self, num: int, func: Any = None, *args: Any, using: str = GAMES_DB, **kwargs: Any) -> Any:
+        return super().assertNumQueries(num, func, *args, using=using, **kwargs) #type: ignore[misc]
+
+    @classmethod
+    def captureOnCommitCallbacks(cls, *, using: str = GAMES_DB, execute: bool = False) -> Any:
+        return super().captureOnCommitCallbacks(using=using, execute=execute) #type: ignore[misc]
+
+class TestCase(ShardedTests, test.TestCase):
+    pass
+
+class TransactionTestCase(ShardedTests, test.TransactionTestCase):
+    pass
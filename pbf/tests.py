@@ -1,8 +1,12 @@
+import importlib.util
 import os
 from collections import Counter
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.test import Client, SimpleTestCase
+from django.test.utils import CaptureQueriesContext
 from .models import Card, Elements, Game, GamePlayer, Spirit
+from .test_query_budget import data_queries
+from .testing import TestCase, TransactionTestCase, connection, make_game, read_connection
 import sys
 import unittest
 
@@ -60,6 +64,155 @@ class TestDecks(TestCase):
         client.post(f"/game/{game.id}/deck_mod/vengeance_of_the_dead")
         self.assertEqual(list(player.impending_with_energy.values_list('name', flat=True)), ["River's Bounty", 'Vengeance of the Dead exploratory'])
 
+    def test_draw_takes_top_of_deck(self):
+        from .models import GameMinorDeckCard
+        client = Client()
+        response = client.post("/new")
+        game = Game.objects.get(id=response.url.split('/')[-2])
+        top = list(GameMinorDeckCard.objects.filter(game=game).order_by('position', 'id').values_list('card__name', flat=True)[:4])
+        client.post(f"/game/{game.id}/draw", {'num_cards': 4, 'type': 'minor'})
+        self.assertEqual(list(game.discard_pile.order_by('name').values_list('name', flat=True)), sorted(top))
+        self.assertEqual(game.minor_deck.count(), 96)
+
+    def test_draw_queries_do_not_depend_on_deck_size(self):
+        from django.test.utils import CaptureQueriesContext
+        from .views import cards_from_deck
+        client = Client()
+        response = client.post("/new")
+        game = Game.objects.get(id=response.url.split('/')[-2])
+        with CaptureQueriesContext(connection) as full:
+            cards_from_deck(game, 4, 'minor')
+        game.minor_deck.remove(*game.minor_deck.all()[:80])
+        with CaptureQueriesContext(connection) as small:
+            cards_from_deck(game, 4, 'minor')
+        self.assertEqual(len(full), len(small))
+
+    def test_draws_never_repeat(self):
+        from .views import cards_from_deck
+        client = Client()
+        response = client.post("/new")
+        game = Game.objects.get(id=response.url.split('/')[-2])
+        drawn = []
+        for _ in range(30):
+            drawn += [card.name for card in cards_from_deck(game, 3, 'minor')]
+        # 30 draws of 3 is less than the 100 card deck
+        self.assertEqual(len(drawn), 90)
+        self.assertEqual(len(set(drawn)), 90)
+        game.discard_pile.add(*Card.objects.filter(name__in=drawn))
+        # 10 left in the deck, so this reshuffles part way through
+        drawn = [card.name for card in cards_from_deck(game, 15, 'minor')]
+        self.assertEqual(len(set(drawn)), 15)
+        self.assertEqual(game.minor_deck.count() + game.discard_pile.count(), 85)
+
+class TestGameRng(TestCase):
+    def game_with_seed(self, seed):
+        from .views import setup_decks
+        game = Game.objects.create(name='rng', rng_seed=seed)
+        setup_decks(game)
+        return game
+
+    def test_same_seed_same_draws(self):
+        from .views import cards_from_deck
+        game1 = self.game_with_seed(1234)
+        game2 = self.game_with_seed(1234)
+        for game in (game1, game2):
+            # enough to reshuffle
+            for _ in range(30):
+                game.discard_pile.add(*cards_from_deck(game, 4, 'minor'))
+        self.assertEqual(game1.rng_counter, game2.rng_counter)
+        from .models import GameMinorDeckCard
+        decks = [list(GameMinorDeckCard.objects.filter(game=game).order_by('position').values_list('card__name', flat=True)) for game in (game1, game2)]
+        self.assertEqual(decks[0], decks[1])
+        self.assertEqual(set(game1.discard_pile.values_list('name', flat=True)), set(game2.discard_pile.values_list('name', flat=True)))
+
+    def test_different_seed_different_draws(self):
+        from .views import cards_from_deck
+        self.assertNotEqual(cards_from_deck(self.game_with_seed(1), 6, 'minor'), cards_from_deck(self.game_with_seed(2), 6, 'minor'))
+
+    def test_counter_saved(self):
+        game = self.game_with_seed(99)
+        # one for each deck
+        self.assertEqual(Game.objects.get(id=game.id).rng_counter, 2)
+        game.rng()
+        self.assertEqual(Game.objects.get(id=game.id).rng_counter, 3)
+
+    def test_random_color(self):
+        colors = []
+        for _ in range(2):
+            game = self.game_with_seed(5)
+            client = Client()
+            for spirit in ('River', 'Lightning', 'Earth'):
+                client.post(f"/game/{game.id}/add-player", {"spirit": spirit, "color": "random"})
+            colors.append(list(game.gameplayer_set.order_by('id').values_list('color', flat=True)))
+        self.assertEqual(colors[0], colors[1])
+        self.assertEqual(len(set(colors[0])), 3)
+
+    def test_simulatedraws(self):
+        import contextlib
+        import io
+        from django.core.management import call_command
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            call_command('simulatedraws', seed=7, draws=30, check=True)
+        (first, _, second, _) = out.getvalue().splitlines()
+        self.assertEqual(first, second)
+        self.assertIn('1 reshuffles', first)
+        self.assertEqual(Game.objects.filter(name='simulatedraws').count(), 0)
+
+class TestCardCatalog(TestCase):
+    def test_matches_database(self):
+        from .catalog import card_catalog
+        catalog = card_catalog()
+        self.assertEqual(len(catalog), Card.objects.count())
+        for card in Card.objects.all():
+            entry = catalog.by_id[card.id]
+            self.assertEqual(entry.name, card.name)
+            self.assertEqual(entry.url, card.url())
+            self.assertEqual(entry.get_elements(), card.get_elements())
+            self.assertEqual(entry.card().pk, card.pk)
+
+    def test_lookup_by_name(self):
+        from .catalog import card_catalog
+        catalog = card_catalog()
+        card = Card.objects.get(name="River's Bounty")
+        self.assertEqual(catalog.get("River's Bounty").id, card.id)
+        self.assertEqual(catalog.get_iexact("river's BOUNTY").id, card.id)
+        with self.assertRaises(Card.DoesNotExist):
+            catalog.get("river's bounty")
+        with self.assertRaises(Card.DoesNotExist):
+            catalog.get_iexact('No Such Card')
+
+    def test_returns_copies(self):
+        from .catalog import card_catalog
+        entry = card_catalog().get("River's Bounty")
+        entry.card().name = 'changed'
+        entry.get_elements()[Elements.Sun] = 99
+        self.assertEqual(entry.card().name, "River's Bounty")
+        self.assertEqual(entry.get_elements(), Card.objects.get(name="River's Bounty").get_elements())
+
+    def test_invalidated_on_save(self):
+        from .catalog import card_catalog, invalidate_card_catalog
+        # The test's transaction is rolled back afterwards, which doesn't send post_save,
+        # so don't leave the changed cost in the catalog for other tests.
+        self.addCleanup(invalidate_card_catalog)
+        card = Card.objects.get(name="River's Bounty")
+        self.assertEqual(card_catalog().get("River's Bounty").cost, card.cost)
+        card.cost += 1
+        card.save()
+        self.assertEqual(card_catalog().get("River's Bounty").cost, card.cost)
+
+    def test_waters_thresholds_no_card_queries(self):
+        from .catalog import card_catalog
+        card_catalog()
+        game = Game.objects.create()
+        player = game.gameplayer_set.create(spirit=Spirit.objects.get(name='Waters'))
+        player.healing.add(Card.objects.get(name='Waters Renew'))
+        player = GamePlayer.objects.get(id=player.id)
+        _ = player.elements
+        # only the healing cards; the two card lookups come from the catalog
+        with self.assertNumQueries(1):
+            player.thresholds()
+
 class TestSpiritPresence(TestCase):
     def test_base_serpent_presence(self):
         from .views import make_presence
@@ -356,6 +509,22 @@ class TestSetupSpiritSpecificResources(TestCase):
         elements = {elt: count for (_, _, count, elt) in player.spirit_specific_resource_elements()}
         self.assertEqual(elements, self.expected_shifting_memory_elements())
 
+    def test_sync_fractured_time(self):
+        import contextlib
+        import io
+        from django.core.management import call_command
+        player = self.setup_game('Fractured')
+        time = player.presence_set.filter(opacity=1.0, left__lte=300).count()
+        GamePlayer.objects.filter(id=player.id).update(spirit_specific_resource=time + 1)
+        player.game.refresh_from_db()
+        (game_version, player_version) = (player.game.version, player.version)
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command('syncfracturedtime', save=True)
+        player.refresh_from_db()
+        player.game.refresh_from_db()
+        self.assertEqual(player.spirit_specific_resource, time)
+        self.assertEqual((player.game.version, player.version), (game_version + 1, player_version + 1))
+
 class TestEnergyGainAndBargainDebt(TestCase):
     def test_no_debt(self):
         player = GamePlayer(energy=1)
@@ -387,6 +556,16 @@ class TestEnergyGainAndBargainDebt(TestCase):
         self.assertEqual(player.energy, 5)
         self.assertEqual(player.bargain_paid_this_turn, 8)
 
+    def test_changes_match_in_memory(self):
+        game = Game.objects.create()
+        river = Spirit.objects.get(name='River')
+        for (energy, cost, paid, gain) in [(1, 0, 0, 2), (1, 2, 2, 4), (1, 8, 2, 4), (1, 8, 2, 6), (1, 8, 2, 10)]:
+            expected = GamePlayer(energy=energy, bargain_cost_per_turn=cost, bargain_paid_this_turn=paid)
+            expected.gain_energy_or_pay_debt(gain)
+            player = GamePlayer.objects.create(game=game, spirit=river, energy=energy, bargain_cost_per_turn=cost, bargain_paid_this_turn=paid)
+            player.write(**player.gain_energy_or_pay_debt_changes(gain))
+            self.assertEqual((player.energy, player.bargain_paid_this_turn), (expected.energy, expected.bargain_paid_this_turn))
+
 class TestMatchSpirit(TestCase):
     @staticmethod
     def try_match_spirit(*args):
@@ -1224,6 +1403,76 @@ class TestElements(TestCase):
         player.presence_set.create(left=0, top=0, opacity=0.0, elements='Water,Rot')
         self.assert_elements(player, expected_elements)
 
+    def test_temporary_and_permanent_sum_past_lane(self):
+        player = self.setup_game([])
+        player.temporary_moon = 15
+        player.permanent_moon = 15
+        player.permanent_fire = 1
+        player.temporary_animal = 9
+        player.permanent_animal = 8
+        self.assertEqual(player.elements[Elements.Moon], 30)
+        self.assertEqual(player.elements[Elements.Fire], 1)
+        self.assertEqual(player.elements[Elements.Air], 0)
+        self.assertEqual(player.elements[Elements.Animal], 17)
+
+    def test_add_remove_element(self):
+        client = Client()
+        player = self.setup_game([])
+        client.get(f'/game/{player.id}/element/water/add')
+        client.get(f'/game/{player.id}/element/water/add')
+        client.get(f'/game/{player.id}/element/water/remove')
+        client.get(f'/game/{player.id}/element-permanent/plant/add')
+        player.refresh_from_db()
+        self.assertEqual(player.temporary_water, 1)
+        self.assertEqual(player.permanent_plant, 1)
+        self.assertEqual(player.temporary_elements_packed, 1 << 16)
+        self.assertEqual(player.permanent_elements_packed, 1 << 24)
+
+    def test_element_stays_in_lane(self):
+        client = Client()
+        player = self.setup_game([])
+        client.get(f'/game/{player.id}/element/sun/remove')
+        player.temporary_earth = 15
+        player.save()
+        client.get(f'/game/{player.id}/element/earth/add')
+        player.refresh_from_db()
+        self.assertEqual(player.temporary_sun, 0)
+        self.assertEqual(player.temporary_earth, 15)
+        self.assertEqual(player.temporary_plant, 0)
+
+    def test_full_element_not_shown_added(self):
+        player = self.setup_game([])
+        player.temporary_earth = 15
+        player.permanent_earth = 14
+        player.save()
+        content = Client().get(f'/game/{player.game.id}/tab/{player.id}').content.decode()
+        self.assertIn('data-room="0" onclick="if (this.dataset.room > 0) { this.dataset.room--; queueAction(this, \'add_element\', \'earth\')', content)
+        self.assertIn('data-room="1" onclick="if (this.dataset.room > 0) { this.dataset.room--; queueAction(this, \'add_element_permanent\', \'earth\')', content)
+
+    def test_remove_moonfire(self):
+        client = Client()
+        player = self.setup_game([])
+        player.temporary_moon = 1
+        player.temporary_fire = 1
+        player.save()
+        client.get(f'/game/{player.id}/element/moonfire/remove')
+        player.refresh_from_db()
+        self.assertEqual((player.temporary_moon, player.temporary_fire), (0, 1))
+        client.get(f'/game/{player.id}/element/moonfire/remove')
+        player.refresh_from_db()
+        self.assertEqual((player.temporary_moon, player.temporary_fire), (0, 0))
+
+    def test_discard_all_clears_temporary(self):
+        client = Client()
+        player = self.setup_game([])
+        player.temporary_air = 2
+        player.permanent_air = 1
+        player.save()
+        client.post(f'/game/{player.id}/discard/all')
+        player.refresh_from_db()
+        self.assertEqual(player.temporary_elements_packed, 0)
+        self.assertEqual(player.permanent_air, 1)
+
 class TestCheckElements(TestCase):
     @staticmethod
     def check_elements(*args):
@@ -1356,6 +1605,39 @@ class TestCheckElements(TestCase):
         elements[Elements.Air] = 2
         self.assertTrue(self.check_elements(elements, '4M3F2A', 'MF'))
 
+    def test_more_than_fits_in_packed_element(self):
+        elements = Counter()
+        elements[Elements.Moon] = 20
+        elements[Elements.Fire] = 20
+        self.assertTrue(self.check_elements(elements, '9M'))
+        self.assertTrue(self.check_elements(elements, '9M9F', 'MF'))
+        self.assertFalse(self.check_elements(elements, '9M1A'))
+
+    def test_element_listed_twice(self):
+        elements = Counter()
+        elements[Elements.Sun] = 2
+        self.assertTrue(self.check_elements(elements, '2S1S'))
+
+    def test_compiled_matches_uncompiled(self):
+        import random
+        from collections import defaultdict
+        from .models import card_thresholds, check_elements_uncompiled, spirit_thresholds
+        rng = random.Random(0)
+        desireds = [t[2] for ts in (*spirit_thresholds.values(), *card_thresholds.values()) for t in ts]
+        for _ in range(20):
+            elements = defaultdict(int, {e: rng.randint(0, 6) for e in Elements})
+            for desired in desireds:
+                for equiv in (None, 'MF'):
+                    self.assertEqual(self.check_elements(elements, desired, equiv), check_elements_uncompiled(elements, desired, equiv), (desired, equiv, elements))
+
+    def test_benchmark_command(self):
+        import contextlib
+        import io
+        from django.core.management import call_command
+        # raises CommandError if any result differs
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command('benchmarkthresholds', samples=2)
+
 class TestScenario(TestCase):
     def setup_game(self, n=1):
         client = Client()
@@ -1574,11 +1856,8 @@ class TestDaysThatNeverWere(TestCase):
 class TestImpending(TestCase):
     def setup_players(self, n=1):
         client = Client()
-        client.post("/new")
-        game = Game.objects.last()
-        for i in range(n):
-            client.post(f"/game/{game.id}/add-player", {"spirit": "Earthquakes", "color": "random"})
-            self.assertEqual(game.gameplayer_set.count(), i + 1, "didn't find correct number of players; spirit not created successfully?")
+        game = make_game(client, *["Earthquakes"] * n)
+        self.assertEqual(game.gameplayer_set.count(), n, "didn't find correct number of players; spirit not created successfully?")
         return (client, *game.gameplayer_set.all())
 
     def assert_impending_energy(self, player, expected):
@@ -1628,6 +1907,19 @@ class TestImpending(TestCase):
         self.assert_impending_energy(player, [1])
         self.assert_impending_in_play(player, [True])
 
+    def test_autoplay_rerenders_elements(self):
+        client, player = self.setup_players()
+
+        cards = player.hand.filter(cost=1).values_list('id', flat=True)
+
+        client.post(f"/game/{player.id}/impend/{cards[0]}")
+        client.post(f"/game/{player.id}/discard/all")
+        content = client.post(f"/game/{player.id}/gain_energy_on_impending").content.decode()
+        # the card now in play counts towards the elements, so they and the thresholds change
+        self.assertIn(f'id="spirit-elements-{player.id}" hx-swap-oob="true"', content)
+        self.assertIn(f'id="spirit-impending-{player.id}" hx-swap-oob="true"', content)
+        self.assertIn(f'id="spirit-hand-{player.id}" hx-swap-oob="true"', content)
+
     def test_discard_impending_from_play(self):
         client, player = self.setup_players()
 
@@ -1764,11 +2056,8 @@ class TestImpending(TestCase):
 class TestCovetsGleamingShardsPlantTreasure(TestCase):
     def setup_players(self, n=1):
         client = Client()
-        client.post("/new")
-        game = Game.objects.last()
-        for i in range(n):
-            client.post(f"/game/{game.id}/add-player", {"spirit": "Covets", "color": "random"})
-            self.assertEqual(game.gameplayer_set.count(), i + 1, "didn't find correct number of players; spirit not created successfully?")
+        game = make_game(client, *["Covets"] * n)
+        self.assertEqual(game.gameplayer_set.count(), n, "didn't find correct number of players; spirit not created successfully?")
         return (client, game, *game.gameplayer_set.all())
 
     def test_create(self):
@@ -2163,6 +2452,21 @@ class TestImport(TestCase):
         player = game.gameplayer_set.first()
         self.assertEqual(list(player.gameplayerimpendingwithenergy_set.values_list('energy', flat=True)), [1])
 
+    def test_import_elements(self):
+        game = self.import_game('{"players": [{"spirit": "River", "temporary_fire": 2, "permanent_fire": 1, "permanent_animal": 3}]}')
+        player = game.gameplayer_set.first()
+        self.assertEqual(player.temporary_fire, 2)
+        self.assertEqual(player.permanent_fire, 1)
+        self.assertEqual(player.permanent_animal, 3)
+        self.assertEqual(player.temporary_sun, 0)
+
+    def test_import_too_many_elements(self):
+        import io
+        num_games = Game.objects.count()
+        with self.assertRaisesMessage(ValueError, 'temporary fire must be from 0 to 15, not 16'), self.assertLogs('django.request', 'ERROR'):
+            Client().post("/import", {"json": io.StringIO('{"players": [{"spirit": "River", "temporary_fire": 16}]}')})
+        self.assertEqual(Game.objects.count(), num_games)
+
     def test_impending_removed_from_default_minors(self):
         game = self.import_game('{"players": [{"spirit": "Earthquakes", "impending": [{"card": "Call to Isolation"}]}]}')
         minor = Card.objects.get(name="Call to Isolation")
@@ -2216,6 +2520,17 @@ class TestApi(TestCase):
         self.assertEqual(len(player['presence']), 12)
         # A number of fields not tested yet, can test them if there's any reason to believe one is more bug-prune than the other
 
+    def test_player_elements(self):
+        import json
+        client = Client()
+        game = Game.objects.create()
+        GamePlayer.objects.create(game=game, spirit=Spirit.objects.get(name='River'), temporary_water=2, permanent_sun=1)
+        player = json.loads(client.get(f'/api/game/{game.id}').content)['players'][0]
+        self.assertEqual(player['temporary_water'], 2)
+        self.assertEqual(player['permanent_sun'], 1)
+        self.assertEqual(player['temporary_sun'], 0)
+        self.assertNotIn('temporary_elements_packed', player)
+
     def test_log(self):
         import json
         client = Client()
@@ -2227,7 +2542,39 @@ class TestApi(TestCase):
         self.assertEqual(j[0]['spoiler_text'], 'hidden')
         self.assertEqual(j[0]['images'], 'island.png')
 
-class TestLog(TestCase):
+# The logs view, run as part of TestLog, and as TestLogsReadConnection with DB_READ_CONNECTION set.
+class LogsViewTests:
+    def test_logs_after(self):
+        game = Game.objects.create()
+        first = game.gamelog_set.create(text='first')
+        game.gamelog_set.create(text='second')
+        game.gamelog_set.create(text='third')
+        other_game = Game.objects.create()
+        other_game.gamelog_set.create(text='elsewhere')
+        with CaptureQueriesContext(read_connection) as captured:
+            response = Client().get(f"/game/{game.id}/logs", {'after': first.id})
+        self.assertGreater(len(data_queries(captured)), 0)
+        content = response.content.decode()
+        self.assertNotIn('first', content)
+        self.assertNotIn('elsewhere', content)
+        self.assertLess(content.index('second'), content.index('third'))
+        self.assertEqual(content.count('<li'), 2)
+
+    def test_logs_after_invalid(self):
+        game = Game.objects.create()
+        response = Client().get(f"/game/{game.id}/logs", {'after': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_logs_latest(self):
+        game = Game.objects.create()
+        for i in range(40):
+            game.gamelog_set.create(text=f'log number {i}.')
+        content = Client().get(f"/game/{game.id}/logs").content.decode()
+        self.assertEqual(content.count('<li'), 30)
+        self.assertNotIn('log number 9.', content)
+        self.assertLess(content.index('log number 10.'), content.index('log number 39.'))
+
+class TestLog(LogsViewTests, TestCase):
     @staticmethod
     def add_log_msg(*args, **kwargs):
         from .views import add_log_msg
@@ -2342,6 +2689,18 @@ class TestLog(TestCase):
         self.assertIn(player.hand.first().url(), game.gamelog_set.last().images)
         self.assertIn(player.hand.first().name, game.gamelog_set.last().spoiler_text)
 
+    def test_logs_use_index(self):
+        game = Game.objects.create()
+        for qs in (game.gamelog_set.order_by('-id')[:30], game.gamelog_set.filter(id__gt=5).order_by('id')):
+            plan = qs.explain()
+            self.assertIn('pbf_gamelog_game_id_id', plan)
+            # no sorting needed
+            self.assertNotIn('TEMP B-TREE', plan)
+
+@unittest.skipUnless(os.getenv('DB_READ_CONNECTION') == 'yes', "needs DB_READ_CONNECTION=yes")
+class TestLogsReadConnection(LogsViewTests, TransactionTestCase):
+    serialized_rollback = True
+
 # We can't run TestSocket on Windows yet.
 # It results in an error that socket.AF_UNIX is not defined.
 # Although there's a 2017 Microsoft dev blog post announcing the availability of AF_UNIX on Windows,
@@ -2359,7 +2718,7 @@ class TestSocket(TestCase):
     def setUp(self):
         import socket
         import tempfile
-        from .views import set_ipc_method
+        from .relay import set_ipc_method
 
         self.socket_path = os.path.join(tempfile.gettempdir(), 'si.sock')
         os.environ['SOCKET_PATH'] = self.socket_path
@@ -2379,21 +2738,842 @@ class TestSocket(TestCase):
         import json
 
         game = Game.objects.create(discord_channel='test_channel')
-        self.add_log_msg(game, text='hello world')
+        # messages are sent once the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_log_msg(game, text='hello world')
         data, _addr = self.socket.recvfrom(1024)
         j = json.loads(data.decode())
         self.assertEqual(j['channel'], 'test_channel')
         self.assertEqual(j['text'], 'hello world')
+        # for the bot to measure how long it takes to relay
+        log = game.gamelog_set.get()
+        self.assertEqual(j['id'], log.id)
+        self.assertEqual(j['created'], log.date.timestamp())
 
     def test_spoiler(self):
         import json
 
         game = Game.objects.create(discord_channel='test_channel')
         card = Card.objects.get(name='Irresistible Call')
-        self.add_log_msg(game, text='look at this card', cards=[card], spoiler=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_log_msg(game, text='look at this card', cards=[card], spoiler=True)
         data, _addr = self.socket.recvfrom(1024)
         j = json.loads(data.decode())
         self.assertEqual(j['channel'], 'test_channel')
         self.assertEqual(j['text'], 'look at this card: ||Irresistible Call||')
         self.assertTrue(j['spoiler'])
         self.assertIn(card.url(), j['images'])
+
+    def test_rolled_back(self):
+        import socket
+        from django.db import transaction
+
+        game = Game.objects.create(discord_channel='test_channel')
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic(using=connection.alias):
+                    self.add_log_msg(game, text='never happened')
+                    raise ValueError
+            except ValueError:
+                pass
+            self.add_log_msg(game, text='did happen')
+        data, _addr = self.socket.recvfrom(1024)
+        self.assertIn('did happen', data.decode())
+        self.socket.settimeout(0.1)
+        with self.assertRaises(socket.timeout):
+            self.socket.recvfrom(1024)
+
+# Relaying through Redis, with a stand-in for the Redis client that records what was published.
+class TestRelay(TestCase):
+    class FakeRedis:
+        def __init__(self):
+            self.up = True
+            self.executed = []
+
+        def pipeline(self, transaction):
+            redis = self
+
+            class Pipeline:
+                def __init__(self):
+                    self.published = []
+
+                def publish(self, channel, payload):
+                    self.published.append((channel, payload))
+
+                def execute(self):
+                    if not redis.up:
+                        raise ConnectionError('redis is down')
+                    redis.executed.append(self.published)
+
+            return Pipeline()
+
+    def setUp(self):
+        from unittest import mock
+        from . import relay
+        self.redis = self.FakeRedis()
+        for (attr, value) in (('redis_client', self.redis), ('redis_errors', (ConnectionError,)), ('bot_socket', None)):
+            patcher = mock.patch.object(relay, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.game = Game.objects.create(discord_channel='test_channel')
+
+    def add_logs(self, *texts):
+        from .views import add_log_msg
+        for text in texts:
+            add_log_msg(self.game, text=text)
+
+    def published(self, prefix):
+        import json
+        return [[json.loads(payload) for (channel, payload) in pipeline if channel.startswith(prefix)] for pipeline in self.redis.executed]
+
+    def test_one_pipeline_per_batch(self):
+        from .relay import batch
+        with batch('some page'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.add_logs('one', 'two', 'three')
+        self.assertEqual(len(self.redis.executed), 1)
+        self.assertEqual([[j['text'] for j in logs] for logs in self.published('log-relay:test_channel')], [['one', 'two', 'three']])
+        # and one change for the game, with all three logs
+        ids = list(self.game.gamelog_set.order_by('id').values_list('id', flat=True))
+        self.assertEqual(self.published(f'game-events:{self.game.id}'), [[{'origin': 'some page', 'logs': ids, 'ready': {}, 'stale': []}]])
+
+    def test_outbox_until_published(self):
+        from .models import LogOutbox
+        from .relay import batch
+        with batch():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.add_logs('one', 'two')
+                # saved with the logs, before anything is published
+                self.assertEqual(LogOutbox.objects.count(), 2)
+            self.assertEqual(self.redis.executed, [])
+        self.assertEqual(len(self.redis.executed), 1)
+        self.assertEqual(LogOutbox.objects.count(), 0)
+
+    def test_without_batch(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_logs('one', 'two')
+        self.assertEqual([[j['text'] for j in logs] for logs in self.published('log-relay:') if logs], [['one'], ['two']])
+
+    def test_no_channel(self):
+        self.game.discord_channel = ''
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_logs('one')
+        self.assertEqual([logs for logs in self.published('log-relay:') if logs], [])
+        self.assertEqual(len([changes for changes in self.published('game-events:') if changes]), 1)
+
+    def test_changes_merged(self):
+        from .relay import batch
+        player = self.game.gameplayer_set.create(spirit=Spirit.objects.get(name='River'), color='red')
+        client = Client()
+        with batch():
+            with self.captureOnCommitCallbacks(execute=True):
+                client.post(f"/game/{player.id}/energy/2")
+                client.post(f"/game/{player.id}/ready")
+        [[change]] = self.published('game-events:')
+        self.assertEqual(change['stale'], [player.id])
+        self.assertEqual(change['ready'], {str(player.id): True})
+        self.assertEqual(len(change['logs']), self.game.gamelog_set.count())
+
+    def test_outbox(self):
+        import contextlib
+        import io
+        from django.core.management import CommandError, call_command
+        from .models import LogOutbox
+        from .relay import batch
+        self.redis.up = False
+        with contextlib.redirect_stdout(io.StringIO()):
+            with batch():
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.add_logs('one', 'two')
+        self.assertEqual(list(LogOutbox.objects.order_by('id').values_list('channel', flat=True)), ['test_channel', 'test_channel'])
+        self.assertEqual(self.redis.executed, [])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(CommandError):
+                call_command('flushlogoutbox', min_age=0)
+            self.assertEqual(LogOutbox.objects.count(), 2)
+
+            self.redis.up = True
+            # too new: the request that saved them could still be publishing them
+            call_command('flushlogoutbox')
+            self.assertEqual(LogOutbox.objects.count(), 2)
+            call_command('flushlogoutbox', min_age=0)
+        self.assertEqual(LogOutbox.objects.count(), 0)
+        self.assertEqual([channel for (channel, _) in self.redis.executed[0]], ['log-relay:test_channel'] * 2)
+
+class TestGameEvents(TestCase):
+    # Stands in for redis.asyncio's PubSub.
+    class FakePubSub:
+        def __init__(self):
+            import asyncio
+            self.channels = set()
+            self.subscribes = 0
+            self.messages = asyncio.Queue()
+
+        async def subscribe(self, channel):
+            self.subscribes += 1
+            self.channels.add(channel)
+
+        async def unsubscribe(self, channel):
+            self.channels.discard(channel)
+
+        async def get_message(self, timeout):
+            import asyncio
+            try:
+                return await asyncio.wait_for(self.messages.get(), timeout)
+            except TimeoutError:
+                return None
+
+        def publish(self, channel, data):
+            import json
+            if channel in self.channels:
+                self.messages.put_nowait({'type': 'message', 'channel': channel.encode(), 'data': json.dumps(data).encode()})
+
+    def test_not_under_asgi(self):
+        game = Game.objects.create()
+        response = Client().get(f"/game/{game.id}/events")
+        self.assertEqual(response.status_code, 204)
+
+    async def test_stream(self):
+        import asyncio
+        from .events import hub
+        from .relay import Batch, publish
+        game = await Game.objects.acreate()
+        response = await self.async_client.get(f"/game/{game.id}/events")
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b": connected\n\n")
+
+        batch = Batch('some page')
+        batch.add_change(str(game.id), log=5, ready=None, stale=7)
+        publish(batch)
+        event = await asyncio.wait_for(anext(stream), 1.0)
+        self.assertEqual(event, b'event: change\ndata: {"origin": "some page", "logs": [5], "ready": {}, "stale": [7]}\n\n')
+
+        # When the client goes away, the ASGI handler cancels whatever's waiting on the stream.
+        waiting = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(dict(hub().listeners), {})
+
+    async def test_one_subscription_per_game(self):
+        import asyncio
+        from .events import Hub, RedisBackend
+        hub = Hub(asyncio.get_running_loop())
+        pubsub = self.FakePubSub()
+        hub.backend = RedisBackend(hub, pubsub, (ConnectionError,))
+        async with hub.listen('a') as a1, hub.listen('a') as a2, hub.listen('b') as b:
+            self.assertEqual(pubsub.subscribes, 2)
+            pubsub.publish('game-events:a', {'logs': [1]})
+            self.assertEqual(await asyncio.wait_for(a1.get(), 1.0), {'logs': [1]})
+            self.assertEqual(await asyncio.wait_for(a2.get(), 1.0), {'logs': [1]})
+            self.assertTrue(b.empty())
+        self.assertEqual(pubsub.channels, set())
+        hub.backend.reader.cancel()
+
+class TestPlayerActions(TestCase):
+    def setUp(self):
+        client = Client()
+        game = Game.objects.create()
+        client.post(f'/game/{game.id}/add-player', {'spirit': 'River', 'color': 'random'})
+        self.player = game.gameplayer_set.get()
+
+    def send(self, actions):
+        import json
+        return Client().post(f'/game/{self.player.id}/actions', {'actions': json.dumps(actions)})
+
+    def test_applies_in_order_and_renders_once(self):
+        energy = self.player.energy
+        presence = self.player.presence_set.last()
+        response = self.send([['change_energy', 3], ['change_energy', -1], ['add_element', 'fire'], ['add_element', 'fire'], ['toggle_presence', presence.left, presence.top]])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.decode().count(f'id="spirit-image-{self.player.id}"'), 1)
+        self.assertNotIn('HX-Trigger', response)
+        self.player.refresh_from_db()
+        presence.refresh_from_db()
+        self.assertEqual(self.player.energy, energy + 2)
+        self.assertEqual(self.player.temporary_fire, 2)
+        self.assertEqual(presence.opacity, 0.0)
+
+    def test_log_trigger(self):
+        card = self.player.hand.first()
+        response = self.send([['play_card', card.id], ['change_energy', 1]])
+        self.assertEqual(response['HX-Trigger'], 'newLog')
+        self.assertEqual(list(self.player.play.all()), [card])
+
+    def test_not_batched(self):
+        energy = self.player.energy
+        response = self.send([['change_energy', 1], ['ready']])
+        self.assertEqual(response.status_code, 400)
+        self.player.refresh_from_db()
+        self.assertEqual(self.player.energy, energy)
+        self.assertFalse(self.player.ready)
+
+    def test_invalid(self):
+        for actions in ([['change_energy']], [['change_energy', 'one']], [[]], {'change_energy': 1}, 'change_energy'):
+            self.assertEqual(self.send(actions).status_code, 400, actions)
+
+    def test_all_or_nothing(self):
+        energy = self.player.energy
+        response = self.send([['change_energy', 5], ['toggle_presence', 1, 1]])
+        self.assertEqual(response.status_code, 404)
+        self.player.refresh_from_db()
+        self.assertEqual(self.player.energy, energy)
+
+class TestFragments(TestCase):
+    def setUp(self):
+        client = Client()
+        self.game = Game.objects.create()
+        client.post(f'/game/{self.game.id}/add-player', {'spirit': 'River', 'color': 'random'})
+        self.player = self.game.gameplayer_set.get()
+
+    def test_only_changed_parts(self):
+        response = Client().post(f'/game/{self.player.id}/reclaim/all')
+        self.assertEqual(response['HX-Reswap'], 'none')
+        content = response.content.decode()
+        self.assertIn(f'id="spirit-hand-{self.player.id}" hx-swap-oob="true"', content)
+        self.assertIn(f'id="spirit-discard-{self.player.id}" hx-swap-oob="true"', content)
+        self.assertNotIn(f'id="spirit-elements-{self.player.id}"', content)
+        self.assertNotIn(f'id="spirit-image-{self.player.id}"', content)
+
+    def test_elements_rerender_thresholds(self):
+        content = Client().post(f'/game/{self.player.id}/element/fire/add').content.decode()
+        self.assertIn(f'id="spirit-elements-{self.player.id}" hx-swap-oob="true"', content)
+        self.assertIn(f'id="spirit-board-{self.player.id}" hx-swap-oob="true"', content)
+        self.assertIn(f'id="spirit-hand-{self.player.id}" hx-swap-oob="true"', content)
+        self.assertNotIn(f'id="spirit-discard-{self.player.id}"', content)
+
+    def test_second_wave_renders_everything(self):
+        self.game.scenario = 'Second Wave'
+        self.game.save()
+        response = Client().post(f'/game/{self.player.id}/element/fire/add')
+        self.assertNotIn('HX-Reswap', response)
+        self.assertIn(f'id="spirit-image-{self.player.id}"', response.content.decode())
+
+# Run as TestVersions, and as TestVersionsReadConnection with DB_READ_CONNECTION set.
+class VersionsTests:
+    def setUp(self):
+        client = Client()
+        self.game = Game.objects.create()
+        client.post(f'/game/{self.game.id}/add-player', {'spirit': 'River', 'color': 'random'})
+        client.post(f'/game/{self.game.id}/add-player', {'spirit': 'Lightning', 'color': 'random'})
+        self.river = self.game.gameplayer_set.get(spirit__name='River')
+        self.lightning = self.game.gameplayer_set.get(spirit__name='Lightning')
+
+    # Fetches url, then again with its ETag, which should say it's not modified.
+    # Returns the ETag.
+    def assertNotModified(self, url):
+        client = Client()
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        with CaptureQueriesContext(read_connection) as captured:
+            again = client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(len(data_queries(captured)), 1)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b'')
+        return response['ETag']
+
+    def assertModified(self, url, etag):
+        response = Client().get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_tab(self):
+        url = f'/game/{self.game.id}/tab/{self.river.id}'
+        etag = self.assertNotModified(url)
+        Client().post(f'/game/{self.river.id}/energy/1')
+        self.assertModified(url, etag)
+
+    def test_tab_other_player(self):
+        url = f'/game/{self.game.id}/tab/{self.river.id}'
+        etag = self.assertNotModified(url)
+        # the tab shows whether everyone is ready
+        Client().post(f'/game/{self.lightning.id}/ready')
+        self.assertModified(url, etag)
+
+    def test_decks(self):
+        url = f'/game/{self.game.id}/minor-deck'
+        etag = self.assertNotModified(url)
+        Client().post(f'/game/{self.river.id}/take/minor/1')
+        self.assertModified(url, etag)
+
+    def test_discard_pile(self):
+        url = f'/game/{self.river.id}/discard-pile'
+        etag = self.assertNotModified(url)
+        Client().post(f'/game/{self.game.id}/draw', {'num_cards': 2, 'type': 'minor'})
+        self.assertModified(url, etag)
+
+    def test_api(self):
+        url = f'/api/game/{self.game.id}'
+        etag = self.assertNotModified(url)
+        Client().post(f'/game/{self.game.id}/change_game_name', {'name': 'renamed'})
+        self.assertModified(url, etag)
+
+    def test_missing(self):
+        self.assertEqual(Client().get(f'/game/{self.game.id}/tab/0').status_code, 404)
+        self.assertEqual(Client().get('/game/0/discard-pile').status_code, 404)
+
+class TestVersions(VersionsTests, TestCase):
+    pass
+
+# Run with DB_READ_CONNECTION=yes in the environment,
+# where the views that only read see what's been committed on connections of their own.
+@unittest.skipUnless(os.getenv('DB_READ_CONNECTION') == 'yes', "needs DB_READ_CONNECTION=yes")
+class TestVersionsReadConnection(VersionsTests, TransactionTestCase):
+    serialized_rollback = True
+
+class TestFragmentCache(TestCase):
+    def setUp(self):
+        client = Client()
+        self.game = Game.objects.create()
+        client.post(f'/game/{self.game.id}/add-player', {'spirit': 'River', 'color': 'random'})
+        self.player = self.game.gameplayer_set.get()
+        self.url = f'/game/{self.game.id}/tab/{self.player.id}'
+
+    def hits(self):
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value('django_cache_get_hits_total', {'backend': 'locmem'}) or 0
+
+    def test_same_as_uncached(self):
+        from django.core.cache import caches
+        caches['template_fragments'].clear()
+        uncached = Client().get(self.url).content
+        hits = self.hits()
+        self.assertEqual(Client().get(self.url).content, uncached)
+        self.assertEqual(self.hits(), hits + 2)
+
+    def test_change(self):
+        Client().get(self.url)
+        presence = self.player.presence_set.last()
+        # this rendering is the one that gets cached for the new version
+        changed = Client().post(f'/game/{self.player.id}/presence/{presence.left}/{presence.top}').content.decode()
+        self.assertIn(f'left: {presence.left}px; top: {presence.top}px; opacity: 0.0', changed)
+        hits = self.hits()
+        self.assertIn(f'left: {presence.left}px; top: {presence.top}px; opacity: 0.0', Client().get(self.url).content.decode())
+        self.assertEqual(self.hits(), hits + 2)
+
+    def test_card_tiles(self):
+        from django.core.cache import caches
+        caches['template_fragments'].clear()
+        Client().get(self.url)
+        hits = self.hits()
+        # the whole hand is rendered again, but not the cards in it, whose thresholds are the same
+        Client().post(f'/game/{self.player.id}/energy/1')
+        self.assertEqual(Client().get(self.url).status_code, 200)
+        self.assertEqual(self.hits(), hits + self.player.hand.count())
+
+    def test_deploy_version(self):
+        from unittest import mock
+        from .cache import deploy_version
+        self.addCleanup(deploy_version.cache_clear)
+        deploy_version.cache_clear()
+        hashed = deploy_version()
+        deploy_version.cache_clear()
+        with mock.patch.dict(os.environ, {'DEPLOY_VERSION': 'abc123'}):
+            self.assertEqual(deploy_version(), 'abc123')
+        deploy_version.cache_clear()
+        # the same code hashes the same
+        self.assertEqual(deploy_version(), hashed)
+
+class TestViewMetrics(TestCase):
+    def setUp(self):
+        client = Client()
+        self.game = Game.objects.create()
+        client.post(f'/game/{self.game.id}/add-player', {'spirit': 'River', 'color': 'random'})
+        self.player = self.game.gameplayer_set.get()
+        self.url = f'/game/{self.game.id}/tab/{self.player.id}'
+
+    def sample(self, name, view):
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value(name, {'view': view}) or 0
+
+    def test_metrics(self):
+        from django.test.utils import CaptureQueriesContext
+        before = {name: self.sample(name, 'tab') for name in ('pbf_view_queries_count', 'pbf_view_queries_sum', 'pbf_view_render_seconds_sum', 'pbf_view_response_bytes_sum')}
+        with CaptureQueriesContext(connection) as queries:
+            response = Client().get(self.url)
+        self.assertEqual(self.sample('pbf_view_queries_count', 'tab'), before['pbf_view_queries_count'] + 1)
+        self.assertEqual(self.sample('pbf_view_queries_sum', 'tab'), before['pbf_view_queries_sum'] + len(queries))
+        self.assertGreater(self.sample('pbf_view_render_seconds_sum', 'tab'), before['pbf_view_render_seconds_sum'])
+        self.assertEqual(self.sample('pbf_view_response_bytes_sum', 'tab'), before['pbf_view_response_bytes_sum'] + len(response.content))
+
+    def test_slow_requests(self):
+        from django.test import override_settings
+        with self.assertNoLogs('pbf.slow_requests'):
+            Client().get(self.url)
+        with override_settings(SLOW_REQUEST_SECONDS=0), self.assertLogs('pbf.slow_requests') as logs:
+            Client().get(self.url)
+        self.assertIn(f'GET {self.url} (tab)', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+# Requests really running at the same time, each in its own thread with its own database connection,
+# so that they'd lose each other's changes if a view wrote back what it had read.
+class TestConcurrentWrites(TransactionTestCase):
+    serialized_rollback = True
+    THREADS = 4
+    REQUESTS = 5
+
+    def setUp(self):
+        game = Game.objects.create()
+        self.player = GamePlayer.objects.create(game=game, spirit=Spirit.objects.get(name='River'))
+
+    def hammer(self, *urls):
+        import threading
+        errors = []
+        def run(url):
+            client = Client(raise_request_exception=False)
+            try:
+                for _ in range(self.REQUESTS):
+                    if client.get(url).status_code != 200:
+                        errors.append(url)
+            finally:
+                connection.close()
+        threads = [threading.Thread(target=run, args=(url,)) for url in urls for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.player.refresh_from_db()
+
+    def test_change_energy(self):
+        self.hammer(f'/game/{self.player.id}/energy/1', f'/game/{self.player.id}/energy/-1', f'/game/{self.player.id}/energy/2')
+        self.assertEqual(self.player.energy, 2 * self.THREADS * self.REQUESTS)
+
+    def test_elements_and_energy(self):
+        self.hammer(f'/game/{self.player.id}/element/fire/add', f'/game/{self.player.id}/element-permanent/fire/add', f'/game/{self.player.id}/energy/1')
+        self.assertEqual(self.player.temporary_fire, min(15, self.THREADS * self.REQUESTS))
+        self.assertEqual(self.player.permanent_fire, min(15, self.THREADS * self.REQUESTS))
+        self.assertEqual(self.player.temporary_air, 0)
+        self.assertEqual(self.player.energy, self.THREADS * self.REQUESTS)
+
+    def test_bargain_paid_stays_within_cost(self):
+        GamePlayer.objects.filter(id=self.player.id).update(bargain_cost_per_turn=3)
+        self.hammer(f'/game/{self.player.id}/bargain_pay/1')
+        self.assertEqual(self.player.bargain_paid_this_turn, 3)
+
+# Players drawing cards from the same deck at the same time, each in their own thread with its own database connection.
+class TestConcurrentDraws(TransactionTestCase):
+    serialized_rollback = True
+    THREADS = 4
+
+    def setUp(self):
+        self.game = make_game(Client(), *('River', 'Lightning', 'Earth', 'Shadows')[:self.THREADS])
+        self.minors = set(self.game.minor_deck.values_list('id', flat=True))
+
+    # Runs draw(thread number) in each thread, until every thread has drawn the whole deck's worth between them.
+    def draw_in_threads(self, draw):
+        import contextvars
+        import threading
+        errors = []
+        def run(i):
+            try:
+                for _ in range(len(self.minors) // self.THREADS):
+                    draw(i)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+        # (each with a copy of the test's context, so that it works in the same database as the test: see pbf/testing.py)
+        threads = [threading.Thread(target=contextvars.copy_context().run, args=(run, i)) for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def assertDrewEachCardOnce(self, drawn):
+        self.assertEqual(sorted(drawn), sorted(self.minors))
+        self.assertEqual(self.game.minor_deck.count(), 0)
+
+    def test_take_powers(self):
+        players = list(self.game.gameplayer_set.all())
+        def draw(i):
+            response = Client().get(f'/game/{players[i].id}/take/minor/1')
+            self.assertEqual(response.status_code, 200)
+        self.draw_in_threads(draw)
+        self.assertDrewEachCardOnce([id for player in players for id in player.hand.filter(type=Card.MINOR).values_list('id', flat=True)])
+
+    def test_create_days(self):
+        players = list(self.game.gameplayer_set.all())
+        def draw(i):
+            response = Client().post(f'/game/{players[i].id}/create_days/1')
+            self.assertEqual(response.status_code, 200)
+        self.draw_in_threads(draw)
+        self.assertDrewEachCardOnce([id for player in players for id in player.days.filter(type=Card.MINOR).values_list('id', flat=True)])
+
+    # Outside of a request, where cards_from_deck has its own transaction.
+    def test_cards_from_deck(self):
+        from .views import cards_from_deck
+        drawn = []
+        def draw(i):
+            game = Game.objects.get(id=self.game.id)
+            drawn.extend(card.id for card in cards_from_deck(game, 1, 'minor'))
+        self.draw_in_threads(draw)
+        self.assertDrewEachCardOnce(drawn)
+
+    def test_reshuffle(self):
+        from .views import cards_from_deck
+        # Everything but a few cards is in the discard pile, so the threads all reshuffle it at about the same time.
+        deck = list(self.game.minor_deck.order_by('id'))
+        self.game.minor_deck.remove(*deck[3:])
+        self.game.discard_pile.add(*deck[3:])
+        drawn = []
+        def draw(i):
+            game = Game.objects.get(id=self.game.id)
+            drawn.extend(card.id for card in cards_from_deck(game, 1, 'minor'))
+        self.draw_in_threads(draw)
+        self.assertDrewEachCardOnce(drawn)
+        self.assertEqual(self.game.discard_pile.count(), 0)
+        self.assertEqual(self.game.gamelog_set.filter(text='Re-shuffling minor power deck').count(), 1)
+
+class TestTransactionMode(TransactionTestCase):
+    serialized_rollback = True
+
+    def setUp(self):
+        self.game = Game.objects.create()
+        self.player = GamePlayer.objects.create(game=self.game, spirit=Spirit.objects.get(name='River'))
+
+    # The BEGINs that a request to url issued.
+    def begins(self, url, data=None):
+        client = Client()
+        with CaptureQueriesContext(connection) as captured:
+            response = client.post(url, data) if data is not None else client.get(url)
+        self.assertLess(response.status_code, 400)
+        return [q['sql'] for q in captured.captured_queries if q['sql'].startswith('BEGIN')]
+
+    def test_write_views_begin_immediate(self):
+        # including GETs, which is what the page's links send
+        self.assertEqual(self.begins(f'/game/{self.player.id}/energy/1'), ['BEGIN IMMEDIATE'])
+        self.assertEqual(self.begins(f'/game/{self.game.id}/change_game_name', {'name': 'x'}), ['BEGIN IMMEDIATE'])
+        self.assertIsNone(connection.transaction_mode)
+
+    def test_read_views_begin_deferred(self):
+        self.assertEqual(self.begins(f'/game/{self.game.id}/tab/{self.player.id}'), ['BEGIN'])
+        self.assertEqual(self.begins(f'/game/{self.game.id}'), ['BEGIN'])
+        self.assertEqual(self.begins(f'/api/game/{self.game.id}'), ['BEGIN'])
+        # the same view, uploading a screenshot
+        self.assertEqual(self.begins(f'/game/{self.game.id}', {}), ['BEGIN IMMEDIATE'])
+
+    def test_rolled_back_if_view_raises(self):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from .db import TransactionModeMiddleware
+        def view(request):
+            Game.objects.filter(id=self.game.id).update(name='changed')
+            raise ValueError
+        # what Django's handler does with the view
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            try:
+                return view(request)
+            except ValueError as e:
+                middleware.process_exception(request, e)
+                return HttpResponse(status=500)
+        middleware = TransactionModeMiddleware(get_response)
+        middleware(RequestFactory().post('/'))
+        self.game.refresh_from_db()
+        self.assertNotEqual(self.game.name, 'changed')
+
+    def test_pragmas(self):
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone()[0], 1) # NORMAL
+            self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], 20000)
+
+# Run with DB_SHARDS=2 (or more) in the environment; unsharded, there's nothing to test.
+@unittest.skipUnless(int(os.getenv('DB_SHARDS', 0)) >= 2, "needs DB_SHARDS=2 or more")
+class TestShards(TestCase):
+    shard_games = False
+
+    # A new game id that belongs in shard alias.
+    def game_id_in(self, alias):
+        import uuid
+        from .shards import game_db
+        while game_db(game_id := uuid.uuid4()) != alias:
+            pass
+        return game_id
+
+    def test_new_game(self):
+        from .shards import PLAYER_ID_STRIDE, game_db
+        client = Client()
+        game_id = client.post('/new').url.split('/')[-2]
+        alias = game_db(game_id)
+        self.assertFalse(Game.objects.using('default').filter(id=game_id).exists())
+        game = Game.objects.using(alias).get(id=game_id)
+        self.assertTrue(game.minor_deck.exists())
+
+        client.post(f'/game/{game_id}/add-player', {'spirit': 'River', 'color': 'random'})
+        player = game.gameplayer_set.get()
+        self.assertEqual(player.id // PLAYER_ID_STRIDE, int(alias.removeprefix('shard')))
+        self.assertEqual(player.hand.count(), 4)
+        energy = player.energy
+        self.assertEqual(client.get(f'/game/{player.id}/energy/1').status_code, 200)
+        player.refresh_from_db()
+        self.assertEqual(player.energy, energy + 1)
+        self.assertEqual(client.get(f'/game/{game_id}/tab/{player.id}').status_code, 200)
+        self.assertEqual(client.get(f'/game/{player.id}/gain/minor/4').status_code, 200)
+        self.assertEqual(player.selection.count(), 4)
+
+    def test_transaction_on_game_db_only(self):
+        from django.db import connections
+        game = Game(id=self.game_id_in('shard1'))
+        game.save()
+        player = game.gameplayer_set.create(spirit=Spirit.objects.get(name='River'))
+        client = Client()
+        for url in (f'/game/{player.id}/energy/1', f'/game/{game.id}/tab/{player.id}'):
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connections['default']) as default, CaptureQueriesContext(connections['shard0']) as shard0:
+                    self.assertEqual(client.get(url).status_code, 200)
+                self.assertEqual(default.captured_queries, [])
+                self.assertEqual(shard0.captured_queries, [])
+
+    # Outside of a request, with no shard chosen.
+    def test_create(self):
+        for alias in ('shard0', 'shard1'):
+            with self.subTest(alias=alias):
+                game = Game.objects.create(id=self.game_id_in(alias))
+                player = GamePlayer.objects.create(game=game, spirit=Spirit.objects.get(name='River'))
+                self.assertEqual((game._state.db, player._state.db), (alias, alias))
+                self.assertTrue(GamePlayer.objects.using(alias).filter(id=player.id, game_id=game.id).exists())
+                self.assertFalse(Game.objects.using('default').filter(id=game.id).exists())
+
+    def test_reference_data(self):
+        card = Card.objects.using('default').get(name='Boon of Vigor')
+        card.cost = 7
+        card.save()
+        self.assertEqual(card._state.db, 'default')
+        for alias in ('shard0', 'shard1'):
+            self.assertEqual(Card.objects.using(alias).get(id=card.id).cost, 7)
+        spirit = Spirit.objects.using('default').create(name='Test Spirit')
+        self.assertTrue(Spirit.objects.using('shard1').filter(id=spirit.id).exists())
+        spirit.delete()
+        self.assertFalse(Spirit.objects.using('shard1').filter(id=spirit.id).exists())
+
+    def test_game_list(self):
+        import json
+        ids = set()
+        for alias in ('shard0', 'shard1'):
+            # saved to the shard its id says
+            (game := Game(id=self.game_id_in(alias))).save()
+            self.assertEqual(game._state.db, alias)
+            ids.add(str(game.id))
+        self.assertEqual({game['id'] for game in json.loads(Client().get('/api/game').content)}, ids)
+
+    def test_rebalance(self):
+        import contextlib
+        import io
+        from django.core.management import call_command
+        from .shards import PLAYER_ID_STRIDE
+        # as if from before sharding
+        game = Game(id=self.game_id_in('shard1'), name='old game')
+        game.save(using='default')
+        game.shuffle_into_deck('minor_deck', Card.objects.filter(type=Card.MINOR)[:5])
+        game.discard_pile.add(Card.objects.filter(type=Card.MAJOR).first())
+        game.gamelog_set.create(text='first')
+        game.gamelog_set.create(text='second')
+        player = GamePlayer(game=game, spirit=Spirit.objects.get(name='River'), energy=3)
+        player.save(using='default')
+        player.hand.set(Card.objects.filter(spirit__name='River'))
+        player.presence_set.create(left=1, top=2, opacity=0.0)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command('rebalanceshards')
+
+        self.assertFalse(Game.objects.using('default').exists())
+        self.assertFalse(GamePlayer.objects.using('default').exists())
+        moved = Game.objects.using('shard1').get(id=game.id)
+        self.assertEqual(moved.name, 'old game')
+        self.assertEqual(moved.minor_deck.count(), 5)
+        self.assertEqual(moved.discard_pile.count(), 1)
+        self.assertEqual(list(moved.gamelog_set.order_by('id').values_list('text', flat=True)), ['first', 'second'])
+        moved_player = moved.gameplayer_set.get()
+        self.assertEqual(moved_player.id // PLAYER_ID_STRIDE, 1)
+        self.assertEqual(moved_player.energy, 3)
+        self.assertEqual(moved_player.hand.count(), 4)
+        self.assertEqual(list(moved_player.presence_set.values_list('left', 'top', 'opacity')), [(1, 2, 0.0)])
+
+        # and now everything's where it belongs
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            call_command('rebalanceshards')
+        self.assertIn('moved 0 games', out.getvalue())
+
+# Run with DB_READ_CONNECTION=yes in the environment.
+@unittest.skipUnless(os.getenv('DB_READ_CONNECTION') == 'yes', "needs DB_READ_CONNECTION=yes")
+class TestReadConnection(TransactionTestCase):
+    serialized_rollback = True
+
+    def setUp(self):
+        self.client = Client()
+        self.game = make_game(self.client)
+        self.player = self.game.gameplayer_set.create(spirit=Spirit.objects.get(name='River'), color='blue')
+
+    # How many queries a request to url made on each connection.
+    def queries(self, url):
+        with CaptureQueriesContext(connection) as primary, CaptureQueriesContext(read_connection) as read:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return tuple(len(data_queries(captured)) for captured in (primary, read))
+
+    def test_read_views(self):
+        for url in (f'/game/{self.game.id}/tab/{self.player.id}', f'/game/{self.game.id}/minor-deck', f'/game/{self.player.id}/discard-pile',
+                    f'/game/{self.game.id}/logs', f'/api/game/{self.game.id}', '/api/game'):
+            with self.subTest(url=url):
+                (primary, read) = self.queries(url)
+                self.assertEqual(primary, 0)
+                self.assertGreater(read, 0)
+
+    def test_write_views(self):
+        (primary, read) = self.queries(f'/game/{self.player.id}/energy/1')
+        self.assertGreater(primary, 0)
+        self.assertEqual(read, 0)
+        # and the read connection sees what was written
+        self.assertEqual(Game.objects.using(read_connection.alias).get(id=self.game.id).version, self.game.version + 1)
+
+    def test_read_only(self):
+        from django.db import OperationalError
+        with read_connection.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA query_only').fetchone()[0], 1)
+        with self.assertRaises(OperationalError):
+            Game.objects.using(read_connection.alias).filter(id=self.game.id).update(name='x')
+
+# The bot's dependencies are a group of their own (see pyproject.toml), which the site's tests don't otherwise need.
+@unittest.skipUnless(importlib.util.find_spec('discord') and importlib.util.find_spec('structlog'), "needs the bot group")
+class TestBotRelay(SimpleTestCase):
+    # Stands in for a Discord channel whose sends take a while.
+    class SlowChannel:
+        def __init__(self, id):
+            self.id = id
+            self.sent = []
+
+        async def send(self, content, **kwargs):
+            import asyncio
+            await asyncio.sleep(0.05)
+            self.sent.append(content)
+
+    def setUp(self):
+        from unittest import mock
+        with mock.patch.dict(os.environ, {'IPC_METHOD': 'socket'}):
+            import bot
+        self.bot = bot
+        self.channels = {id: type('Channel', (self.SlowChannel, bot.discord.abc.Messageable), {})(id) for id in (1, 2)}
+        for patcher in (mock.patch.object(bot.client, 'get_channel', self.channels.get), mock.patch.object(bot, 'RELAY_QUIET_SECONDS', 0.0)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_channels_at_once(self):
+        import asyncio
+        scheduler = self.bot.RelayScheduler()
+        await scheduler.add(1, 'one', {'text': 'one'})
+        # channel 1's first message is being sent...
+        await asyncio.sleep(0.01)
+        self.assertEqual(scheduler.sent_at[1], self.bot.collections.deque(maxlen=self.bot.CHANNEL_RATE_LIMIT[0]))
+        # ...when channel 2 gets one
+        await scheduler.add(2, 'two', {'text': 'two'})
+        self.assertEqual(scheduler.pending, 2)
+        await scheduler.drain()
+        self.assertEqual([channel.sent for channel in self.channels.values()], [['one'], ['two']])
+        self.assertEqual(scheduler.pending, 0)
@@ -1,69 +1,32 @@
 import json
 import itertools
-import random
 import os
 
 from collections.abc import Iterable
-from django.conf import settings
+from contextvars import ContextVar
+from django.db import transaction
+from django.db.models import F, Subquery
+from django.db.models.functions import Greatest, Least
 from django.forms import ModelForm
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render, get_object_or_404, redirect
-from django.urls import reverse
+from django.template.loader import render_to_string
+from django.urls import NoReverseMatch, resolve, reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import etag
 from typing import Any, TYPE_CHECKING, overload
 
-from .models import Card, Elements, Game, GameLog, GamePlayer, GamePlayerImpendingWithEnergy, Presence, Spirit
+from . import relay
+from .cache import deploy_version
+from .db import read_only, write_transaction
+from .shards import current_db, game_db, use_db_for_request
+from .catalog import CatalogCard, card_catalog
+from .models import Card, Elements, Game, GameLog, GamePlayer, GamePlayerImpendingWithEnergy, Presence, Spirit, bump_version
 
 if TYPE_CHECKING:
+    from django.db.models.fields.related_descriptors import ManyRelatedManager
     from .models import Card_ManyRelatedManager
 
-# These are used for inter-process communication (IPC) between the site and the bot.
-bot_socket = None
-redis_client = None
-SOCKET_PATH = ''
-
-def set_ipc_method(method: str) -> None:
-    global bot_socket, redis_client, SOCKET_PATH
-    match method:
-        case 'socket':
-            SOCKET_PATH = os.getenv('SOCKET_PATH', 'si.sock')
-            import socket
-            bot_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
-            redis_client = None
-        case 'redis':
-            try:
-                # for type-checking, this code path is statically checked regardless of IPC_METHOD,
-                # and we don't want to force type-checking to install redis
-                import redis #type: ignore[import-not-found]
-            except ImportError as e:
-                e.add_note("If you want to use Redis to relay log messages to Discord, add `--group redis` to your `uv run` command.")
-                e.add_note("If you just want to develop the site (not running in production) and don't need to send messages to Discord, see .env.template for instructions on running in debug mode")
-                raise
-            REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
-            REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
-            bot_socket = None
-            redis_client = redis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT, db=1)
-        case _:
-            raise ValueError('unknown IPC method')
-
-match os.getenv('IPC_METHOD'):
-    case None:
-        if settings.DEBUG:
-            # In development, it's still useful to run the site without a Discord bot,
-            # so IPC can be disabled by default.
-            # That way, a developer doesn't have to install IPC-related packages unless they want to.
-            print("\033[1;33mWARNING: Not sending messages to Discord. If Discord messages are needed, set IPC_METHOD to a valid value\033[0m")
-        else:
-            # For production, we want to set the IPC method immediately,
-            # so that it fails fast if a required package is not installed,
-            # rather than only surfacing the error when attempting to relay a log message.
-            set_ipc_method('redis')
-    case 'delay_setup_for_testing':
-        # For testing, we'll allow each test to individually set up its own IPC method,
-        # so as to not require Redis nor Unix sockets on systems that lack them.
-        pass
-    case ipc_method:
-        set_ipc_method(ipc_method)
-
 # If player is set, the text will be prefixed with their colour and spirit name.
 #
 # If cards is set:
@@ -103,28 +66,19 @@ def add_log_msg(game: Game, *, text: str, spoiler_text: str | None = None, playe
         if cards:
             text += ': ' + card_names
         log = game.gamelog_set.create(text=text, spoiler_text=spoiler_text or '', images=images)
-    send_log(log)
+    relay.game_changed(game.id, log=log.id)
+    send_log(game, log)
 
-def send_log(log: GameLog) -> None:
-    if not (channel := log.game.discord_channel):
+def send_log(game: Game, log: GameLog) -> None:
+    if not (channel := game.discord_channel):
         return
-    j: dict[str, str | bool] = {'text': f"{log.text} ||{log.spoiler_text}||" if log.spoiler_text else log.text}
+    # id and created let the bot trace how long each message takes to get to Discord (see bot.py)
+    j: relay.Message = {'text': f"{log.text} ||{log.spoiler_text}||" if log.spoiler_text else log.text, 'id': log.id, 'created': log.date.timestamp()}
     if log.images:
         j['images'] = log.images
     if log.spoiler_text:
         j['spoiler'] = True
-    if redis_client:
-        redis_client.publish(f'log-relay:{channel}', json.dumps(j))
-    elif bot_socket:
-        j['channel'] = channel
-        try:
-            bot_socket.sendto(json.dumps(j).encode(), SOCKET_PATH)
-        except ConnectionRefusedError:
-            print("nobody there")
-        except FileNotFoundError:
-            print("no file")
-    else:
-        print("Neither Redis nor socket?")
+    relay.queue_log(channel, j)
 
 class GameForm(ModelForm): #type: ignore[type-arg]
     class Meta:
@@ -140,28 +94,116 @@ def with_log_trigger(response: HttpResponse) -> HttpResponse:
     response['HX-Trigger'] = 'newLog'
     return response
 
+# Every view that touches a player also touches their game and spirit, so get them in the same query.
+def get_player(player_id: int) -> GamePlayer:
+    return get_object_or_404(GamePlayer.objects.select_related('game', 'spirit'), pk=player_id)
+
+# Set while player_actions applies each action, which renders the player once at the end instead.
+_render_deferred: ContextVar[bool] = ContextVar('render_deferred', default=False)
+
+# For the render helpers below, once a view has changed the player:
+# bumps the versions, then reloads the player, along with the version it's now at,
+# unless nothing about to be rendered is cached (reload=False).
+# The cached parts of player.html are keyed by that version (see pbf/cache.py),
+# so what's rendered must be (at least) as new as the version; what the view loaded at the start may not be.
+def changed(player: GamePlayer, reload: bool = True) -> None:
+    bump_version(player.game_id, player.id)
+    if reload:
+        # only its own columns, keeping the game and spirit it was loaded with (which don't change)
+        player.refresh_from_db(fields=[f.attname for f in GamePlayer._meta.concrete_fields if not f.is_relation])
+
+# Renders player.html after loading everything it needs (see GamePlayer.prefetch_for_render).
+# Done at render time rather than when the player is loaded,
+# so that it picks up whatever the view just changed.
+def render_player(request: HttpRequest, player: GamePlayer, context: dict[str, Any] | None = None) -> HttpResponse:
+    # Only views that changed the player render it this way (tab renders it for viewing),
+    # so anyone else looking at this player needs to fetch them again.
+    relay.game_changed(player.game_id, stale=player.id)
+    if _render_deferred.get():
+        return HttpResponse()
+    changed(player)
+    player.prefetch_for_render()
+    return render(request, 'player.html', {'player': player, **(context or {})})
+
+# The parts of player.html that can be rendered on their own (see render_player_fragments), by name.
+# The outermost element of each has an id, and when rendered as a fragment, hx-swap-oob,
+# so that it replaces the same part of the page.
+PLAYER_FRAGMENTS = {
+    'presence': 'spirit_board.html',
+    'ready': 'ready_button.html',
+    'elements': 'elements.html',
+    'energy': 'energy.html',
+    'resource': 'spirit_specific_resource.html',
+    'selection': 'selection.html',
+    'hand': 'play_and_hand.html',
+    'impending': 'impending.html',
+    'discard': 'discard.html',
+}
+# The fragments that show thresholds, which change whenever the elements do.
+THRESHOLD_FRAGMENTS = ('presence', 'selection', 'hand', 'impending')
+# The fragments with parts that are cached (see changed).
+CACHED_FRAGMENTS = {'presence', 'hand'}
+
+# For views that change only some parts of a player:
+# renders just the fragments (see PLAYER_FRAGMENTS) that the view says it may have changed,
+# all swapped in out-of-band, rather than all of player.html.
+def render_player_fragments(request: HttpRequest, player: GamePlayer, *fragments: str) -> HttpResponse:
+    names = set(fragments)
+    if 'elements' in names:
+        if player.game.scenario == 'Second Wave':
+            # Its cards show thresholds too, outside of any fragment.
+            return render_player(request, player)
+        names.update(THRESHOLD_FRAGMENTS)
+    relay.game_changed(player.game_id, stale=player.id)
+    if _render_deferred.get():
+        return HttpResponse()
+    changed(player, reload=not names.isdisjoint(CACHED_FRAGMENTS))
+    player.prefetch_for_render()
+    response = HttpResponse(''.join(render_to_string(template, {'player': player, 'oob': True}, request) for (name, template) in PLAYER_FRAGMENTS.items() if name in names))
+    # There's nothing to swap into the element that made the request.
+    response['HX-Reswap'] = 'none'
+    return response
+
+# Renders part of player.html (energy, spirit-specific resources) after a view changed just that part.
+def render_player_part(request: HttpRequest, template: str, player: GamePlayer) -> HttpResponse:
+    relay.game_changed(player.game_id, stale=player.id)
+    if _render_deferred.get():
+        return HttpResponse()
+    bump_version(player.game_id, player.id)
+    return render(request, template, {'player': player})
+
+@read_only
 def home(request: HttpRequest) -> HttpResponse:
     return render(request, 'index.html')
 
 # For use in development only, not production.
+@read_only
 def view_screenshot(request: HttpRequest, game_id: str | None = None, filename: str | None = None) -> HttpResponse:
     with open(os.path.join(*[s for s in ['screenshot', game_id, filename] if s]), mode='rb') as f:
         return HttpResponse(f.read(), content_type='image/jpeg')
 
 def new_game(request: HttpRequest) -> HttpResponse:
     game = Game(name='My Game')
-    game.save()
-    game.minor_deck.set(Card.objects.filter(type=Card.MINOR, exclude_from_deck=False))
-    game.major_deck.set(Card.objects.filter(type=Card.MAJOR, exclude_from_deck=False))
+    use_db_for_request(game_db(game.id))
+    # The request's own transaction is on the database it started with (see pbf/db.py), which may not be the game's.
+    with write_transaction():
+        game.save()
+        setup_decks(game)
     return redirect(reverse('game_setup', args=[game.id]))
 
+def setup_decks(game: Game) -> None:
+    game.shuffle_into_deck('minor_deck', Card.objects.filter(type=Card.MINOR, exclude_from_deck=False).only('id'))
+    game.shuffle_into_deck('major_deck', Card.objects.filter(type=Card.MAJOR, exclude_from_deck=False).only('id'))
+
 def edit_players(request: HttpRequest, game_id: str) -> HttpResponse:
     game = get_object_or_404(Game, pk=game_id)
     players = zip(request.POST.getlist('id'), request.POST.getlist('name'), request.POST.getlist('color'))
     GamePlayer.objects.bulk_update([GamePlayer(id=id, name=name, color=color) for id, name, color in players], ['name', 'color'])
+    bump_version(game.id, all_players=True)
 
     return redirect(reverse('game_setup', args=[game.id]))
 
+@read_only
 def game_setup(request: HttpRequest, game_id: str) -> HttpResponse:
     game = get_object_or_404(Game, pk=game_id)
 
@@ -252,15 +294,18 @@ def game_setup(request: HttpRequest, game_id: str) -> HttpResponse:
 def change_game_name(request: HttpRequest, game_id: str) -> HttpResponse:
     game = get_object_or_404(Game, pk=game_id)
     game.name = request.POST['name']
-    game.save()
+    game.save(update_fields=['name'])
+    bump_version(game.id)
     return redirect(reverse('game_setup', args=[game.id]))
 
 def change_scenario(request: HttpRequest, game_id: str) -> HttpResponse:
     game = get_object_or_404(Game, pk=game_id)
     game.scenario = request.POST['scenario']
-    game.save()
+    game.save(update_fields=['scenario'])
+    bump_version(game.id)
     return redirect(reverse('game_setup', args=[game.id]))
 
+@read_only
 def deck_mods(request: HttpRequest, game_id: str) -> HttpResponse:
     game = get_object_or_404(Game, pk=game_id)
     return render(request, 'deck_mods.html', { 'game': game })
@@ -270,6 +315,9 @@ def toggle_deck_mod(request: HttpRequest, game_id: str, mod: str) -> HttpRespons
 
     def replace_card(loc: Card.Location, old: Card, new: Card) -> None:
         match loc:
+            case Card.LocGame('minor_deck' | 'major_deck' as attr):
+                # keep the new card where the old one was in the deck
+                game.deck_through(attr).objects.filter(game=game, card=old).update(card=new)
             case Card.LocGame(attr):
                 getattr(old, attr).remove(game)
                 getattr(new, attr).add(game)
@@ -284,8 +332,8 @@ def toggle_deck_mod(request: HttpRequest, game_id: str, mod: str) -> HttpRespons
 
     match mod:
         case 'vengeance_of_the_dead':
-            original = Card.objects.get(name='Vengeance of the Dead')
-            exploratory = Card.objects.get(name='Vengeance of the Dead exploratory')
+            original = card_catalog().get('Vengeance of the Dead').card()
+            exploratory = card_catalog().get('Vengeance of the Dead exploratory').card()
             if (locs := exploratory.location_in_game(game)):
                 for (loc, _) in locs:
                     replace_card(loc, exploratory, original)
@@ -295,6 +343,8 @@ def toggle_deck_mod(request: HttpRequest, game_id: str, mod: str) -> HttpRespons
         case _:
             raise ValueError('unknown deck mod')
 
+    # it may have replaced cards that players had
+    bump_version(game.id, all_players=True)
     return render(request, 'deck_mods.html', { 'game': game })
 
 # Note that both spirit and aspect are used in this lookup,
@@ -466,7 +516,7 @@ def add_player(request: HttpRequest, game_id: str) -> HttpResponse:
     # this automatically handles random by virtue of random not being in colors.
     # TODO: maybe consider showing an error if they select a color already in use?
     if color not in colors:
-        color = random.choice(colors)
+        color = game.rng().choice(colors)
     spirit_name = request.POST['spirit']
     spirit_and_aspect = spirit_name
     aspect = None
@@ -481,6 +531,7 @@ def add_player(request: HttpRequest, game_id: str) -> HttpResponse:
 
     make_presence(gp)
     make_initial_hand(gp)
+    bump_version(game.id)
 
     return redirect(reverse('game_setup', args=[game.id]))
 
@@ -491,38 +542,52 @@ def make_presence(gp: GamePlayer) -> None:
         return Presence(game_player=gp, left=left, top=top, opacity=opacity, energy=energy, elements=elements)
     gp.presence_set.bulk_create(presence_from_spec(*presence_spec) for presence_spec in spirit_presence[gp.spirit.name])
 
-def make_initial_hand(gp: GamePlayer, remove_from_decks: bool = True) -> None:
+# The ids of the cards a player starts with in hand (their spirit's uniques, and any their aspect adds or removes),
+# and the cards the aspect adds, which would otherwise be in the minor/major decks.
+def initial_hand(gp: GamePlayer) -> tuple[set[int], list[CatalogCard]]:
+    catalog = card_catalog()
+    hand = {card.id for card in catalog.for_spirit(gp.spirit_id)}
+    additional = [catalog.get(name) for name in spirit_additional_cards.get(gp.full_name(), [])]
+    hand |= {card.id for card in additional}
+    hand -= {catalog.get(name).id for name in spirit_remove_cards.get(gp.full_name(), [])}
+    return (hand, additional)
+
+def make_initial_hand(gp: GamePlayer) -> None:
     game = gp.game
-    gp.hand.set(Card.objects.filter(spirit=gp.spirit))
-    if gp.full_name() in spirit_additional_cards:
-        cards = [Card.objects.get(name=name) for name in spirit_additional_cards[gp.full_name()]]
-        gp.hand.add(*cards)
+    (hand, additional) = initial_hand(gp)
+    gp.hand.set(hand)
+    if additional:
         # Iterates over cards twice, but cards is currently small for all spirits, so not an issue yet.
-        game.minor_deck.remove(*[card for card in cards if card.type == Card.MINOR])
-        game.major_deck.remove(*[card for card in cards if card.type == Card.MAJOR])
-    if gp.full_name() in spirit_remove_cards:
-        gp.hand.remove(*[Card.objects.get(name=name) for name in spirit_remove_cards[gp.full_name()]])
+        game.minor_deck.remove(*[card.id for card in additional if card.type == Card.MINOR])
+        game.major_deck.remove(*[card.id for card in additional if card.type == Card.MAJOR])
 
 def import_game(request: HttpRequest) -> HttpResponse:
-    def cards_with_name(cards: list[str | dict[str, str]]) -> Iterable[Card]:
+    def cards_with_name(cards: list[str | dict[str, str]]) -> list[CatalogCard]:
         # Cards can be specified as either:
         # - just their name as a string
         # - or a dict with key "name"
         # (it is an error to provide something other than a string or dict)
         names = {(card if isinstance(card, str) else card['name']) for card in cards}
-        exact_name_matches = Card.objects.filter(name__in=names)
-        if exact_name_matches.count() == len(cards):
-            return exact_name_matches
-
-        # TODO: Is there a way to do a case-insensitive match on a set?
-        # maybe not: https://stackoverflow.com/questions/2667524/django-query-case-insensitive-list-match
-        remaining_names_needed = names - {card.name for card in exact_name_matches}
-        remaining_cards = [Card.objects.get(name__iexact=name) for name in remaining_names_needed]
-        if len(remaining_cards) == len(remaining_names_needed):
-            return list(exact_name_matches) + remaining_cards
-        # TODO: This feedback needs to be shown in UI
-        still_not_matched = remaining_names_needed - {card.name for card in remaining_cards}
-        raise ValueError(f"Couldn't find cards {still_not_matched}")
+        # Exact matches are preferred, falling back to a case-insensitive match.
+        catalog = card_catalog()
+        found = []
+        still_not_matched = set()
+        for name in names:
+            try:
+                found.append(catalog.get_iexact(name))
+            except Card.DoesNotExist:
+                still_not_matched.add(name)
+        if still_not_matched:
+            # TODO: This feedback needs to be shown in UI
+            raise ValueError(f"Couldn't find cards {still_not_matched}")
+        # (different names can match the same card case-insensitively)
+        return list({card.id: card for card in found}.values())
+
+    def spirit_with_name(name: str) -> Spirit:
+        try:
+            return spirits[name.casefold()]
+        except KeyError:
+            raise Spirit.DoesNotExist(f'no spirit named {name!r} (case-insensitive)') from None
 
     # The general strategy of the importer is that it will allow most fields to be optional,
     # using a reasonable default for any field not defined.
@@ -530,6 +595,10 @@ def import_game(request: HttpRequest) -> HttpResponse:
     # Really, this should be unnecessary for games that were exported from the API,
     # as they should have all the fields,
     # but it doesn't seem to hurt to be permissive here.
+    #
+    # Every name is looked up in memory (cards in the catalog, spirits in one query)
+    # and everything the game needs is built up before being written in a few bulk inserts,
+    # so the number of queries doesn't grow with the size of the game.
 
     if isinstance(request.FILES['json'], list):
         raise ValueError("multiple files unsupported")
@@ -541,12 +610,20 @@ def import_game(request: HttpRequest) -> HttpResponse:
             )
     # we are not importing the discord_channel,
     # because it's not yet been proven to be desirable to automatically do this.
-    game.save()
+    use_db_for_request(game_db(game.id))
+
+    spirits = {spirit.name.casefold(): spirit for spirit in Spirit.objects.all()}
+    players: list[GamePlayer] = []
+    presence: list[Presence] = []
+    # the players' cards in each of hand, discard, etc.: (player, card id)
+    player_cards: dict[str, list[tuple[GamePlayer, int]]] = {}
+    impending: list[GamePlayerImpendingWithEnergy] = []
 
     if 'discard_pile' in to_import:
-        game.discard_pile.set(discards := cards_with_name(to_import['discard_pile']))
+        discards = cards_with_name(to_import['discard_pile'])
         cards_in_game = {card.id for card in discards}
     else:
+        discards = []
         cards_in_game = set()
 
     # set minor/major decks after we've imported players,
@@ -584,7 +661,7 @@ def import_game(request: HttpRequest) -> HttpResponse:
                 game=game,
                 **basic_attrs,
                 color=player.get('color', next(iter(available_colours))),
-                spirit=Spirit.objects.get(name__iexact=spirit_name),
+                spirit=spirit_with_name(spirit_name),
                 )
 
         # If these basic attributes aren't set, we'll use the values at the start of a new game,
@@ -608,7 +685,7 @@ def import_game(request: HttpRequest) -> HttpResponse:
             # if there are no colours left, we'll just have to repopulate.
             if not available_colours:
                 available_colours = {color for (color, _) in GamePlayer.COLORS}
-        gp.save()
+        players.append(gp)
 
         def presence_from_import_or_spec(import_presence: dict[str, Any], left: int, top: int, opacity: float, expected_energy: str = '', expected_elements: str = '') -> Presence:
             # if imported_presence has left/top those fields are ignored
@@ -632,45 +709,63 @@ def import_game(request: HttpRequest) -> HttpResponse:
 
             return Presence(game_player=gp, left=left, top=top, opacity=opacity, energy=expected_energy, elements=expected_elements)
 
-        gp.presence_set.bulk_create(presence_from_import_or_spec(import_presence, *spec) for (spec, import_presence) in zip(spirit_presence[spirit_name], itertools.chain(player.get('presence', []), itertools.repeat(None))))
+        presence.extend(presence_from_import_or_spec(import_presence, *spec) for (spec, import_presence) in zip(spirit_presence[spirit_name], itertools.chain(player.get('presence', []), itertools.repeat(None))))
 
         if 'hand' in player:
-            gp.hand.set(hand := cards_with_name(player['hand']))
-            cards_in_game |= {card.id for card in hand}
+            hand = {card.id for card in cards_with_name(player['hand'])}
+            cards_in_game |= hand
         else:
             # We haven't made the major/minor decks yet
             # (because we need to know what cards to exclude from it)
             # so we should not remove cards from it yet,
             # only record the cards so that we remove them when the decks are made.
-            make_initial_hand(gp, remove_from_decks=False)
-            if gp.full_name() in spirit_additional_cards:
-                cards_in_game |= {Card.objects.get(name=card).id for card in spirit_additional_cards[gp.full_name()]}
+            (hand, additional) = initial_hand(gp)
+            cards_in_game |= {card.id for card in additional}
+        player_cards.setdefault('hand', []).extend((gp, id) for id in hand)
 
         for name in ('discard', 'play', 'selection', 'days', 'healing', 'scenario'):
             if name in player:
-                getattr(gp, name).set(cards := cards_with_name(player[name]))
+                cards = cards_with_name(player[name])
+                player_cards.setdefault(name, []).extend((gp, card.id) for card in cards)
                 cards_in_game |= {card.id for card in cards}
         if 'impending' in player:
-            for impending in player['impending']:
-                card = Card.objects.get(name__iexact=impending['card'] if isinstance(impending['card'], str) else impending['card']['name'])
-                GamePlayerImpendingWithEnergy(
+            for imported in player['impending']:
+                card_id = card_catalog().get_iexact(imported['card'] if isinstance(imported['card'], str) else imported['card']['name']).id
+                impending.append(GamePlayerImpendingWithEnergy(
                         gameplayer=gp,
-                        card=card,
-                        **{attr: impending[attr] for attr in ('in_play', 'energy', 'this_turn') if attr in impending},
-                        ).save()
-                cards_in_game.add(card.id)
+                        card_id=card_id,
+                        **{attr: imported[attr] for attr in ('in_play', 'energy', 'this_turn') if attr in imported},
+                        ))
+                cards_in_game.add(card_id)
 
+    decks = {}
     for (name, type) in (('minor_deck', Card.MINOR), ('major_deck', Card.MAJOR)):
-        deck = getattr(game, name)
         if name in to_import:
-            deck.set(cards_with_name(to_import[name]))
+            decks[name] = cards_with_name(to_import[name])
         else:
             # if someone imports a discard pile and not a major/minor deck,
             # exclude discarded cards and cards being held by any player
-            deck.set(Card.objects.filter(type=type, exclude_from_deck=False).exclude(id__in=cards_in_game))
+            decks[name] = [card for card in card_catalog().by_id.values() if card.type == type and not card.exclude_from_deck and card.id not in cards_in_game]
+
+    # Everything's been checked, so now to write it all,
+    # in a transaction on the game's database (the request's own is on the database it started with: see pbf/db.py).
+    # The game and its players first, which gives them the ids that everything else refers to.
+    with write_transaction():
+        game.save()
+        Game.discard_pile.through.objects.bulk_create(Game.discard_pile.through(game=game, card_id=card.id) for card in discards)
+        GamePlayer.objects.bulk_create(players)
+        Presence.objects.bulk_create(presence)
+        for (name, rows) in player_cards.items():
+            through = getattr(GamePlayer, name).through
+            through.objects.bulk_create(through(gameplayer=gp, card_id=id) for (gp, id) in rows)
+        GamePlayerImpendingWithEnergy.objects.bulk_create(impending)
+        for (name, deck) in decks.items():
+            game.shuffle_into_deck(name, [card.card() for card in deck])
 
     return redirect(reverse('view_game', args=[game.id]))
 
+# (only for GETs, not uploading screenshots: see pbf/db.py)
+@read_only
 def view_game(request: HttpRequest, game_id: str, spirit_spec: str | None = None) -> HttpResponse:
     game = get_object_or_404(Game, pk=game_id)
     if request.method == 'POST':
@@ -719,14 +814,16 @@ def view_game(request: HttpRequest, game_id: str, spirit_spec: str | None = None
 
             form = form_class(request.POST, request.FILES, instance=game)
             if form.is_valid():
-                form.save()
+                form.save(commit=False)
+                # Only the screenshot, rather than writing back the version it was loaded with (see bump_version).
+                game.save(update_fields=[key])
+                bump_version(game.id)
                 add_log_msg(game, text='New screenshot uploaded.', images='.' + getattr(game, key).url)
 
         return redirect(reverse('view_game', args=[game.id, spirit_spec] if spirit_spec else [game.id]))
 
     tab_id = try_match_spirit(game, spirit_spec) or game.gameplayer_set.values_list('id', flat=True).first()
-    logs = reversed(game.gamelog_set.order_by('-date').all()[:30])
-    return render(request, 'game.html', { 'game': game, 'logs': logs, 'tab_id': tab_id, 'spirit_spec': spirit_spec })
+    return render(request, 'game.html', { 'game': game, 'logs': latest_logs(game), 'tab_id': tab_id, 'spirit_spec': spirit_spec })
 
 def try_match_spirit(game: Game, spirit_spec: str | None) -> int | None:
     if not spirit_spec:
@@ -772,6 +869,7 @@ def draw_cards(request: HttpRequest, game_id: str) -> HttpResponse:
 
     cards_drawn = cards_from_deck(game, cards_needed, type)
     game.discard_pile.add(*cards_drawn)
+    bump_version(game.id)
 
     draw_result = f"drew {len(cards_drawn)} {type} power card{'s' if len(cards_drawn) != 1 else ''}"
     draw_result_explain = "" if len(cards_drawn) == cards_needed else f" (there were not enough cards to draw all {cards_needed})"
@@ -781,32 +879,19 @@ def draw_cards(request: HttpRequest, game_id: str) -> HttpResponse:
     card_names = ', '.join(card.name for card in cards_drawn)
     return with_log_trigger(render(request, 'host_draw.html', {'msg': f"You {draw_result}{draw_result_explain}: {card_names}", 'cards': cards_drawn}))
 
+# Two players drawing at once must never get the same cards,
+# so the game is locked until the end of the transaction (the request's, if there is one, otherwise its own).
 def cards_from_deck(game: Game, cards_needed: int, type: str) -> list[Card]:
-    if type == 'minor':
-        deck: 'Card_ManyRelatedManager[Any]' = game.minor_deck
-    elif type == 'major':
-        deck = game.major_deck
-    else:
+    if type not in ('minor', 'major'):
         raise ValueError(f"can't draw from {type} deck")
 
-    cards_have = deck.count()
-
-    if cards_have >= cards_needed:
-        cards_drawn = random.sample(list(deck.all()), cards_needed)
-        deck.remove(*cards_drawn)
-    else:
-        # reshuffle needed, but first draw all the cards we do have
-        cards_drawn = list(deck.all())
-        cards_remain = cards_needed - cards_have
-        deck.clear()
-        reshuffle_discard(game, type)
-        if deck.count() >= cards_remain:
-            new_cards = random.sample(list(deck.all()), cards_remain)
-            cards_drawn.extend(new_cards)
-            deck.remove(*new_cards)
-        else:
-            cards_drawn.extend(list(deck.all()))
-            deck.clear()
+    with write_transaction(game._state.db):
+        game.lock()
+        cards_drawn = game.draw_from_deck(f'{type}_deck', cards_needed)
+        if len(cards_drawn) < cards_needed:
+            # reshuffle needed, after drawing all the cards we did have
+            reshuffle_discard(game, type)
+            cards_drawn += game.draw_from_deck(f'{type}_deck', cards_needed - len(cards_drawn))
 
     return cards_drawn
 
@@ -814,18 +899,18 @@ def reshuffle_discard(game: Game, type: str) -> None:
     if type == 'minor':
         minors = game.discard_pile.filter(type=Card.MINOR).all()
         game.discard_pile.remove(*minors)
-        game.minor_deck.add(*minors)
+        game.shuffle_into_deck('minor_deck', minors)
     elif type == 'major':
         majors = game.discard_pile.filter(type=Card.MAJOR).all()
         game.discard_pile.remove(*majors)
-        game.major_deck.add(*majors)
+        game.shuffle_into_deck('major_deck', majors)
     else:
         raise ValueError(f"can't reshuffle {type} deck")
 
     add_log_msg(game, text=f'Re-shuffling {type} power deck')
 
 def take_powers(request: HttpRequest, player_id: int, type: str, num: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     # most compliant browsers should send 'on', but we'll allow 'true' as well
     spoiler = request.GET.get('spoiler_power_gain', '') in ('on', 'true')
 
@@ -837,14 +922,13 @@ def take_powers(request: HttpRequest, player_id: int, type: str, num: int) -> Ht
     else:
         if player.spirit.name == 'Covets' and player.aspect == 'v1.3' and type == 'major' and num == 3:
             # This is the Plant Treasure that can only be used once, so unset the flag.
-            player.spirit_specific_per_turn_flags &= ~GamePlayer.PLANT_TREASURE_THIS_TURN
-            player.save(update_fields=['spirit_specific_per_turn_flags'])
+            player.write(spirit_specific_per_turn_flags=F('spirit_specific_per_turn_flags').bitand(~GamePlayer.PLANT_TREASURE_THIS_TURN))
         add_log_msg(player.game, player=player, text=f'takes {num} {type} powers', cards=taken_cards, spoiler=spoiler)
 
-    return with_log_trigger(render(request, 'player.html', {'player': player, 'taken_cards': taken_cards}))
+    return with_log_trigger(render_player(request, player, {'taken_cards': taken_cards}))
 
 def take_play_powers(request: HttpRequest, player_id: int, type: str, num: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     # most compliant browsers should send 'on', but we'll allow 'true' as well
     spoiler = request.GET.get('spoiler_power_gain', '') in ('on', 'true')
 
@@ -856,25 +940,25 @@ def take_play_powers(request: HttpRequest, player_id: int, type: str, num: int)
     else:
         add_log_msg(player.game, player=player, text=f'takes and plays {num} {type} powers', cards=taken_cards, spoiler=spoiler)
 
-    return with_log_trigger(render(request, 'player.html', {'player': player, 'taken_cards': taken_cards}))
+    return with_log_trigger(render_player(request, player, {'taken_cards': taken_cards}))
 
 def gain_healing(request: HttpRequest, player_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     if player.selection.exists():
         # Don't set a new selection while the player already has one.
         # Otherwise, cards in the previous selection would no longer be accessible.
-        return render(request, 'player.html', {'player': player})
+        return render_player(request, player)
 
     player.selection.set(Card.objects.filter(type=Card.HEALING))
 
-    return render(request, 'player.html', {'player': player})
+    return render_player(request, player)
 
 def gain_power(request: HttpRequest, player_id: int, type: str, num: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     if player.selection.exists():
         # Don't set a new selection while the player already has one.
         # Otherwise, cards in the previous selection would no longer be accessible.
-        return render(request, 'player.html', {'player': player})
+        return render_player(request, player)
 
     # most compliant browsers should send 'on', but we'll allow 'true' as well
     spoiler = request.GET.get('spoiler_power_gain', '') in ('on', 'true')
@@ -896,65 +980,94 @@ def gain_power(request: HttpRequest, player_id: int, type: str, num: int) -> Htt
         # Overall it seems better to put this in the function matching its verb.
         player.hand.add(*selection)
         add_log_msg(player.game, player=player, text=f'gains {num} {type} powers', cards=selection, spoiler=spoiler)
-        return with_log_trigger(render(request, 'player.html', {'player': player, 'taken_cards_verb': 'gained', 'taken_cards': selection}))
+        return with_log_trigger(render_player(request, player, {'taken_cards_verb': 'gained', 'taken_cards': selection}))
 
     if player.spirit.name == 'Fractured':
         keep = 2 if num == 6 else 1
         # clear the value, because undo gain doesn't clear it
         # (consider what would happen if they gain 4, undo, gain 6: should show 2, not 3)
-        player.spirit_specific_per_turn_flags &= ~(GamePlayer.FRACTURED_DAYS_TO_HAND * 3)
-        player.spirit_specific_per_turn_flags &= ~(GamePlayer.FRACTURED_DAYS_TO_DAYS * 3)
-        player.spirit_specific_per_turn_flags |= GamePlayer.FRACTURED_DAYS_TO_HAND * keep
-        player.spirit_specific_per_turn_flags |= GamePlayer.FRACTURED_DAYS_TO_DAYS * keep
-        player.save(update_fields=['spirit_specific_per_turn_flags'])
+        player.write(spirit_specific_per_turn_flags=F('spirit_specific_per_turn_flags')
+                     .bitand(~(GamePlayer.FRACTURED_DAYS_TO_HAND * 3) & ~(GamePlayer.FRACTURED_DAYS_TO_DAYS * 3))
+                     .bitor(GamePlayer.FRACTURED_DAYS_TO_HAND * keep | GamePlayer.FRACTURED_DAYS_TO_DAYS * keep))
 
     player.selection.set(selection)
 
     # TODO: Should we set a flag on the player, such that when they actually select the card, it is also spoilered?
     add_log_msg(player.game, player=player, text=f'gains a {type} power. Choices', cards=selection, spoiler=spoiler)
 
-    return with_log_trigger(render(request, 'player.html', {'player': player, 'spoiler_power_gain': spoiler}))
+    return with_log_trigger(render_player(request, player, {'spoiler_power_gain': spoiler}))
 
+# The views that only read a game answer If-None-Match with 304 Not Modified
+# when the versions of what they show (see bump_version) are still the ones in the ETag,
+# so that the page polling them or reloading costs one small query.
+# no-cache makes the browser check every time rather than reusing what it has for a while.
+#
+# Each ETag also has the deploy's version, since a new deploy may render the same state differently.
+
+def game_etag(request: HttpRequest, game_id: str) -> str | None:
+    version = Game.objects.filter(pk=game_id).values_list('version', flat=True).first()
+    return None if version is None else f'{deploy_version()}-{version}'
+
+def player_etag(request: HttpRequest, player_id: int) -> str | None:
+    versions = GamePlayer.objects.filter(pk=player_id).values_list('game__version', 'version').first()
+    return None if versions is None else f'{deploy_version()}-{versions[0]}-{versions[1]}'
+
+def tab_etag(request: HttpRequest, game_id: str, player_id: int) -> str | None:
+    player_version = GamePlayer.objects.filter(pk=player_id).values('version')
+    versions = Game.objects.filter(pk=game_id).annotate(player_version=Subquery(player_version)).values_list('version', 'player_version').first()
+    if versions is None or versions[1] is None:
+        return None
+    return f'{deploy_version()}-{versions[0]}-{versions[1]}'
+
+@read_only
+@cache_control(no_cache=True)
+@etag(game_etag)
 def minor_deck(request: HttpRequest, game_id: str) -> HttpResponse:
     game = get_object_or_404(Game, pk=game_id)
     return render(request, 'power_deck.html', {'name': 'Minor', 'cards': game.minor_deck.all()})
 
+@read_only
+@cache_control(no_cache=True)
+@etag(game_etag)
 def major_deck(request: HttpRequest, game_id: str) -> HttpResponse:
     game = get_object_or_404(Game, pk=game_id)
     return render(request, 'power_deck.html', {'name': 'Major', 'cards': game.major_deck.all()})
 
+@read_only
+@cache_control(no_cache=True)
+@etag(player_etag)
 def discard_pile(request: HttpRequest, player_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     return render(request, 'discard_pile.html', { 'player': player })
 
 def return_to_deck(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
     # this doesn't actually manipulate the player in any way,
     # except to return to their tab after the operation is done
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     game = player.game
     card = get_object_or_404(game.discard_pile, pk=card_id)
     game.discard_pile.remove(card)
 
     if card.type == card.MINOR:
-        game.minor_deck.add(card)
+        game.shuffle_into_deck('minor_deck', [card])
     elif card.type == card.MAJOR:
-        game.major_deck.add(card)
+        game.shuffle_into_deck('major_deck', [card])
     else:
         raise ValueError(f"Can't return {card}")
 
     add_log_msg(game, text=f'{card.name} returned to the deck')
 
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player(request, player))
 
 def choose_from_discard(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     card = get_object_or_404(player.game.discard_pile, pk=card_id)
     player.hand.add(card)
     player.game.discard_pile.remove(card)
 
     add_log_msg(player.game, player=player, text=f'takes {card.name} from the power discard pile')
 
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player(request, player))
 
 # move a card from one of many possible sources to the destination
 def move_card(card_id: int, srcs: Iterable['Card_ManyRelatedManager[Any]'], dst: 'Card_ManyRelatedManager[Any]') -> Card | None:
@@ -971,7 +1084,7 @@ def move_card(card_id: int, srcs: Iterable['Card_ManyRelatedManager[Any]'], dst:
     return None
 
 def send_days(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     if card := move_card(card_id, [player.selection], player.days):
         add_log_msg(player.game, player=player, text=f'sends {card.name} to the Days That Never Were')
         # Boon of Reimagining: 6 - 4 = 2
@@ -980,14 +1093,13 @@ def send_days(request: HttpRequest, player_id: int, card_id: int) -> HttpRespons
             player.game.discard_pile.add(*player.selection.all())
             player.selection.clear()
         if player.to_days_left > 0:
-            player.spirit_specific_per_turn_flags -= GamePlayer.FRACTURED_DAYS_TO_DAYS
-            player.save(update_fields=['spirit_specific_per_turn_flags'])
+            player.write(spirit_specific_per_turn_flags=F('spirit_specific_per_turn_flags') - GamePlayer.FRACTURED_DAYS_TO_DAYS)
     elif card := move_card(card_id, [player.game.discard_pile], player.days):
         add_log_msg(player.game, player=player, text=f'sends {card.name} to the Days That Never Were')
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player(request, player))
 
 def choose_card(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     card = get_object_or_404(player.selection, pk=card_id)
     # most compliant browsers should send 'on', but we'll allow 'true' as well
     spoiler = request.GET.get('spoiler_power_gain', '') in ('on', 'true')
@@ -1015,8 +1127,7 @@ def choose_card(request: HttpRequest, player_id: int, card_id: int) -> HttpRespo
         # normal gain: 4 - 2 = 2
         can_keep_selecting = cards_left != 2
         if player.to_hand_left > 0:
-            player.spirit_specific_per_turn_flags -= GamePlayer.FRACTURED_DAYS_TO_HAND
-            player.save(update_fields=['spirit_specific_per_turn_flags'])
+            player.write(spirit_specific_per_turn_flags=F('spirit_specific_per_turn_flags') - GamePlayer.FRACTURED_DAYS_TO_HAND)
     else:
         can_keep_selecting = card.type == Card.MINOR and (cards_left == 5 or player.aspect == 'Mentor' and cards_left > 1)
     if not can_keep_selecting:
@@ -1028,10 +1139,10 @@ def choose_card(request: HttpRequest, player_id: int, card_id: int) -> HttpRespo
     else:
         add_log_msg(player.game, player=player, text=f'gains {card.name}')
 
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player(request, player))
 
 def undo_gain_card(request: HttpRequest, player_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     game = player.game
 
     to_remove = []
@@ -1051,11 +1162,11 @@ def undo_gain_card(request: HttpRequest, player_id: int) -> HttpResponse:
             to_remove.append(sel)
         # If it's not any of these types, we'll leave it in selection, as something's gone wrong.
 
-    game.minor_deck.add(*minors)
-    game.major_deck.add(*majors)
+    game.shuffle_into_deck('minor_deck', minors)
+    game.shuffle_into_deck('major_deck', majors)
     player.selection.remove(*to_remove)
 
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player(request, player))
 
 def choose_healing_card(request: HttpRequest, player: GamePlayer, card: Card) -> HttpResponse:
     if card.name.startswith('Waters'):
@@ -1067,33 +1178,31 @@ def choose_healing_card(request: HttpRequest, player: GamePlayer, card: Card) ->
 
     add_log_msg(player.game, player=player, text=f'claims {card.name}')
 
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player(request, player))
 
 def choose_days(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     card = get_object_or_404(player.days, pk=card_id)
     player.hand.add(card)
     player.days.remove(card)
 
     add_log_msg(player.game, player=player, text=f'gains {card.name} from the Days That Never Were')
 
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player(request, player))
 
 def create_days(request: HttpRequest, player_id: int, num: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     game = player.game
 
-    decks: list[tuple['Card_ManyRelatedManager[Any]', str]] = [(game.minor_deck, 'minor'), (game.major_deck, 'major')]
-    for (deck, name) in decks:
-        days = random.sample(list(deck.all()), num)
-        deck.remove(*days)
+    for name in ('minor', 'major'):
+        days = cards_from_deck(game, num, name)
         player.days.add(*days)
         add_log_msg(player.game, player=player, text=f'starts with {num} {name} powers in the Days That Never Were', cards=days)
 
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player(request, player))
 
 def setup_deck(request: HttpRequest, player_id: int, type: str) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     if type == 'minor':
         cards = player.game.minor_deck.all()
     elif type == 'major':
@@ -1120,10 +1229,10 @@ def setup_discard_pile(request: HttpRequest, game_id: str, type: str) -> HttpRes
 # if the card belongs to a deck (major or minor),
 #   returns the card and that deck (regardless of whether the card was moved)
 # if the card does not belong to a deck (unique), returns the card and None.
-def move_card_from_deck(card_id: int, game: Game, dst: 'Card_ManyRelatedManager[Any]') -> tuple[Card, 'Card_ManyRelatedManager[Any] | None']:
+def move_card_from_deck(card_id: int, game: Game, dst: 'Card_ManyRelatedManager[Any]') -> tuple[Card, 'ManyRelatedManager[Card, Any] | None']:
     card = get_object_or_404(Card, pk=card_id)
     if card.type == Card.MINOR:
-        deck: 'Card_ManyRelatedManager[Any]' = game.minor_deck
+        deck: 'ManyRelatedManager[Card, Any]' = game.minor_deck
     elif card.type == Card.MAJOR:
         deck = game.major_deck
     else:
@@ -1139,73 +1248,76 @@ def setup_discard_card_game(request: HttpRequest, game_id: str, card_id: int) ->
     card, deck = move_card_from_deck(card_id, game, game.discard_pile)
     if not deck:
         raise ValueError(f"Can't add {card}")
+    bump_version(game.id)
 
     return render(request, 'power_deck_setup.html', {'name': card.get_type_display(), 'game': game, 'owned': game.discard_pile.all(), 'deck': deck.all()})
 
 def setup_discard_card_player(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
     # this doesn't actually manipulate the player in any way,
     # except to return to their setup after the operation is done
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     card, deck = move_card_from_deck(card_id, player.game, player.game.discard_pile)
     if not deck:
         raise ValueError(f"Can't add {card}")
+    bump_version(player.game_id)
 
     return render(request, 'power_deck_setup.html', {'name': card.get_type_display(), 'player': player, 'owned': player.scenario.all(), 'deck': deck.all()})
 
 def add_to_scenario(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     card, deck = move_card_from_deck(card_id, player.game, player.scenario)
     if not deck:
         if card.type == Card.UNIQUE and player.game.scenario_setup_uniques():
             player.scenario.add(card)
+            bump_version(player.game_id, player.id)
             return render(request, 'power_deck_setup.html', {'name': 'Unique', 'player': player, 'owned': player.scenario.all(), 'deck': Card.objects.filter(type=Card.UNIQUE)})
         raise ValueError(f"Can't add {card}")
+    bump_version(player.game_id, player.id)
 
     return render(request, 'power_deck_setup.html', {'name': card.get_type_display(), 'player': player, 'owned': player.scenario.all(), 'deck': deck.all()})
 
 def gain_scenario(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     card = get_object_or_404(player.scenario, pk=card_id)
     player.hand.add(card)
     player.scenario.remove(card)
 
     add_log_msg(player.game, player=player, text=f'gains {card.name} from their Destiny')
 
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player(request, player))
 
 def discard_scenario(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     card = get_object_or_404(player.scenario, pk=card_id)
     player.scenario.remove(card)
     player.game.discard_pile.add(card)
 
     add_log_msg(player.game, text=f'{card.name} (Second Wave) discarded')
 
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player(request, player))
 
 # Covets Gleaming Shards of Earth
 def create_plant_treasure(request: HttpRequest, player_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
 
     if player.plant_treasure.exists():
         # show the ones they already set aside
-        return render(request, 'player.html', {'player': player, 'taken_cards': player.plant_treasure.all(), 'taken_cards_verb': 'set aside'})
+        return render_player(request, player, {'taken_cards': player.plant_treasure.all(), 'taken_cards_verb': 'set aside'})
 
     if not player.plant_treasure_this_turn():
-        return render(request, 'player.html', {'player': player})
+        return render_player(request, player)
 
     game = player.game
     majors = cards_from_deck(game, 3, 'major')
     add_log_msg(game, player=player, text='stores the Plant Treasure and sets aside 3 major powers', cards=majors)
     player.plant_treasure.add(*majors)
-    player.spirit_specific_per_turn_flags &= ~GamePlayer.PLANT_TREASURE_THIS_TURN
-    player.save(update_fields=['spirit_specific_per_turn_flags'])
+    player.write(spirit_specific_per_turn_flags=F('spirit_specific_per_turn_flags').bitand(~GamePlayer.PLANT_TREASURE_THIS_TURN))
 
-    return with_log_trigger(render(request, 'player.html', {'player': player, 'taken_cards': majors, 'taken_cards_verb': 'set aside'}))
+    return with_log_trigger(render_player(request, player, {'taken_cards': majors, 'taken_cards_verb': 'set aside'}))
 
 # Covets Gleaming Shards of Earth
 def take_plant_treasure(request: HttpRequest, player_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
 
     # The site does not maintain a counter of metal held by incarna,
     # so we cannot check that.
@@ -1217,10 +1329,10 @@ def take_plant_treasure(request: HttpRequest, player_id: int) -> HttpResponse:
         player.plant_treasure.clear()
         add_log_msg(player.game, player=player, text='takes their Plant Treasure powers')
 
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player(request, player))
 
 def gain_energy_on_impending(request: HttpRequest, player_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     to_gain = player.impending_energy()
     # You only gain energy on cards made impending on previous turns.
     impendings = player.gameplayerimpendingwithenergy_set.filter(this_turn=False)
@@ -1234,105 +1346,104 @@ def gain_energy_on_impending(request: HttpRequest, player_id: int) -> HttpRespon
             impending.energy = impending.cost_with_scenario
             impending.in_play = True
     GamePlayerImpendingWithEnergy.objects.bulk_update(impendings, ['energy', 'in_play'])
-    player.spirit_specific_per_turn_flags |= GamePlayer.SPIRIT_SPECIFIC_INCREMENTED_THIS_TURN
-    player.save()
+    player.write(spirit_specific_per_turn_flags=F('spirit_specific_per_turn_flags').bitor(GamePlayer.SPIRIT_SPECIFIC_INCREMENTED_THIS_TURN))
 
-    return render(request, 'player.html', {'player': player})
+    return render_player_fragments(request, player, 'impending', 'elements')
 
 def impend_card(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     card = get_object_or_404(player.hand, pk=card_id)
     player.impending_with_energy.add(card)
     player.hand.remove(card)
 
-    return render(request, 'player.html', {'player': player})
+    return render_player_fragments(request, player, 'hand', 'impending')
 
 def unimpend_card(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     card = get_object_or_404(player.impending_with_energy, pk=card_id)
     player.impending_with_energy.remove(card)
     player.hand.add(card)
 
-    return render(request, 'player.html', {'player': player})
+    return render_player_fragments(request, player, 'hand', 'impending')
 
 def add_energy_to_impending(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     card = get_object_or_404(player.impending_with_energy, pk=card_id)
     impending_with_energy = get_object_or_404(GamePlayerImpendingWithEnergy, gameplayer=player, card=card)
     if not impending_with_energy.in_play and impending_with_energy.energy < impending_with_energy.cost_with_scenario:
         impending_with_energy.energy += 1
         impending_with_energy.save()
 
-    return render(request, 'player.html', {'player': player})
+    return render_player_fragments(request, player, 'impending')
 
 def remove_energy_from_impending(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     card = get_object_or_404(player.impending_with_energy, pk=card_id)
     impending_with_energy = get_object_or_404(GamePlayerImpendingWithEnergy, gameplayer=player, card=card)
     if not impending_with_energy.in_play and impending_with_energy.energy > 0:
         impending_with_energy.energy -= 1
         impending_with_energy.save()
 
-    return render(request, 'player.html', {'player': player})
+    return render_player_fragments(request, player, 'impending')
 
 def play_from_impending(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     card = get_object_or_404(player.impending_with_energy, pk=card_id)
     impending_with_energy = get_object_or_404(GamePlayerImpendingWithEnergy, gameplayer=player, card=card)
     if not impending_with_energy.in_play and impending_with_energy.energy >= impending_with_energy.cost_with_scenario:
         impending_with_energy.in_play = True
         impending_with_energy.save()
 
-    return render(request, 'player.html', {'player': player})
+    return render_player_fragments(request, player, 'impending', 'elements')
 
 def unplay_from_impending(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     card = get_object_or_404(player.impending_with_energy, pk=card_id)
     impending_with_energy = get_object_or_404(GamePlayerImpendingWithEnergy, gameplayer=player, card=card)
     if impending_with_energy.in_play:
         impending_with_energy.in_play = False
         impending_with_energy.save()
 
-    return render(request, 'player.html', {'player': player})
+    return render_player_fragments(request, player, 'impending', 'elements')
 
 def play_card(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     card = get_object_or_404(player.hand, pk=card_id)
     player.play.add(card)
     player.hand.remove(card)
 
     # no log message but deciding to keep with_log_trigger anyway as they could affect what cards the player wants to play
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player_fragments(request, player, 'hand', 'elements', 'energy'))
 
 def unplay_card(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     card = get_object_or_404(player.play, pk=card_id)
     player.hand.add(card)
     player.play.remove(card)
 
     # no log message but deciding to keep with_log_trigger anyway as they could affect what cards the player wants to play
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player_fragments(request, player, 'hand', 'elements', 'energy'))
 
 def forget_card(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     if card := move_card(card_id, [player.hand, player.play, player.discard, player.impending_with_energy], player.game.discard_pile):
         add_log_msg(player.game, player=player, text=f'forgets {card.name}')
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player_fragments(request, player, 'hand', 'discard', 'impending', 'elements', 'energy'))
 
 
 def reclaim_card(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     card = get_object_or_404(player.discard, pk=card_id)
     player.hand.add(card)
     player.discard.remove(card)
 
     # no log message but deciding to keep with_log_trigger anyway as they could affect what cards the player wants to play
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player_fragments(request, player, 'hand', 'discard'))
 
 def reclaim_all(request: HttpRequest, player_id: int, element: str | None = None) -> HttpResponse:
     from django.db.models import Q
 
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     if element:
         # just validate that it's an element, don't need to keep the value
         _ = Elements[element.capitalize()]
@@ -1346,10 +1457,10 @@ def reclaim_all(request: HttpRequest, player_id: int, element: str | None = None
         player.discard.clear()
 
     # no log message but deciding to keep with_log_trigger anyway as they could affect what cards the player wants to play
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player_fragments(request, player, 'hand', 'discard'))
 
 def discard_all(request: HttpRequest, player_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     # if we used the cached property cards_in_play here, we'd have to clear it,
     # so let's just not use it.
     player.discard.add(*player.play.all())
@@ -1361,37 +1472,31 @@ def discard_all(request: HttpRequest, player_id: int) -> HttpResponse:
         player.gameplayerimpendingwithenergy_set.update(this_turn=False)
 
     player.play.clear()
-    player.ready = False
-    player.last_unready_energy = player.energy
-    player.gained_this_turn = False
-    player.paid_this_turn = False
-    player.temporary_sun = 0
-    player.temporary_moon = 0
-    player.temporary_fire = 0
-    player.temporary_air = 0
-    player.temporary_water = 0
-    player.temporary_earth = 0
-    player.temporary_plant = 0
-    player.temporary_animal = 0
-    player.bargain_paid_this_turn = 0
-    player.spirit_specific_per_turn_flags = 0
-    player.save()
+    player.write(
+        ready=False,
+        last_unready_energy=F('energy'),
+        gained_this_turn=False,
+        paid_this_turn=False,
+        temporary_elements_packed=0,
+        bargain_paid_this_turn=0,
+        spirit_specific_per_turn_flags=0,
+    )
+    relay.game_changed(player.game_id, ready=(player.id, False))
 
     # no log message but deciding to keep with_log_trigger anyway as an update is useful at the end of the turn
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player(request, player))
 
 def discard_card(request: HttpRequest, player_id: int, card_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     move_card(card_id, [player.play, player.hand], player.discard)
 
     # no log message but deciding to keep with_log_trigger anyway as they could affect what cards the player wants to play
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player_fragments(request, player, 'hand', 'discard', 'elements', 'energy'))
 
 def ready(request: HttpRequest, player_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
-    player.ready = True
-    player.last_ready_energy = player.energy
-    player.save()
+    player = get_player(player_id)
+    player.write(ready=True, last_ready_energy=F('energy'))
+    relay.game_changed(player.game_id, ready=(player.id, True))
 
     if player.gained_this_turn:
         add_log_msg(player.game, player=player, text=f'gains {player.get_gain_energy()} energy')
@@ -1409,7 +1514,7 @@ def ready(request: HttpRequest, player_id: int) -> HttpResponse:
     if player.game.gameplayer_set.filter(ready=False).count() == 0:
         add_log_msg(player.game, text='All spirits are ready!')
 
-    return with_log_trigger(render(request, 'player.html', {'player': player}))
+    return with_log_trigger(render_player_fragments(request, player, 'ready', 'energy'))
 
 def add_impending_log_msgs(player: GamePlayer) -> None:
     for impended_card_with_energy in player.gameplayerimpendingwithenergy_set.all().prefetch_related('card'):
@@ -1430,84 +1535,78 @@ def add_spirit_specific_resource_msgs(player: GamePlayer) -> None:
             add_log_msg(player.game, player=player, text=f'{player.spirit_specific_resource_name()}: {element_msg}')
 
 def change_energy(request: HttpRequest, player_id: int, amount: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
-    player.energy += amount
-    player.save()
+    player = get_player(player_id)
+    player.write(energy=F('energy') + amount)
 
-    return render(request, 'energy.html', {'player': player})
+    return render_player_part(request, 'energy.html', player)
 
 def pay_energy(request: HttpRequest, player_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     amount = player.get_play_cost()
-    player.energy -= amount
-    player.paid_this_turn = True
-    player.save()
+    player.write(energy=F('energy') - amount, paid_this_turn=True)
 
-    return render(request, 'energy.html', {'player': player})
+    return render_player_part(request, 'energy.html', player)
 
 def gain_energy(request: HttpRequest, player_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     amount = player.get_gain_energy()
-    player.gain_energy_or_pay_debt(amount)
-    player.gained_this_turn = True
-    player.save()
+    player.write(**player.gain_energy_or_pay_debt_changes(amount), gained_this_turn=True)
 
     # no log message but deciding to keep with_log_trigger anyway as they could affect what cards the player wants to play
-    return with_log_trigger(render(request, 'energy.html', {'player': player}))
+    return with_log_trigger(render_player_part(request, 'energy.html', player))
 
 def change_bargain_cost_per_turn(request: HttpRequest, player_id: int, amount: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
-    player.bargain_cost_per_turn = max(0, player.bargain_cost_per_turn + amount)
+    player = get_player(player_id)
     # what if they adjust bargain_cost_per_turn to be less than bargain_paid_this_turn?
     # should we adjust bargain_paid_this_turn down?
     # let's say no for now, because the player may need to adjust their energy count
-    player.save()
-    return render(request, 'energy_and_spirit_resource.html' if player.spirit_specific_resource_gives_energy else 'energy.html', {'player': player})
+    player.write(bargain_cost_per_turn=Greatest(F('bargain_cost_per_turn') + amount, 0))
+    return render_player_part(request, 'energy_and_spirit_resource.html' if player.spirit_specific_resource_gives_energy else 'energy.html', player)
 
 def change_bargain_paid_this_turn(request: HttpRequest, player_id: int, amount: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
-    player.bargain_paid_this_turn = max(0, min(player.bargain_paid_this_turn + amount, player.bargain_cost_per_turn))
-    player.save()
-    return render(request, 'energy_and_spirit_resource.html' if player.spirit_specific_resource_gives_energy else 'energy.html', {'player': player})
+    player = get_player(player_id)
+    player.write(bargain_paid_this_turn=Greatest(Least(F('bargain_paid_this_turn') + amount, F('bargain_cost_per_turn')), 0))
+    return render_player_part(request, 'energy_and_spirit_resource.html' if player.spirit_specific_resource_gives_energy else 'energy.html', player)
 
 def change_spirit_specific_resource(request: HttpRequest, player_id: int, amount: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     # no known spirit's spirit-specific-resource can go below 0
-    player.spirit_specific_resource = max(player.spirit_specific_resource + amount, 0)
+    changes: dict[str, Any] = {'spirit_specific_resource': Greatest(F('spirit_specific_resource') + amount, 0)}
     if amount > 0:
-        player.spirit_specific_per_turn_flags |= GamePlayer.SPIRIT_SPECIFIC_INCREMENTED_THIS_TURN
+        changes['spirit_specific_per_turn_flags'] = F('spirit_specific_per_turn_flags').bitor(GamePlayer.SPIRIT_SPECIFIC_INCREMENTED_THIS_TURN)
     elif amount < 0:
-        player.spirit_specific_per_turn_flags |= GamePlayer.SPIRIT_SPECIFIC_DECREMENTED_THIS_TURN
-    player.save()
+        changes['spirit_specific_per_turn_flags'] = F('spirit_specific_per_turn_flags').bitor(GamePlayer.SPIRIT_SPECIFIC_DECREMENTED_THIS_TURN)
+    player.write(**changes)
 
     if player.spirit.name == 'Fractured':
         player.sync_time_discs_with_resource()
-        # Have to render the spirit panel to show the change in discs.
-        return render(request, 'player.html', {'player': player})
+        # Have to render the spirit board to show the change in discs.
+        return render_player_fragments(request, player, 'presence', 'resource')
 
-    return render(request, 'spirit_specific_resource.html', {'player': player})
+    return render_player_part(request, 'spirit_specific_resource.html', player)
 
 def gain_rot(request: HttpRequest, player_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
-    player.spirit_specific_resource += player.rot_gain()
-    player.spirit_specific_per_turn_flags |= GamePlayer.ROT_GAINED_THIS_TURN
-    player.save()
+    player = get_player(player_id)
+    player.write(
+        spirit_specific_resource=F('spirit_specific_resource') + player.rot_gain(),
+        spirit_specific_per_turn_flags=F('spirit_specific_per_turn_flags').bitor(GamePlayer.ROT_GAINED_THIS_TURN),
+    )
 
-    return render(request, 'spirit_specific_resource.html', {'player': player})
+    return render_player_part(request, 'spirit_specific_resource.html', player)
 
 def convert_rot(request: HttpRequest, player_id: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
-    # be sure to change energy before rot,
-    # because energy gain is based on rot.
-    player.gain_energy_or_pay_debt(player.energy_from_rot())
-    player.spirit_specific_resource -= player.rot_loss()
-    player.spirit_specific_per_turn_flags |= GamePlayer.ROT_CONVERTED_THIS_TURN
-    player.save()
+    player = get_player(player_id)
+    # both are based on the rot as loaded, so compute them before writing.
+    player.write(
+        **player.gain_energy_or_pay_debt_changes(player.energy_from_rot()),
+        spirit_specific_resource=F('spirit_specific_resource') - player.rot_loss(),
+        spirit_specific_per_turn_flags=F('spirit_specific_per_turn_flags').bitor(GamePlayer.ROT_CONVERTED_THIS_TURN),
+    )
 
-    return render(request, 'energy_and_spirit_resource.html', {'player': player})
+    return render_player_part(request, 'energy_and_spirit_resource.html', player)
 
 def toggle_presence(request: HttpRequest, player_id: int, left: int, top: int) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_player(player_id)
     presence = get_object_or_404(player.presence_set, left=left, top=top)
     presence.opacity = abs(1.0 - presence.opacity)
     presence.save()
@@ -1516,93 +1615,115 @@ def toggle_presence(request: HttpRequest, player_id: int, left: int, top: int) -
         # and reasoning why we do this.
         # You'd think we could just +/- 1 depending on the new opacity,
         # But we do have to handle the case where they had more Time than discs (10).
-        player.spirit_specific_resource = player.presence_set.filter(opacity=1.0, left__lte=Presence.FRACTURED_DAYS_TIME_X).count()
-        player.save(update_fields=['spirit_specific_resource'])
+        player.write(spirit_specific_resource=player.presence_set.filter(opacity=1.0, left__lte=Presence.FRACTURED_DAYS_TIME_X).count())
     if player.spirit.name == 'Covets' and left == 176 and top == (700 if player.aspect == 'v1.3' else 815):
         # the plant treasure was above the earth treasure in v1.3 but below it in v1.4, hence the different `top` value being checked
         if presence.opacity:
-            player.spirit_specific_per_turn_flags |= GamePlayer.PLANT_TREASURE_THIS_TURN
+            player.write(spirit_specific_per_turn_flags=F('spirit_specific_per_turn_flags').bitor(GamePlayer.PLANT_TREASURE_THIS_TURN))
         else:
-            player.spirit_specific_per_turn_flags &= ~GamePlayer.PLANT_TREASURE_THIS_TURN
-        player.save(update_fields=['spirit_specific_per_turn_flags'])
+            player.write(spirit_specific_per_turn_flags=F('spirit_specific_per_turn_flags').bitand(~GamePlayer.PLANT_TREASURE_THIS_TURN))
 
-    return render(request, 'player.html', {'player': player})
+    # Presence can reveal energy and elements; for Fractured it's also their Time,
+    # and for Covets the plant treasure enables a button to gain powers.
+    return render_player_fragments(request, player, 'presence', 'elements', 'energy', 'resource', 'selection')
 
 def add_element(request: HttpRequest, player_id: int, element: str) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
-    if element == 'sun': player.temporary_sun += 1
-    if element == 'moon': player.temporary_moon += 1
-    if element == 'fire': player.temporary_fire += 1
-    if element == 'air': player.temporary_air += 1
-    if element == 'water': player.temporary_water += 1
-    if element == 'earth': player.temporary_earth += 1
-    if element == 'plant': player.temporary_plant += 1
-    if element == 'animal': player.temporary_animal += 1
-    if element == 'moonfire': player.temporary_moon += 1
-    player.save()
-
-    return render(request, 'player.html', {'player': player})
+    player = get_player(player_id)
+    player.change_element('temporary_elements_packed', element, 1)
+
+    return render_player_fragments(request, player, 'elements')
 
 def remove_element(request: HttpRequest, player_id: int, element: str) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
-    if element == 'sun': player.temporary_sun -= 1
-    if element == 'moon': player.temporary_moon -= 1
-    if element == 'fire': player.temporary_fire -= 1
-    if element == 'air': player.temporary_air -= 1
-    if element == 'water': player.temporary_water -= 1
-    if element == 'earth': player.temporary_earth -= 1
-    if element == 'plant': player.temporary_plant -= 1
-    if element == 'animal': player.temporary_animal -= 1
-    if element == 'moonfire':
-        if player.temporary_moon > 0:
-            player.temporary_moon -= 1
-        elif player.temporary_fire > 0:
-            player.temporary_fire -= 1
-    player.save()
-
-    return render(request, 'player.html', {'player': player})
+    player = get_player(player_id)
+    player.change_element('temporary_elements_packed', element, -1)
+
+    return render_player_fragments(request, player, 'elements')
 
 def add_element_permanent(request: HttpRequest, player_id: int, element: str) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
-    if element == 'sun': player.permanent_sun += 1
-    if element == 'moon': player.permanent_moon += 1
-    if element == 'fire': player.permanent_fire += 1
-    if element == 'air': player.permanent_air += 1
-    if element == 'water': player.permanent_water += 1
-    if element == 'earth': player.permanent_earth += 1
-    if element == 'plant': player.permanent_plant += 1
-    if element == 'animal': player.permanent_animal += 1
-    if element == 'moonfire': player.permanent_moon += 1
-    player.save()
-
-    return render(request, 'player.html', {'player': player})
+    player = get_player(player_id)
+    player.change_element('permanent_elements_packed', element, 1)
 
-def remove_element_permanent(request: HttpRequest, player_id: int, element: str) -> HttpResponse:
-    player = get_object_or_404(GamePlayer, pk=player_id)
-    if element == 'sun': player.permanent_sun -= 1
-    if element == 'moon': player.permanent_moon -= 1
-    if element == 'fire': player.permanent_fire -= 1
-    if element == 'air': player.permanent_air -= 1
-    if element == 'water': player.permanent_water -= 1
-    if element == 'earth': player.permanent_earth -= 1
-    if element == 'plant': player.permanent_plant -= 1
-    if element == 'animal': player.permanent_animal -= 1
-    if element == 'moonfire':
-        if player.permanent_moon > 0:
-            player.permanent_moon -= 1
-        elif player.permanent_fire > 0:
-            player.permanent_fire -= 1
-    player.save()
-
-    return render(request, 'player.html', {'player': player})
+    return render_player_fragments(request, player, 'elements')
 
+def remove_element_permanent(request: HttpRequest, player_id: int, element: str) -> HttpResponse:
+    player = get_player(player_id)
+    player.change_element('permanent_elements_packed', element, -1)
+
+    return render_player_fragments(request, player, 'elements')
+
+# What player_actions can apply, by URL name (see island/urls.py):
+# actions that are often done several times in a row, and whose views just render the player (or part of it).
+BATCHED_ACTIONS = frozenset({
+    'change_energy', 'pay_energy', 'gain_energy',
+    'change_bargain_cost_per_turn', 'change_bargain_paid_this_turn',
+    'change_spirit_specific_resource', 'gain_rot', 'convert_rot',
+    'toggle_presence',
+    'add_element', 'remove_element', 'add_element_permanent', 'remove_element_permanent',
+    'play_card', 'unplay_card', 'discard_card', 'reclaim_card', 'reclaim_all',
+    'add_energy_to_impending', 'remove_energy_from_impending',
+})
+
+# Applies several actions to a player in one request and one transaction,
+# rendering the player once at the end rather than once per action.
+# The page queues these up and sends them together (see queueAction in game.html).
+#
+# actions (POST) is a JSON list of the actions in the order to apply them,
+# each the action's URL name followed by the URL's arguments after the player id,
+# e.g. [["change_energy", 1], ["toggle_presence", 453, 224], ["add_element", "fire"]].
+# If any action fails, none of them are applied.
+def player_actions(request: HttpRequest, player_id: int) -> HttpResponse:
+    try:
+        actions = json.loads(request.POST.get('actions', ''))
+        if not isinstance(actions, list):
+            raise ValueError
+        matches = []
+        for (name, *args) in actions:
+            if name not in BATCHED_ACTIONS:
+                return HttpResponseBadRequest(f'{name} cannot be sent to player_actions')
+            matches.append(resolve(reverse(name, args=[player_id, *args])))
+    except (ValueError, TypeError, NoReverseMatch):
+        return HttpResponseBadRequest('actions should be a JSON list of [action, arguments...]')
+
+    new_logs = False
+    with transaction.atomic(using=current_db()):
+        token = _render_deferred.set(True)
+        try:
+            for match in matches:
+                response: HttpResponse = match.func(request, *match.args, **match.kwargs)
+                if response.status_code >= 400:
+                    transaction.set_rollback(True, using=current_db())
+                    return response
+                new_logs = new_logs or 'HX-Trigger' in response
+        finally:
+            _render_deferred.reset(token)
+        response = render_player(request, get_player(player_id))
+    return with_log_trigger(response) if new_logs else response
+
+@read_only
+@cache_control(no_cache=True)
+@etag(tab_etag)
 def tab(request: HttpRequest, game_id: int, player_id: int) -> HttpResponse:
     game = get_object_or_404(Game, pk=game_id)
-    player = get_object_or_404(GamePlayer, pk=player_id)
+    player = get_object_or_404(GamePlayer.objects.select_related('spirit'), pk=player_id)
+    if player.game_id == game.id:
+        # no need to query for the same game again
+        player.game = game
+    player.prefetch_for_render()
     return render(request, 'tabs.html', {'game': game, 'player': player})
 
+# The log pane starts with the latest logs,
+# then asks for those after the last one it has whenever there are new ones (see logs.html).
+def latest_logs(game: Game) -> Iterable[GameLog]:
+    return reversed(game.gamelog_set.order_by('-id')[:30])
+
+@read_only
 def game_logs(request: HttpRequest, game_id: int) -> HttpResponse:
     game = get_object_or_404(Game, pk=game_id)
-    logs = reversed(game.gamelog_set.order_by('-date').all()[:30])
-    return render(request, 'logs.html', {'game': game, 'logs': logs})
+    if 'after' not in request.GET:
+        return render(request, 'logs.html', {'game': game, 'logs': latest_logs(game)})
+    try:
+        after = int(request.GET['after'])
+    except ValueError:
+        return HttpResponseBadRequest('after must be a log id')
+    return render(request, 'log_entries.html', {'logs': game.gamelog_set.filter(id__gt=after).order_by('id')})
 
@@ -0,0 +1,5 @@
+#!/bin/sh
+export PYTHONUNBUFFERED=TRUE
+PATH=/home/si/.local/bin:$PATH
+uv sync --no-dev --group redis
+exec uv run --no-dev --locked ./manage.py flushlogoutbox --forever
@@ -6,4 +6,5 @@ uv sync --no-dev --group redis
 uv run --no-dev --locked python --version
 uv run --no-dev --locked ./manage.py collectstatic --noinput
 uv run --no-dev --locked ./manage.py migrate
+uv run --no-dev --locked ./manage.py migrateshards
 exec uv run --no-dev --locked gunicorn --no-control-socket island.wsgi